@@ -1,68 +1,241 @@
 import asyncio
+import os
 import signal
-from typing import Dict, Optional, Set
+import time
+from typing import Dict, List, Optional, Set
 
 import chainlit as cl
 from temporalio.client import Client
+from temporalio.client import WorkflowFailureError
 from temporalio.exceptions import WorkflowAlreadyStartedError
+from temporalio.service import RPCError, RPCStatusCode
 from temporalio.worker import Worker
+from temporalio.api.enums.v1 import TaskQueueType
+from temporalio.api.taskqueue.v1 import TaskQueue
+from temporalio.api.workflowservice.v1 import DescribeTaskQueueRequest
 
 from common.temporal_client import get_temporal_client
-from common import get_redis  # must return a redis-py client
+from common import get_pubsub_redis, close_redis, get_redis_pool_metrics
 from pois.poi_models import ClientLiEvent
-from pois.workflow_poi_self_improving import SelfImprovingDestinationWorkflow
-from pois.temporal_pois_worker import get_pois_worker
+from pois.workflow_stubs import WORKFLOW_NAME, USER_REPLY_SIGNAL
+from pois.task_queues import WORKFLOW_TASK_QUEUE, LLM_TASK_QUEUE
 
 # ----------------------------
 # Globals
 # ----------------------------
 client: Optional[Client] = None
-worker: Optional[Worker] = None
+workers: List[Worker] = []
 worker_task: Optional[asyncio.Task] = None
 
 # Per-session pubsub listener tasks
 pubsub_tasks: Dict[str, asyncio.Task] = {}
 # Track active session IDs to clean up on exit
 active_sessions: Set[str] = set()
+shutdown_started = False
+
+# Bulk shutdown tuning: parallel terminations, overall deadline, and an optional
+# cancellation grace period before falling back to terminate
+SHUTDOWN_CONCURRENCY = int(os.getenv("SHUTDOWN_CONCURRENCY", "50"))
+SHUTDOWN_DEADLINE_SECONDS = float(os.getenv("SHUTDOWN_DEADLINE_SECONDS", "20"))
+SHUTDOWN_CANCEL_GRACE_SECONDS = float(os.getenv("SHUTDOWN_CANCEL_GRACE_SECONDS", "0"))
+
+# Run the Temporal workers inside the UI process (single process setup). Disable it when
+# workers run separately (python -m pois.temporal_pois_worker) so the UI never loads them.
+EMBEDDED_WORKER = os.getenv("POIS_EMBEDDED_WORKER", "true").lower() in ("1", "true", "yes")
+
+
+BUSY_MESSAGE = os.getenv(
+    "ADMISSION_BUSY_MESSAGE",
+    "Lorenzo is helping a lot of travelers right now. Please try again in a minute!",
+)
+IN_FLIGHT_MESSAGE = os.getenv(
+    "ADMISSION_IN_FLIGHT_MESSAGE",
+    "I'm still working on your previous message, I'll get back to you in a moment!",
+)
 
 
 def _channel(session_id: str) -> str:
     return f"chainlit:poi:events:{session_id}"
 
+
+class AdmissionController:
+    """
+    Per-node admission control for new sessions plus per-session message backpressure.
+
+    New sessions are rejected when the node already runs max_active_workflows, or when
+    the activity backlog of the watched task queues is above max_queue_backlog. Admitted
+    sessions keep being served, so overload only costs new users a fast "busy" reply.
+    A message stays in flight until its turn completes (the workflow's final event), or
+    for at most inflight_timeout_seconds if that event never arrives.
+    """
+
+    def __init__(
+        self,
+        max_active_workflows: int,
+        max_inflight_messages: int,
+        max_queue_backlog: int,
+        backlog_queues: List[str],
+        backlog_cache_seconds: float = 5.0,
+        inflight_timeout_seconds: float = 600.0,
+    ) -> None:
+        self.max_active_workflows = max_active_workflows
+        self.max_inflight_messages = max_inflight_messages
+        self.max_queue_backlog = max_queue_backlog
+        self.backlog_queues = backlog_queues
+        self.backlog_cache_seconds = backlog_cache_seconds
+        self.inflight_timeout_seconds = inflight_timeout_seconds
+        self._inflight: Dict[str, int] = {}
+        self._inflight_since: Dict[str, float] = {}
+        self._last_message: Dict[str, str] = {}
+        self._backlog = 0
+        self._backlog_checked_at = 0.0
+        self._backlog_lock = asyncio.Lock()
+
+    async def queue_backlog(self) -> int:
+        """
+        Approximate activity backlog over the watched queues, cached for a few seconds
+        so admission decisions don't add a Temporal round trip each.
+        """
+        async with self._backlog_lock:
+            if time.monotonic() - self._backlog_checked_at < self.backlog_cache_seconds:
+                return self._backlog
+            try:
+                client = await get_temporal_client()
+                backlog = 0
+                for queue in self.backlog_queues:
+                    resp = await client.workflow_service.describe_task_queue(
+                        DescribeTaskQueueRequest(
+                            namespace=client.namespace,
+                            task_queue=TaskQueue(name=queue),
+                            task_queue_type=TaskQueueType.TASK_QUEUE_TYPE_ACTIVITY,
+                            report_stats=True,
+                        )
+                    )
+                    backlog += resp.stats.approximate_backlog_count
+                self._backlog = backlog
+            except Exception as e:
+                # Keep the last known value, admission must not fail because stats did
+                print(f"[admission] Failed to read task queue backlog: {e}")
+            self._backlog_checked_at = time.monotonic()
+            return self._backlog
+
+    async def admit_session(self, session_id: str) -> bool:
+        """
+        Admits the session and reserves its slot in active_sessions. The slot is taken before
+        the first await, so concurrent chat starts can't all pass the check; callers give it
+        back with release_session when the workflow fails to start.
+        """
+        if session_id in active_sessions:
+            return True
+        if self.max_active_workflows and len(active_sessions) >= self.max_active_workflows:
+            return False
+        active_sessions.add(session_id)
+        if self.max_queue_backlog and await self.queue_backlog() >= self.max_queue_backlog:
+            active_sessions.discard(session_id)
+            return False
+        return True
+
+    def release_session(self, session_id: str) -> None:
+        active_sessions.discard(session_id)
+        self.forget(session_id)
+
+    def begin_message(self, session_id: str, content: str) -> Optional[str]:
+        """
+        Returns None when the message may be signalled, otherwise "duplicate" (a rapid
+        repeat of the in-flight message, to be dropped) or "busy".
+        """
+        inflight = self._inflight.get(session_id, 0)
+        if inflight and time.monotonic() - self._inflight_since.get(session_id, 0.0) > self.inflight_timeout_seconds:
+            # The turn never completed (lost event, failed workflow): don't keep the session busy
+            print(f"[admission] In-flight message of {session_id} timed out")
+            inflight = 0
+        if self.max_inflight_messages and inflight >= self.max_inflight_messages:
+            if self._last_message.get(session_id, "").strip() == content.strip():
+                return "duplicate"
+            return "busy"
+        self._inflight[session_id] = inflight + 1
+        self._inflight_since[session_id] = time.monotonic()
+        self._last_message[session_id] = content
+        return None
+
+    def end_message(self, session_id: str) -> None:
+        inflight = self._inflight.get(session_id, 0) - 1
+        if inflight > 0:
+            self._inflight[session_id] = inflight
+        else:
+            self._inflight.pop(session_id, None)
+            self._inflight_since.pop(session_id, None)
+
+    def forget(self, session_id: str) -> None:
+        self._inflight.pop(session_id, None)
+        self._inflight_since.pop(session_id, None)
+        self._last_message.pop(session_id, None)
+
+
+admission = AdmissionController(
+    max_active_workflows=int(os.getenv("ADMISSION_MAX_ACTIVE_WORKFLOWS", "200")),
+    max_inflight_messages=int(os.getenv("ADMISSION_MAX_INFLIGHT_MESSAGES", "1")),
+    max_queue_backlog=int(os.getenv("ADMISSION_MAX_QUEUE_BACKLOG", "100")),
+    backlog_queues=[q.strip() for q in os.getenv("ADMISSION_BACKLOG_QUEUES", LLM_TASK_QUEUE).split(",") if q.strip()],
+    backlog_cache_seconds=float(os.getenv("ADMISSION_BACKLOG_CACHE_SECONDS", "5")),
+    inflight_timeout_seconds=float(os.getenv("ADMISSION_INFLIGHT_TIMEOUT_SECONDS", "600")),
+)
+
 # ----------------------------
-async def consume_pubsub_events(session_id: str) -> None:
+async def consume_pubsub_events(session_id: str, subscribed: Optional[asyncio.Event] = None) -> None:
     """
-    Subscribe to session channel and forward events to Chainlit UI.
-    Uses blocking redis-py PubSub under cl.run_sync (thread) to avoid blocking the event loop.
+    Subscribe to session channel and forward events to Chainlit UI, for the whole session.
+    Uses the asyncio redis PubSub, so waiting for events never blocks the event loop.
+    Final events complete the user's turn and release its in-flight slot.
     """
-    redis = get_redis()
+    redis = get_pubsub_redis()
     channel = _channel(session_id)
 
     pubsub = redis.pubsub(ignore_subscribe_messages=True)
-    pubsub.subscribe(channel)
+    await pubsub.subscribe(channel)
+    if subscribed is not None:
+        subscribed.set()
+    # Message being filled by "stream" events, finalized by the next "message" event
+    streaming_msg: Optional[cl.Message] = None
 
     try:
         while True:
             try:
-                # redis-py pubsub.get_message is non-blocking by default; we can poll with timeout
-                msg =  pubsub.get_message()
+                # Waits up to the timeout for the next event instead of busy polling
+                msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
                 if not msg:
-                    await asyncio.sleep(0.05)
                     continue
 
                 # redis-py returns dict like: {"type": "message", "channel": b"...", "data": b"..."}
                 raw = msg.get("data")
-                print(f"got {raw}")
                 if isinstance(raw, bytes):
                     raw = raw.decode("utf-8")
 
                 event = ClientLiEvent.model_validate_json(raw)
+                if event.type not in ("stream_start", "stream"):
+                    print(f"got {raw}")
 
                 match event.type:
+                    case "stream_start" | "stream":
+                        # stream_start opens a fresh message, dropping partial output of a retried attempt
+                        if event.type == "stream_start" and streaming_msg is not None:
+                            await streaming_msg.remove()
+                            streaming_msg = None
+                        if streaming_msg is None:
+                            streaming_msg = cl.Message(content="", author="assistant")
+                        await streaming_msg.stream_token(event.content)
+                        continue
                     case "message":
-                        await cl.Message(content=str(event.content), author="assistant").send()
+                        if streaming_msg is not None:
+                            # The full text replaces the streamed one, they only differ if a chunk was lost
+                            streaming_msg.content = str(event.content)
+                            await streaming_msg.update()
+                            streaming_msg = None
+                        else:
+                            await cl.Message(content=str(event.content), author="assistant").send()
                         if event.is_final:
-                            break
+                            admission.end_message(session_id)
+                        continue
                     case "update":
                         # Use dynamic title if available, otherwise fallback to default
                         step_title = event.title if event.title else "Workflow Update"
@@ -86,37 +259,47 @@ async def consume_pubsub_events(session_id: str) -> None:
                             await cl.Message(content="", elements=[map_element], author="assistant").send()
                         
                         if event.is_final:
-                            break
+                            admission.end_message(session_id)
                         continue
                     case _:
-                        # unknown / stop
-                        break
+                        print(f"[pubsub] Unknown event type for {session_id}: {event.type}")
+                        continue
 
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 # TODO log
                 print(f"{e}")
+                # The next message starts a new listener; don't leave the turn in flight
+                admission.end_message(session_id)
                 break
     finally:
         try:
-            pubsub.unsubscribe(channel)
-            pubsub.close()
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
         except Exception:
             pass
 
 
-def start_pubsub_listener(session_id: str) -> None:
+async def start_pubsub_listener(session_id: str) -> asyncio.Task:
     """
-    Ensure one pubsub listener task per session, running in background.
+    Ensure one pubsub listener task per session, running in background, and wait until it
+    is subscribed: events published before the subscription would be lost.
     """
     global pubsub_tasks
     existing = pubsub_tasks.get(session_id)
-    if existing:
-        existing.cancel()
+    if existing and not existing.done():
+        return existing
 
-    task = asyncio.create_task(consume_pubsub_events(session_id))
+    subscribed = asyncio.Event()
+    task = asyncio.create_task(consume_pubsub_events(session_id, subscribed))
     pubsub_tasks[session_id] = task
+    task.add_done_callback(lambda t: pubsub_tasks.pop(session_id, None) if pubsub_tasks.get(session_id) is t else None)
+    try:
+        await asyncio.wait_for(subscribed.wait(), timeout=5)
+    except asyncio.TimeoutError:
+        print(f"[pubsub] Subscription for {session_id} not confirmed, continuing")
+    return task
 
 
 def stop_pubsub_listener(session_id: str) -> None:
@@ -127,59 +310,144 @@ def stop_pubsub_listener(session_id: str) -> None:
 
 
 async def start_or_replace_workflow(session_id: str) -> None:
-   
-    client = await get_temporal_client()
+    """
+    Starts the session's workflow in the slot reserved by admission; the slot is released
+    when the workflow can't be started.
+    """
     active_sessions.add(session_id)
-
     try:
-        await client.start_workflow(
-            SelfImprovingDestinationWorkflow.run,
-            session_id,
-            id=session_id,
-            task_queue="pois-self-improving-v2",
-        )
-    except WorkflowAlreadyStartedError:
-        handle = client.get_workflow_handle(session_id)
-        await handle.terminate(reason="Replace workflow run for same workflow id")
-        await client.start_workflow(
-            SelfImprovingDestinationWorkflow.run,
-            session_id,
-            id=session_id,
-            task_queue="pois-self-improving-v2",
-        )
+        client = await get_temporal_client()
+        try:
+            await client.start_workflow(
+                WORKFLOW_NAME,
+                session_id,
+                id=session_id,
+                task_queue=WORKFLOW_TASK_QUEUE,
+            )
+        except WorkflowAlreadyStartedError:
+            handle = client.get_workflow_handle(session_id)
+            await handle.terminate(reason="Replace workflow run for same workflow id")
+            await client.start_workflow(
+                WORKFLOW_NAME,
+                session_id,
+                id=session_id,
+                task_queue=WORKFLOW_TASK_QUEUE,
+            )
+    except BaseException:
+        admission.release_session(session_id)
+        raise
+
+
 
+async def _run_workers() -> None:
+    await asyncio.gather(*(w.run() for w in workers))
 
 
 async def on_init() -> None:
-    global  worker
-    if worker is not None:
+    global  workers, worker_task
+    if workers:
         return
-    client = await get_temporal_client()
-    worker =  get_pois_worker(client)
-    print("[startup] Temporal worker started")
-    asyncio.create_task(worker.run())
+    if EMBEDDED_WORKER:
+        # Imported here: the workflow and activity modules are only needed to host workers
+        from pois.temporal_pois_worker import get_pois_workers
+        from pois.workflow_travel_advisories import ensure_advisory_ingestion
+
+        client = await get_temporal_client()
+        # Hosts the activity classes listed in POIS_WORKER_CLASSES (all of them by default)
+        workers = get_pois_workers(client)
+        print(f"[startup] Temporal workers started for queues: {[w.task_queue for w in workers]}")
+        worker_task = asyncio.create_task(_run_workers())
+        await ensure_advisory_ingestion(client)
     
     # Register signals during initial startup
     register_signals()
     
 
 
+async def _close_workflow(client: Client, session_id: str, reason: str, grace_seconds: float) -> None:
+    """
+    Cancels the workflow and waits up to the grace period for it to close, then terminates it.
+    A zero grace period terminates right away.
+    """
+    handle = client.get_workflow_handle(session_id)
+    if grace_seconds > 0:
+        await handle.cancel()
+        try:
+            await asyncio.wait_for(handle.result(), timeout=grace_seconds)
+            return
+        except WorkflowFailureError:
+            # Closed as cancelled
+            return
+        except asyncio.TimeoutError:
+            pass
+    await handle.terminate(reason=reason)
+
+
+async def terminate_workflows(
+    session_ids: List[str],
+    reason: str,
+    concurrency: int = SHUTDOWN_CONCURRENCY,
+    deadline_seconds: float = SHUTDOWN_DEADLINE_SECONDS,
+    grace_seconds: float = SHUTDOWN_CANCEL_GRACE_SECONDS,
+) -> Dict[str, str]:
+    """
+    Closes many workflows concurrently, bounded by a semaphore and a global deadline.
+    Returns the failures as {session_id: error}; workflows already gone are not failures.
+    """
+    if not session_ids:
+        return {}
+
+    client = await get_temporal_client()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    failures: Dict[str, str] = {}
+
+    async def _close_one(session_id: str) -> None:
+        async with semaphore:
+            try:
+                await _close_workflow(client, session_id, reason, grace_seconds)
+            except RPCError as e:
+                if e.status != RPCStatusCode.NOT_FOUND:
+                    failures[session_id] = str(e)
+            except Exception as e:
+                failures[session_id] = str(e)
+
+    tasks = {session_id: asyncio.create_task(_close_one(session_id)) for session_id in session_ids}
+    _, pending = await asyncio.wait(tasks.values(), timeout=deadline_seconds)
+    for session_id, task in tasks.items():
+        if task in pending:
+            task.cancel()
+            failures[session_id] = f"deadline of {deadline_seconds}s exceeded"
+    await asyncio.gather(*pending, return_exceptions=True)
+    return failures
+
+
 async def shutdown():
     """Logic to terminate workflows on server exit."""
+    global shutdown_started, worker_task
+    if shutdown_started:
+        return
+    shutdown_started = True
     print("\n[shutdown] Interrupt received, cleaning up workflows...")
-    client = await get_temporal_client()
-
-    for session_id in list(active_sessions):
-        try:
-            handle = client.get_workflow_handle(session_id)
-            await handle.terminate(reason="Server process exiting/terminating")
-            print(f"[shutdown] Terminated workflow: {session_id}")
-        except Exception as e:
-            print(f"[shutdown] Failed to terminate {session_id}: {e}")
 
-    global worker_task
+    # Stop forwarding events first, listeners would only race the terminations
+    for session_id in list(pubsub_tasks):
+        stop_pubsub_listener(session_id)
+
+    session_ids = list(active_sessions)
+    active_sessions.clear()
+    failures = await terminate_workflows(session_ids, reason="Server process exiting/terminating")
+    print(f"[shutdown] Closed {len(session_ids) - len(failures)}/{len(session_ids)} workflows")
+    for session_id, error in failures.items():
+        print(f"[shutdown] Failed to terminate {session_id}: {error}")
+
+    if workers:
+        await asyncio.gather(*(w.shutdown() for w in workers), return_exceptions=True)
+        from pois.temporal_pois_worker import close_worker_resources
+        await close_worker_resources()
     if worker_task:
         worker_task.cancel()
+    print(f"[shutdown] Redis pool metrics: {get_redis_pool_metrics()}")
+    await close_redis()
     print("[shutdown] Cleanup complete.")
 
 
@@ -197,27 +465,57 @@ def register_signals():
 @cl.on_chat_start
 async def on_chat_start() -> None:
     session_id = cl.user_session.get("id")
+    if not await admission.admit_session(session_id):
+        # The workflow is started on a later message, once there is capacity
+        await cl.Message(content=BUSY_MESSAGE, author="assistant").send()
+        return
     await start_or_replace_workflow(session_id)
 
 
 @cl.on_message
 async def on_message(message: cl.Message) -> None:
     session_id = cl.user_session.get("id")
-    # signal the workflow
-    client = await get_temporal_client()
-    handle = client.get_workflow_handle(session_id)
-    await handle.signal(SelfImprovingDestinationWorkflow.user_reply, message.content)
-    await consume_pubsub_events(session_id)
+    if session_id not in active_sessions:
+        if not await admission.admit_session(session_id):
+            await cl.Message(content=BUSY_MESSAGE, author="assistant").send()
+            return
+        await start_or_replace_workflow(session_id)
+
+    match admission.begin_message(session_id, message.content):
+        case "duplicate":
+            return
+        case "busy":
+            await cl.Message(content=IN_FLIGHT_MESSAGE, author="assistant").send()
+            return
+
+    # The in-flight slot is released by the listener when the turn's final event arrives
+    try:
+        # Listening before signalling, so no event of this turn is missed. Tracked in
+        # pubsub_tasks so shutdown and chat end can cancel it
+        await start_pubsub_listener(session_id)
+        # signal the workflow
+        client = await get_temporal_client()
+        handle = client.get_workflow_handle(session_id)
+        await handle.signal(USER_REPLY_SIGNAL, message.content)
+    except asyncio.CancelledError:
+        admission.end_message(session_id)
+    except Exception:
+        admission.end_message(session_id)
+        raise
 
 @cl.on_stop
 async def on_stop():
     session_id = cl.user_session.get("id")
-    await start_or_replace_workflow(session_id)
+    if session_id in active_sessions:
+        # The stopped turn will never complete
+        admission.forget(session_id)
+        await start_or_replace_workflow(session_id)
 
 @cl.on_chat_end
 async def on_chat_end() -> None:
     session_id = cl.user_session.get("id")
     active_sessions.discard(session_id)
+    admission.forget(session_id)
     stop_pubsub_listener(session_id)
     
     # Terminate the workflow on chat end
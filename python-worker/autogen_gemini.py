@@ -1,107 +1,407 @@
-from typing import Optional, Tuple, Dict, TypeVar
+import asyncio
+import hashlib
+import json
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Optional, Set, Tuple, Dict, TypeVar
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from autogen_agentchat.agents import AssistantAgent
 from autogen_agentchat.messages import TextMessage
 from autogen_ext.models.openai import OpenAIChatCompletionClient
 from autogen_core.models import ModelInfo, ModelFamily
-import tiktoken
+import httpx
 import os
 
+from common.llm_limiter import limited_call
+from common.llm_usage import record_provider_usage, mark_first_token, tracked_call, model_pricing
+
 load_dotenv()
 
 
+# Model info for the OpenAI models that autogen doesn't know about (or that we use
+# with non default capabilities). Models missing here use autogen's built-in info.
+OPENAI_MODEL_INFO: Dict[str, ModelInfo] = {
+    "gpt-5.2": {
+        "vision": False,
+        "function_calling": True,
+        "json_output": True,
+        "structured_output": True,
+        "family": ModelFamily.GPT_5,
+    },
+    "gpt-4o-mini": {
+        "vision": False,
+        "function_calling": False,
+        "json_output": False,
+        "structured_output": False,
+        "family": ModelFamily.GPT_4,
+    },
+}
+
+# Gemini context cache: system prompts of at least this many (estimated) tokens are uploaded once
+# as a cachedContents entry that requests reference instead of resending the prompt
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Per-process shared clients, keyed by (provider, model)
+_model_clients: Dict[Tuple[str, str], OpenAIChatCompletionClient] = {}
+
+
 def _ensure_gemini_key() -> None:
     if not os.getenv("GEMINI_API_KEY"):
         raise RuntimeError("GEMINI_API_KEY .env var is required for Gemini.")
 
 
-async def run_single_agent(
-    name: str,
-    system_message: str,
-    task: str,
-    model: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b"),
-) -> Tuple[str, Dict[str, int]]:
-    """
-    Runs a single agent step, returns:
-        (output_text, usage_dict)
-
-    usage_dict = {
-        "prompt_tokens": int,
-        "completion_tokens": int,
-        "total_tokens": int
-    }
-    """
-    _ensure_gemini_key()
-
-    base_url = os.getenv(
+def _gemini_base_url() -> str:
+    return os.getenv(
         "GEMINI_BASE_URL",
         "https://generativelanguage.googleapis.com/v1beta/openai/",
     )
 
-    # Use any tiktoken encoding as an approximation – Autogen just
-    # needs *some* tokenizer to estimate usage.
-    tokenizer = tiktoken.get_encoding("cl100k_base")
 
-    model_info = ModelInfo(
+def default_gemini_model() -> str:
+    return os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b")
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    Loaded once per process. Any tiktoken encoding is fine as an approximation –
+    Autogen just needs *some* tokenizer to estimate usage.
+    """
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=None)
+def gemini_model_info(model: str) -> ModelInfo:
+    price = model_pricing(model) or {"input": 0.0, "output": 0.0}
+    return ModelInfo(
         name=model,
-        tokenizer=tokenizer,
+        tokenizer=get_tokenizer(),
         max_input_tokens=128_000,
         max_output_tokens=8192,
-        input_cost_per_1k_tokens=0.15,      # update with real Gemini pricing later
-        output_cost_per_1k_tokens=0.60,
-        vision=False,                        # REQUIRED NOW
+        input_cost_per_1k_tokens=price["input"] / 1000,  # common.llm_usage.PRICING is per 1M tokens
+        output_cost_per_1k_tokens=price["output"] / 1000,
+        vision=False,
         supports_system_message=True,
         supports_json_schema=True,
         function_calling=False,
         json_output=True,
         structured_output=True,
-        family=model,
+        family=model,  # or "gemini" if you prefer logical families
     )
 
-    client = OpenAIChatCompletionClient(
-        model=model,
-        api_key=os.environ["GEMINI_API_KEY"],
-        base_url=base_url,
-        model_info=model_info,
+
+def _explicit_prompt_cache_enabled() -> bool:
+    return os.getenv("LLM_EXPLICIT_PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
+
+
+def _is_chat_completion(request: httpx.Request) -> bool:
+    return request.method == "POST" and request.url.path.endswith("/chat/completions")
+
+
+def _with_body(request: httpx.Request, body: Dict) -> httpx.Request:
+    return httpx.Request(
+        request.method,
+        request.url,
+        headers=[(k, v) for k, v in request.headers.items() if k.lower() != "content-length"],
+        content=json.dumps(body).encode("utf-8"),
+        extensions=request.extensions,
     )
 
-    try:
-        agent = AssistantAgent(
-            name=name,
-            model_client=client,
-            system_message=system_message,
+
+def _static_system_prompt(body: Dict) -> Optional[str]:
+    messages = body.get("messages") or []
+    if messages and messages[0].get("role") in ("system", "developer"):
+        content = messages[0].get("content")
+        return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    return None
+
+
+class _PromptCacheKeyTransport(httpx.AsyncBaseTransport):
+    """
+    Adds an OpenAI `prompt_cache_key` derived from the system message to chat completion
+    requests, so calls sharing the same static instructions are routed to the same
+    prompt cache.
+    """
+
+    def __init__(self, wrapped: httpx.AsyncBaseTransport) -> None:
+        self._wrapped = wrapped
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if _is_chat_completion(request):
+            body = json.loads(request.content or b"{}")
+            prefix = _static_system_prompt(body)
+            if prefix is not None and "prompt_cache_key" not in body:
+                body["prompt_cache_key"] = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:32]
+                request = _with_body(request, body)
+        return await self._wrapped.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+
+class _GeminiContextCacheTransport(httpx.AsyncBaseTransport):
+    """
+    Gemini counterpart of the prompt cache key. A system prompt long enough for Gemini's
+    context cache is uploaded once per (model, prompt) as a cachedContents entry, and chat
+    completions reference the entry instead of resending the prompt, billed at the cached
+    input rate. Prompts the API refuses to cache (too short for the model, unsupported model)
+    are remembered and sent as is; a request whose entry was dropped server side is resent
+    without it.
+    """
+
+    def __init__(self, wrapped: httpx.AsyncBaseTransport) -> None:
+        self._wrapped = wrapped
+        # prompt key -> (cachedContents name, local expiry)
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._refused: Set[str] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _native_url(path: str) -> str:
+        base = _gemini_base_url().rstrip("/")
+        if base.endswith("/openai"):
+            base = base[: -len("/openai")]
+        return f"{base}/{path}"
+
+    async def _create_entry(self, model: str, system_prompt: str) -> Optional[str]:
+        request = httpx.Request(
+            "POST",
+            self._native_url("cachedContents"),
+            headers={"x-goog-api-key": os.environ.get("GEMINI_API_KEY", "")},
+            json={
+                "model": f"models/{model}",
+                "systemInstruction": {"parts": [{"text": system_prompt}]},
+                "ttl": f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
+            },
         )
+        response = await self._wrapped.handle_async_request(request)
+        content = await response.aread()
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(content.decode("utf-8", "replace")[:300], request=request, response=response)
+        return json.loads(content)["name"]
+
+    async def _cached_content(self, model: str, system_prompt: str) -> Optional[str]:
+        key = hashlib.sha256(f"{model}\n{system_prompt}".encode("utf-8")).hexdigest()
+        if key in self._refused:
+            return None
+        entry = self._entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            try:
+                name = await self._create_entry(model, system_prompt)
+            except httpx.HTTPStatusError as e:
+                if 400 <= e.response.status_code < 500:
+                    self._refused.add(key)
+                print(f"[llm] Gemini context cache refused for {model}: {e}")
+                return None
+            except httpx.HTTPError as e:
+                print(f"[llm] Gemini context cache unavailable for {model}: {e!r}")
+                return None
+            # Renewed a minute before the server drops it
+            self._entries[key] = (name, time.monotonic() + GEMINI_CONTEXT_CACHE_TTL_SECONDS - 60)
+            return name
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not _is_chat_completion(request):
+            return await self._wrapped.handle_async_request(request)
+        body = json.loads(request.content or b"{}")
+        system_prompt = _static_system_prompt(body)
+        # Cached contents carry their own tools; requests with tools keep the inline prompt.
+        # ~4 characters per token is close enough to skip prompts below the API's minimum
+        if (
+            system_prompt is None
+            or body.get("tools")
+            or len(body.get("messages") or []) < 2
+            or len(system_prompt) // 4 < GEMINI_CONTEXT_CACHE_MIN_TOKENS
+        ):
+            return await self._wrapped.handle_async_request(request)
+        name = await self._cached_content(body.get("model", ""), system_prompt)
+        if name is None:
+            return await self._wrapped.handle_async_request(request)
+
+        cached_body = {
+            **body,
+            "messages": body["messages"][1:],
+            "extra_body": {"google": {"cached_content": name}},
+        }
+        response = await self._wrapped.handle_async_request(_with_body(request, cached_body))
+        if response.status_code in (400, 403, 404):
+            await response.aclose()
+            self._entries = {k: v for k, v in self._entries.items() if v[0] != name}
+            return await self._wrapped.handle_async_request(request)
+        return response
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+
+class _UsageRecordingStream(httpx.AsyncByteStream):
+    """
+    Passes a streamed completion through, recording the usage reported by its final chunk.
+    """
+
+    def __init__(self, wrapped: httpx.AsyncByteStream) -> None:
+        self._wrapped = wrapped
+        self._buffer = b""
+
+    def _scan(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:") or line == b"data: [DONE]":
+                continue
+            mark_first_token()
+            if b'"usage"' not in line:
+                continue
+            try:
+                data = json.loads(line[len(b"data:"):])
+            except ValueError:
+                continue
+            if data.get("usage"):
+                record_provider_usage(data.get("model"), data["usage"])
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._wrapped:
+            try:
+                self._scan(chunk)
+            except Exception as e:
+                print(f"[llm] Failed to record streamed usage: {e}")
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
 
-        result = await agent.run(task=task)  # type: ignore
 
-        final_msg: Optional[TextMessage] = None
-        for msg in result.messages:  # type: ignore[attr-defined]
-            if isinstance(msg, TextMessage):
-                final_msg = msg
+class _StreamUsageTransport(httpx.AsyncBaseTransport):
+    """
+    Asks streamed chat completions to report usage in their final chunk and records it,
+    so streamed calls count prompt and cached tokens like non-streaming ones.
+    """
+
+    def __init__(self, wrapped: httpx.AsyncBaseTransport) -> None:
+        self._wrapped = wrapped
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not _is_chat_completion(request):
+            return await self._wrapped.handle_async_request(request)
+        body = json.loads(request.content or b"{}")
+        if body.get("stream") and "stream_options" not in body:
+            request = _with_body(request, {**body, "stream_options": {"include_usage": True}})
+        response = await self._wrapped.handle_async_request(request)
+        if response.status_code == 200 and "text/event-stream" in response.headers.get("content-type", ""):
+            return httpx.Response(
+                status_code=response.status_code,
+                headers=response.headers,
+                stream=_UsageRecordingStream(response.stream),
+                extensions=response.extensions,
+                request=request,
+            )
+        return response
+
+    async def aclose(self) -> None:
+        await self._wrapped.aclose()
+
+
+async def _record_usage_hook(response: httpx.Response) -> None:
+    """
+    Records provider usage (including cached prompt tokens) of non-streaming completions,
+    streamed ones are recorded by `_StreamUsageTransport`.
+    Runs once the response headers arrive, which is the first token time of a non-streaming call.
+    """
+    if not _is_chat_completion(response.request) or response.status_code != 200:
+        return
+    if "text/event-stream" in response.headers.get("content-type", ""):
+        return
+    mark_first_token()
+    try:
+        await response.aread()
+        data = response.json()
+        if data.get("usage"):
+            record_provider_usage(data.get("model"), data["usage"])
+    except Exception as e:
+        print(f"[llm] Failed to record usage: {e}")
+
+
+def _keep_alive_http_client(provider: str = "gemini") -> httpx.AsyncClient:
+    """
+    HTTP client with a keep-alive pool, so consecutive calls reuse TLS connections.
+    """
+    transport: httpx.AsyncBaseTransport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60")),
+        ),
+    )
+    if _explicit_prompt_cache_enabled():
+        transport = _PromptCacheKeyTransport(transport) if provider == "openai" else _GeminiContextCacheTransport(transport)
+    transport = _StreamUsageTransport(transport)
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(float(os.getenv("LLM_HTTP_TIMEOUT", "120")), connect=10.0),
+        event_hooks={"response": [_record_usage_hook]},
+    )
+
 
-        if not final_msg:
-            raise RuntimeError(f"{name} produced no TextMessage output.")
+async def run_single_agent(
+    name: str,
+    system_message: str,
+    task: str,
+    model: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b"),
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Runs a single agent step, returns:
+        (output_text, usage_dict)
 
-        text = final_msg.content
-        if not isinstance(text, str):
-            raise RuntimeError(f"{name} returned non-str content: {type(text)}")
-        text = text.strip()
+    usage_dict = {
+        "prompt_tokens": int,
+        "completion_tokens": int,
+        "total_tokens": int
+    }
+    """
+    client = get_model_client("gemini", model)
+
+    agent = AssistantAgent(
+        name=name,
+        model_client=client,
+        system_message=system_message,
+    )
 
-        usage_dict: Dict[str, int] = {}
-        if final_msg.models_usage:
-            pt = final_msg.models_usage.prompt_tokens or 0
-            ct = final_msg.models_usage.completion_tokens or 0
-            usage_dict = {
-                "prompt_tokens": pt,
-                "completion_tokens": ct,
-                "total_tokens": pt + ct,
-            }
+    route = ("gemini", model)
+    result = await limited_call(route, lambda: tracked_call(name, route, lambda: agent.run(task=task)))  # type: ignore
 
-        return text, usage_dict
+    final_msg: Optional[TextMessage] = None
+    for msg in result.messages:  # type: ignore[attr-defined]
+        if isinstance(msg, TextMessage):
+            final_msg = msg
 
-    finally:
-        await client.close()
+    if not final_msg:
+        raise RuntimeError(f"{name} produced no TextMessage output.")
+
+    text = final_msg.content
+    if not isinstance(text, str):
+        raise RuntimeError(f"{name} returned non-str content: {type(text)}")
+    text = text.strip()
+
+    usage_dict: Dict[str, int] = {}
+    if final_msg.models_usage:
+        pt = final_msg.models_usage.prompt_tokens or 0
+        ct = final_msg.models_usage.completion_tokens or 0
+        usage_dict = {
+            "prompt_tokens": pt,
+            "completion_tokens": ct,
+            "total_tokens": pt + ct,
+        }
+
+    return text, usage_dict
 
 
 
@@ -113,41 +413,64 @@ def create_gemini_model_client(
     the OpenAI-compatible endpoint.
 
     You are responsible for closing the client with `await client.close()`
-    when done.
+    when done. Prefer `get_model_client`, which shares one client per model.
     """
     _ensure_gemini_key()
 
-    model = model or os.getenv("GEMINI_MODEL", "gemini-1.5-flash-8b")
+    model = model or default_gemini_model()
 
-    base_url = os.getenv(
-        "GEMINI_BASE_URL",
-        "https://generativelanguage.googleapis.com/v1beta/openai/",
+    client = OpenAIChatCompletionClient(
+        model=model,
+        api_key=os.environ["GEMINI_API_KEY"],
+        base_url=_gemini_base_url(),
+        model_info=gemini_model_info(model),
+        http_client=_keep_alive_http_client(),
     )
+    return client
 
-    # Any tiktoken encoding is fine as an approximation for usage tracking
-    tokenizer = tiktoken.get_encoding("cl100k_base")
 
-    model_info = ModelInfo(
-        name=model,
-        tokenizer=tokenizer,
-        max_input_tokens=128_000,
-        max_output_tokens=8192,
-        input_cost_per_1k_tokens=0.15,   # TODO: tune with real Gemini pricing
-        output_cost_per_1k_tokens=0.60,  # TODO: tune with real Gemini pricing
-        vision=False,
-        supports_system_message=True,
-        supports_json_schema=True,
-        function_calling=False,
-        json_output=True,
-        structured_output=True,
-        family=model,  # or "gemini" if you prefer logical families
-    )
-
-    client = OpenAIChatCompletionClient(
+def create_openai_model_client(model: str) -> OpenAIChatCompletionClient:
+    """
+    Create an OpenAIChatCompletionClient for the OpenAI API. Same ownership rules
+    as `create_gemini_model_client`.
+    """
+    kwargs = {}
+    if model in OPENAI_MODEL_INFO:
+        kwargs["model_info"] = OPENAI_MODEL_INFO[model]
+    return OpenAIChatCompletionClient(
         model=model,
-        api_key=os.environ["GEMINI_API_KEY"],
-        base_url=base_url,
-        model_info=model_info,
+        api_key=os.environ["OPEN_AI_API_KEY"],  # note: .env var name
+        http_client=_keep_alive_http_client("openai"),
+        **kwargs,
     )
+
+
+def get_model_client(
+    provider: str = "gemini",
+    model: Optional[str] = None,
+) -> OpenAIChatCompletionClient:
+    """
+    Returns the per-process shared client for (provider, model), creating it on first use.
+    Shared clients keep their connection pool alive between calls; do NOT close them,
+    `close_model_clients` does it when the worker shuts down.
+    """
+    if provider == "gemini":
+        model = model or default_gemini_model()
+    elif provider != "openai" or not model:
+        raise ValueError(f"Unsupported model client {provider}:{model}")
+
+    key = (provider, model)
+    client = _model_clients.get(key)
+    if client is None:
+        if provider == "gemini":
+            client = create_gemini_model_client(model)
+        else:
+            client = create_openai_model_client(model)
+        _model_clients[key] = client
     return client
 
+
+async def close_model_clients() -> None:
+    clients = list(_model_clients.values())
+    _model_clients.clear()
+    await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
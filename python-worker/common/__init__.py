@@ -1,19 +1,11 @@
-import os
-import redis
-from functools import lru_cache
+from common.get_redis import get_redis, get_pubsub_redis, publish, publish_many, publish_batched, close_redis, get_redis_pool_metrics
 
-@lru_cache(maxsize=1)
-def get_redis():
-    """
-    Returns a singleton Redis connection per process.
-    Safe for Temporal workers which may spawn multiple processes.
-    """
-    host = os.getenv("REDIS_HOST", "localhost")
-    port = int(os.getenv("REDIS_PORT", "6379"))
-
-    return redis.Redis(
-        host=host,
-        port=port,
-        db=0,
-        decode_responses=True,   # return strings not bytes
-    )
\ No newline at end of file
+__all__ = [
+    "get_redis",
+    "get_pubsub_redis",
+    "publish",
+    "publish_many",
+    "publish_batched",
+    "close_redis",
+    "get_redis_pool_metrics",
+]
@@ -1,22 +1,161 @@
+import asyncio
 import os
-import redis
+import time
+from dataclasses import dataclass, asdict
 from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis.asyncio as redis
 from dotenv import load_dotenv
 
 load_dotenv()
 
-@lru_cache(maxsize=1)
-def get_redis():
+
+@dataclass
+class RedisPoolMetrics:
+    """
+    Connection checkout stats for the shared pool, in seconds.
+    """
+    checkouts: int = 0
+    timeouts: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def record(self, wait_seconds: float) -> None:
+        self.checkouts += 1
+        self.total_wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        data = asdict(self)
+        data["avg_wait_seconds"] = self.total_wait_seconds / self.checkouts if self.checkouts else 0.0
+        return data
+
+
+_pool_metrics = RedisPoolMetrics()
+
+
+class _MeteredBlockingConnectionPool(redis.BlockingConnectionPool):
     """
-    Returns a singleton Redis connection per process.
-    Safe for Temporal workers which may spawn multiple processes.
+    Bounded pool that records how long callers wait for a free connection.
     """
-    host = os.getenv("REDIS_HOST", "localhost")
-    port = int(os.getenv("REDIS_PORT", "6379"))
 
-    return redis.Redis(
-        host=host,
-        port=port,
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            # BlockingConnectionPool raises ConnectionError when `timeout` elapses
+            _pool_metrics.timeouts += 1
+            raise
+        finally:
+            _pool_metrics.record(time.perf_counter() - start)
+
+
+def _connection_kwargs() -> Dict:
+    return dict(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
         db=0,
         decode_responses=True,   # return strings not bytes
-    )
\ No newline at end of file
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "2")),
+        health_check_interval=30,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> redis.Redis:
+    """
+    Returns a singleton asyncio Redis client per process, backed by a bounded
+    connection pool (REDIS_MAX_CONNECTIONS). Callers wait at most
+    REDIS_POOL_TIMEOUT seconds for a free connection.
+    """
+    pool = _MeteredBlockingConnectionPool(
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "2")),
+        **_connection_kwargs(),
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+@lru_cache(maxsize=1)
+def get_pubsub_redis() -> redis.Redis:
+    """
+    Client for long-lived subscriptions. Each PubSub holds its connection for the
+    whole session, so subscribers get their own pool and never starve publishers.
+    """
+    return redis.Redis(socket_keepalive=True, **{**_connection_kwargs(), "socket_timeout": None})
+
+
+def get_redis_pool_metrics() -> Dict[str, float]:
+    return {**_pool_metrics.as_dict(), **{f"batched_{k}": v for k, v in _batch_counters.items()}}
+
+
+async def publish(channel: str, message: str) -> int:
+    return await get_redis().publish(channel, message)
+
+
+# Messages published during the same event loop iteration, flushed together
+_pending: List[Tuple[str, str, "asyncio.Future[None]"]] = []
+_flush_task: Optional["asyncio.Task[None]"] = None
+_batch_counters = {"messages": 0, "round_trips": 0}
+
+
+async def _flush_pending() -> None:
+    global _flush_task
+    # Let the other publishers of this loop iteration queue their messages first
+    await asyncio.sleep(0)
+    batch = _pending[:]
+    _pending.clear()
+    _flush_task = None
+    _batch_counters["messages"] += len(batch)
+    _batch_counters["round_trips"] += 1
+    try:
+        await publish_many((channel, message) for channel, message, _ in batch)
+    except Exception as e:
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for _, _, future in batch:
+        if not future.done():
+            future.set_result(None)
+
+
+async def publish_batched(channel: str, message: str) -> None:
+    """
+    Publishes like `publish`, but messages from concurrent callers (UI events and token
+    streams of many sessions) share one pipelined round trip.
+    """
+    global _flush_task
+    future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+    _pending.append((channel, message, future))
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_pending())
+    await future
+
+
+async def publish_many(messages: Iterable[Tuple[str, str]]) -> None:
+    """
+    Publishes a burst of (channel, message) pairs in a single round trip.
+    """
+    messages = list(messages)
+    if not messages:
+        return
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for channel, message in messages:
+            pipe.publish(channel, message)
+        await pipe.execute()
+
+
+async def close_redis() -> None:
+    """
+    Closes both pools, meant for process shutdown.
+    """
+    for factory in (get_redis, get_pubsub_redis):
+        if factory.cache_info().currsize:
+            client = factory()
+            await client.aclose()
+            await client.connection_pool.disconnect()
+            factory.cache_clear()
@@ -0,0 +1,63 @@
+"""
+Import-time profile of the modules a process loads at startup.
+
+    python -m common.import_profile pois.workflow_stubs pois.poi_models common --max-ms 1500
+
+Runs `python -X importtime` in a fresh interpreter, prints the slowest imports by
+cumulative time and exits non-zero when the total is above --max-ms, so a heavy import
+sneaking into the UI process shows up as a failing check.
+"""
+import argparse
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def profile_imports(modules: List[str]) -> List[Tuple[str, int, int, int]]:
+    """
+    Returns (module, depth, self_us, cumulative_us) for every module imported by `modules`.
+    """
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {modules} failed:\n{proc.stderr[-2000:]}")
+
+    rows: List[Tuple[str, int, int, int]] = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="+")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    rows = profile_imports(args.modules)
+    # Top-level entries already include everything they imported
+    total_ms = sum(cumulative_us for _, depth, _, cumulative_us in rows if depth == 0) / 1000
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, _, self_us, cumulative_us in sorted(rows, key=lambda r: r[3], reverse=True)[: args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {name}")
+    print(f"\nTotal import time for {args.modules}: {total_ms:.0f} ms")
+
+    if args.max_ms is not None and total_ms > args.max_ms:
+        print(f"Import time above budget of {args.max_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
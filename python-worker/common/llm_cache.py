@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+from common.get_redis import get_redis
+from common.model_router import answered_route
+
+T = TypeVar("T")
+
+# Default TTL (seconds) per agent; override with LLM_CACHE_TTL_<AGENT_NAME>=seconds.
+# Agents missing here are never cached.
+DEFAULT_TTLS: Dict[str, int] = {
+    "propose_poi_query": 6 * 3600,
+    "generate_update_title": 7 * 24 * 3600,
+    "summarize_poi_results": 24 * 3600,
+    "poi_blurb": 30 * 24 * 3600,
+}
+
+_KEY_PREFIX = "llm_cache:v1"
+
+
+def cache_key(
+    model: str,
+    system_prompt: str,
+    input_message: str,
+    output_schema: Optional[Type[BaseModel]] = None,
+) -> str:
+    """
+    Content address of a model call: any change to the model, prompt, input or
+    expected output shape produces a different key.
+    """
+    payload = json.dumps(
+        {
+            "model": model,
+            "system": system_prompt,
+            "input": input_message,
+            "schema": output_schema.model_json_schema() if output_schema else None,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two tier response cache: a per-process LRU in front of a shared Redis tier.
+    Redis errors degrade to a miss, the cache must never fail a model call.
+    """
+
+    def __init__(self, max_memory_entries: int = 1024) -> None:
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._metrics: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"memory_hits": 0, "redis_hits": 0, "misses": 0, "bypassed": 0, "fallbacks": 0, "errors": 0}
+        )
+
+    @staticmethod
+    def ttl_for(agent: str) -> int:
+        return int(os.getenv(f"LLM_CACHE_TTL_{agent.upper()}", str(DEFAULT_TTLS.get(agent, 0))))
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, ttl: int) -> None:
+        self._memory[key] = (time.time() + ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, agent: str, key: str) -> Optional[str]:
+        value = self._memory_get(key)
+        if value is not None:
+            self._metrics[agent]["memory_hits"] += 1
+            return value
+        try:
+            redis_key = f"{_KEY_PREFIX}:{agent}:{key}"
+            value = await get_redis().get(redis_key)
+            if value is not None:
+                ttl = await get_redis().ttl(redis_key)
+                self._memory_set(key, value, ttl if ttl and ttl > 0 else self.ttl_for(agent))
+                self._metrics[agent]["redis_hits"] += 1
+                return value
+        except Exception as e:
+            self._metrics[agent]["errors"] += 1
+            print(f"[llm_cache] Redis read failed for {agent}: {e}")
+        self._metrics[agent]["misses"] += 1
+        return None
+
+    async def set(self, agent: str, key: str, value: str, ttl: int) -> None:
+        self._memory_set(key, value, ttl)
+        try:
+            await get_redis().set(f"{_KEY_PREFIX}:{agent}:{key}", value, ex=ttl)
+        except Exception as e:
+            self._metrics[agent]["errors"] += 1
+            print(f"[llm_cache] Redis write failed for {agent}: {e}")
+
+    async def get_many(self, agent: str, keys: List[str]) -> Dict[str, str]:
+        """
+        Batched `get`: memory tier first, then one MGET for the remaining keys.
+        Returns only the keys that were found.
+        """
+        found: Dict[str, str] = {}
+        missing: List[str] = []
+        for key in keys:
+            value = self._memory_get(key)
+            if value is not None:
+                found[key] = value
+                self._metrics[agent]["memory_hits"] += 1
+            else:
+                missing.append(key)
+        if missing:
+            try:
+                values = await get_redis().mget([f"{_KEY_PREFIX}:{agent}:{key}" for key in missing])
+                for key, value in zip(missing, values):
+                    if value is not None:
+                        found[key] = value
+                        self._memory_set(key, value, self.ttl_for(agent))
+                        self._metrics[agent]["redis_hits"] += 1
+            except Exception as e:
+                self._metrics[agent]["errors"] += 1
+                print(f"[llm_cache] Redis read failed for {agent}: {e}")
+        self._metrics[agent]["misses"] += len(keys) - len(found)
+        return found
+
+    async def set_many(self, agent: str, values: Dict[str, str], ttl: int) -> None:
+        if not values:
+            return
+        for key, value in values.items():
+            self._memory_set(key, value, ttl)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                for key, value in values.items():
+                    pipe.set(f"{_KEY_PREFIX}:{agent}:{key}", value, ex=ttl)
+                await pipe.execute()
+        except Exception as e:
+            self._metrics[agent]["errors"] += 1
+            print(f"[llm_cache] Redis write failed for {agent}: {e}")
+
+    def record_bypass(self, agent: str) -> None:
+        self._metrics[agent]["bypassed"] += 1
+
+    def record_fallback(self, agent: str) -> None:
+        self._metrics[agent]["fallbacks"] += 1
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per agent counters plus hit rate over cacheable lookups.
+        """
+        out: Dict[str, Dict[str, Any]] = {}
+        for agent, counters in self._metrics.items():
+            hits = counters["memory_hits"] + counters["redis_hits"]
+            lookups = hits + counters["misses"]
+            out[agent] = {**counters, "hit_rate": hits / lookups if lookups else 0.0}
+        return out
+
+
+_cache = LLMResponseCache(max_memory_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")))
+
+
+def get_llm_cache_metrics() -> Dict[str, Dict[str, Any]]:
+    return _cache.metrics()
+
+
+def llm_cache_enabled() -> bool:
+    return os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+async def get_cached_values(agent: str, keys: List[str]) -> Dict[str, str]:
+    """
+    Looks up caller-keyed entries (e.g. per-POI blurbs) in the response cache.
+    """
+    if not keys or not llm_cache_enabled() or _cache.ttl_for(agent) <= 0:
+        return {}
+    return await _cache.get_many(agent, keys)
+
+
+async def set_cached_values(agent: str, values: Dict[str, str]) -> None:
+    ttl = _cache.ttl_for(agent)
+    if llm_cache_enabled() and ttl > 0:
+        await _cache.set_many(agent, values, ttl)
+
+
+async def cached_llm_call(
+    agent: str,
+    model: str,
+    system_prompt: str,
+    input_message: str,
+    compute: Callable[[], Awaitable[T]],
+    output_type: Optional[Type[BaseModel]] = None,
+    use_cache: bool = True,
+) -> T:
+    """
+    Returns the cached response for this exact call, or runs `compute` and caches
+    its result. Results are either `str` or an instance of `output_type`.
+    `model` is the model the key is computed for (the agent's primary route); when `compute`
+    went through the model router and another model answered (hedge or fallback), the result
+    is returned but not cached, so the key never serves a different model's output.
+    """
+    ttl = _cache.ttl_for(agent)
+    if not (use_cache and llm_cache_enabled() and ttl > 0):
+        _cache.record_bypass(agent)
+        return await compute()
+
+    key = cache_key(model, system_prompt, input_message, output_type)
+    cached = await _cache.get(agent, key)
+    if cached is not None:
+        return output_type.model_validate_json(cached) if output_type else cached
+
+    result = await compute()
+    served = answered_route()
+    if served is not None and served[1] != model:
+        _cache.record_fallback(agent)
+        return result
+    if isinstance(result, BaseModel):
+        await _cache.set(agent, key, result.model_dump_json(), ttl)
+    elif isinstance(result, str) and result.strip():
+        await _cache.set(agent, key, result, ttl)
+    return result
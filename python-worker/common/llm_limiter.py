@@ -0,0 +1,281 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple, TypeVar
+
+from common.get_redis import get_redis
+
+T = TypeVar("T")
+
+LIMITER_ENABLED = os.getenv("LLM_LIMITER_ENABLED", "true").lower() in ("1", "true", "yes")
+LIMITER_INITIAL = float(os.getenv("LLM_LIMITER_INITIAL", "8"))
+LIMITER_MIN = float(os.getenv("LLM_LIMITER_MIN", "1"))
+LIMITER_MAX = float(os.getenv("LLM_LIMITER_MAX", "64"))
+# Additive increase per window of successful calls, multiplicative decrease on throttling
+LIMITER_INCREASE = float(os.getenv("LLM_LIMITER_INCREASE", "1"))
+LIMITER_DECREASE = float(os.getenv("LLM_LIMITER_DECREASE", "0.5"))
+# Failures of calls already in flight when the limit was cut don't cut it again
+LIMITER_DECREASE_COOLDOWN = float(os.getenv("LLM_LIMITER_DECREASE_COOLDOWN_SECONDS", "5"))
+# Optional cross-process coordination: a shared limit and a lease set per (provider, model)
+LIMITER_REDIS = os.getenv("LLM_LIMITER_REDIS", "false").lower() in ("1", "true", "yes")
+LIMITER_LEASE_SECONDS = float(os.getenv("LLM_LIMITER_LEASE_SECONDS", "300"))
+# A process raises the shared limit at most this often, by at most LIMITER_INCREASE per raise
+LIMITER_SHARED_INCREASE_INTERVAL = float(os.getenv("LLM_LIMITER_SHARED_INCREASE_INTERVAL_SECONDS", "10"))
+
+_KEY_PREFIX = "llm_limiter:v1"
+
+# Atomically drops expired leases and takes one if the shared limit allows it
+_ACQUIRE_LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('GET', KEYS[2]) or ARGV[4])
+if redis.call('ZCARD', KEYS[1]) < math.floor(limit) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])))
+    return 1
+end
+return 0
+"""
+
+# Atomically folds one process' limit into the shared one: decreases take the minimum,
+# increases move up by at most one step and never past the proposing process' own limit
+_UPDATE_LIMIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or ARGV[5])
+local proposed = tonumber(ARGV[1])
+local new = current
+if ARGV[2] == 'decrease' then
+    new = math.min(current, proposed)
+elseif proposed > current then
+    new = math.min(proposed, current + tonumber(ARGV[3]), tonumber(ARGV[4]))
+end
+redis.call('SET', KEYS[1], new, 'EX', 3600)
+return tostring(new)
+"""
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """
+    429s, overloaded providers and timeouts: the signals that we are sending too much.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    if getattr(error, "status_code", None) in (429, 503, 529):
+        return True
+    return type(error).__name__ in ("RateLimitError", "APITimeoutError", "TimeoutException", "ReadTimeout", "ConnectTimeout")
+
+
+class AIMDLimiter:
+    """
+    Concurrency limiter for one (provider, model): the allowed in-flight calls grow by
+    LIMITER_INCREASE per limit-sized window of successes and are multiplied by
+    LIMITER_DECREASE on a throttling error. Callers beyond the limit wait in FIFO order.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.limit = LIMITER_INITIAL
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self._last_shared_increase = 0.0
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._counters = {"calls": 0, "queued": 0, "throttled": 0, "errors": 0}
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def acquire(self) -> Optional[str]:
+        """
+        Waits for a slot, returns the Redis lease id when LLM_LIMITER_REDIS is on.
+        """
+        started = time.monotonic()
+        self._counters["calls"] += 1
+        if self.in_flight >= int(self.limit) or self._waiters:
+            self._counters["queued"] += 1
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # The slot was handed over to us right before the cancellation
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        else:
+            self.in_flight += 1
+
+        lease_id = None
+        if LIMITER_REDIS:
+            try:
+                lease_id = await self._acquire_lease()
+            except asyncio.CancelledError:
+                self.in_flight -= 1
+                self._wake()
+                raise
+            except Exception as e:
+                # Without Redis the local limit still applies
+                print(f"[llm_limiter] Redis lease failed for {self.name}: {e}")
+
+        wait = time.monotonic() - started
+        self._waits.append(wait)
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        return lease_id
+
+    def release(self, error: Optional[BaseException] = None, cancelled: bool = False) -> None:
+        """
+        Frees the slot and adapts the limit to the outcome; cancelled calls (hedge losers,
+        cancelled activities) say nothing about the provider's capacity.
+        """
+        self.in_flight -= 1
+        if cancelled:
+            self._wake()
+            return
+        if error is None:
+            self.limit = min(LIMITER_MAX, self.limit + LIMITER_INCREASE / max(self.limit, 1.0))
+        elif is_throttle_error(error):
+            self._counters["throttled"] += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= LIMITER_DECREASE_COOLDOWN:
+                self._last_decrease = now
+                self.limit = max(LIMITER_MIN, self.limit * LIMITER_DECREASE)
+                print(f"[llm_limiter] {self.name} throttled ({type(error).__name__}), limit -> {self.limit:.1f}")
+        else:
+            self._counters["errors"] += 1
+        self._wake()
+
+    def shared_update(self, error: Optional[BaseException]) -> Optional[str]:
+        """
+        How this outcome should move the shared limit: "decrease" on throttling, "increase"
+        on success at most every LIMITER_SHARED_INCREASE_INTERVAL, else None.
+        """
+        if error is not None:
+            return "decrease" if is_throttle_error(error) else None
+        now = time.monotonic()
+        if now - self._last_shared_increase < LIMITER_SHARED_INCREASE_INTERVAL:
+            return None
+        self._last_shared_increase = now
+        return "increase"
+
+    def _wake(self) -> None:
+        # Hands free slots over to the waiters in arrival order
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def _acquire_lease(self) -> str:
+        lease_id = uuid.uuid4().hex
+        delay = 0.05
+        while True:
+            acquired = await get_redis().eval(
+                _ACQUIRE_LEASE_SCRIPT,
+                2,
+                f"{_KEY_PREFIX}:{self.name}:leases",
+                f"{_KEY_PREFIX}:{self.name}:limit",
+                time.time(),
+                lease_id,
+                LIMITER_LEASE_SECONDS,
+                LIMITER_INITIAL,
+            )
+            if acquired:
+                return lease_id
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def metrics(self) -> Dict[str, Any]:
+        ordered = sorted(self._waits)
+        return {
+            **self._counters,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "avg_wait_seconds": round(self._total_wait / self._counters["calls"], 4) if self._counters["calls"] else 0.0,
+            "p95_wait_seconds": round(ordered[int(0.95 * (len(ordered) - 1))], 4) if ordered else 0.0,
+            "max_wait_seconds": round(self._max_wait, 4),
+        }
+
+
+async def _release_shared(
+    name: str,
+    lease_id: Optional[str],
+    limit: float,
+    update: Optional[str],
+) -> None:
+    """
+    Returns the Redis lease and folds this process' AIMD limit into the shared one
+    (`update` is "decrease", "increase" or None).
+    Redis errors are logged only, coordination must never fail a model call.
+    """
+    if not lease_id and update is None:
+        return
+    try:
+        redis = get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            if lease_id:
+                pipe.zrem(f"{_KEY_PREFIX}:{name}:leases", lease_id)
+            if update is not None:
+                pipe.eval(
+                    _UPDATE_LIMIT_SCRIPT,
+                    1,
+                    f"{_KEY_PREFIX}:{name}:limit",
+                    limit,
+                    update,
+                    LIMITER_INCREASE,
+                    LIMITER_MAX,
+                    LIMITER_INITIAL,
+                )
+            await pipe.execute()
+    except Exception as e:
+        print(f"[llm_limiter] Redis release failed for {name}: {e}")
+
+
+_limiters: Dict[str, AIMDLimiter] = {}
+_background_releases: Set["asyncio.Task[None]"] = set()
+
+
+def get_limiter(provider: str, model: str) -> AIMDLimiter:
+    name = f"{provider}:{model}"
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = AIMDLimiter(name)
+    return limiter
+
+
+def get_llm_limiter_metrics() -> Dict[str, Dict[str, Any]]:
+    return {name: limiter.metrics() for name, limiter in _limiters.items()}
+
+
+async def limited_call(route: Tuple[str, str], compute: Callable[[], Awaitable[T]]) -> T:
+    """
+    Runs `compute` within the concurrency limit of the (provider, model) route.
+    """
+    if not LIMITER_ENABLED:
+        return await compute()
+
+    limiter = get_limiter(*route)
+    lease_id = await limiter.acquire()
+    try:
+        result = await compute()
+    except asyncio.CancelledError:
+        limiter.release(cancelled=True)
+        if lease_id:
+            # Don't block the cancellation on Redis
+            task = asyncio.create_task(_release_shared(limiter.name, lease_id, limiter.limit, None))
+            _background_releases.add(task)
+            task.add_done_callback(_background_releases.discard)
+        raise
+    except Exception as e:
+        limiter.release(e)
+        if LIMITER_REDIS:
+            await _release_shared(limiter.name, lease_id, limiter.limit, limiter.shared_update(e))
+        raise
+    limiter.release()
+    if LIMITER_REDIS:
+        await _release_shared(limiter.name, lease_id, limiter.limit, limiter.shared_update(None))
+    return result
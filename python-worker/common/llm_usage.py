@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+# Provider reported token usage per model, read from the raw chat completion responses.
+# Autogen's RequestUsage only carries prompt/completion tokens, the cached part of the
+# prompt (prompt prefix cache hits) is only visible here.
+_provider_usage: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+)
+
+# USD per 1M tokens. Estimates from the providers' public price lists; models are matched
+# exactly first, then by longest prefix ("gpt-4o-2024-08-06" -> "gpt-4o").
+# Override or extend with LLM_PRICING_JSON='{"model": {"input": .., "cached_input": .., "output": ..}}'
+PRICING: Dict[str, Dict[str, float]] = {
+    "gemini-2.5-pro": {"input": 1.25, "cached_input": 0.31, "output": 10.00},
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+    "gemini-2.0-flash": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "gemini-1.5-flash-8b": {"input": 0.0375, "cached_input": 0.01, "output": 0.15},
+    "gemini-1.5-flash": {"input": 0.075, "cached_input": 0.01875, "output": 0.30},
+    "gpt-5": {"input": 1.25, "cached_input": 0.125, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+}
+
+USAGE_EXPORT_PATH = os.getenv("LLM_USAGE_EXPORT_PATH") or None
+USAGE_SESSION_TTL = int(os.getenv("LLM_USAGE_SESSION_TTL", str(7 * 24 * 3600)))
+
+_KEY_PREFIX = "llm_usage:v1:session"
+_SUMMED_FIELDS = ("calls", "errors", "prompt_tokens", "completion_tokens", "cached_tokens", "cost_usd", "wall_seconds", "ttft_seconds")
+
+# Tags (session_id, activity, refine_attempt, ...) of the calls made in the current scope
+_usage_tags: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("llm_usage_tags", default={})
+# Accumulator of the model call in flight, filled by the HTTP response hook
+_call_usage: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("llm_call_usage", default=None)
+
+_ledger_totals: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(lambda: {f: 0.0 for f in _SUMMED_FIELDS})
+_background_writes: Set["asyncio.Task[None]"] = set()
+
+
+def record_provider_usage(model: Optional[str], usage: Dict[str, Any]) -> None:
+    """
+    Records the `usage` object of an OpenAI-compatible chat completion response.
+    """
+    stats = _provider_usage[model or "unknown"]
+    details = usage.get("prompt_tokens_details") or {}
+    stats["requests"] += 1
+    stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    stats["completion_tokens"] += usage.get("completion_tokens") or 0
+    stats["cached_tokens"] += details.get("cached_tokens") or 0
+
+    call = _call_usage.get()
+    if call is not None:
+        call["responses"] += 1
+        call["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        call["completion_tokens"] += usage.get("completion_tokens") or 0
+        call["cached_tokens"] += details.get("cached_tokens") or 0
+
+
+def mark_first_token() -> None:
+    """
+    Time to first token of the call in flight: first streamed chunk, or response headers
+    for non-streaming calls. Only the first mark counts.
+    """
+    call = _call_usage.get()
+    if call is not None and call["ttft_seconds"] is None:
+        call["ttft_seconds"] = time.monotonic() - call["started"]
+
+
+def get_prompt_cache_metrics() -> Dict[str, Dict[str, Any]]:
+    """
+    Per model token totals plus the share of prompt tokens served from the provider cache.
+    """
+    return {
+        model: {
+            **stats,
+            "cached_ratio": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0,
+        }
+        for model, stats in _provider_usage.items()
+    }
+
+
+def model_pricing(model: str) -> Optional[Dict[str, float]]:
+    pricing = dict(PRICING)
+    if os.getenv("LLM_PRICING_JSON"):
+        pricing.update(json.loads(os.environ["LLM_PRICING_JSON"]))
+    if model in pricing:
+        return pricing[model]
+    prefixes = [name for name in pricing if model.startswith(name)]
+    return pricing[max(prefixes, key=len)] if prefixes else None
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Estimated USD cost of a call; 0 for models missing from the pricing table.
+    """
+    price = model_pricing(model)
+    if not price:
+        return 0.0
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * price["input"]
+        + cached_tokens * price.get("cached_input", price["input"])
+        + completion_tokens * price["output"]
+    ) / 1_000_000
+
+
+@contextmanager
+def usage_scope(**tags: Any) -> Iterator[None]:
+    """
+    Tags every model call made inside the block (including tasks it spawns), e.g.
+    `with usage_scope(session_id=..., activity=..., refine_attempt=3):`
+    """
+    token = _usage_tags.set({**_usage_tags.get(), **{k: v for k, v in tags.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _usage_tags.reset(token)
+
+
+def _usage_from_result(result: Any) -> Tuple[int, int]:
+    """
+    Prompt/completion tokens reported by autogen on the result messages, used when the
+    provider response could not be read (streamed responses).
+    """
+    prompt_tokens = completion_tokens = 0
+    for msg in getattr(result, "messages", None) or []:
+        usage = getattr(msg, "models_usage", None)
+        if usage:
+            prompt_tokens += usage.prompt_tokens or 0
+            completion_tokens += usage.completion_tokens or 0
+    return prompt_tokens, completion_tokens
+
+
+async def tracked_call(agent: str, route: Tuple[str, str], compute: Callable[[], Awaitable[T]]) -> T:
+    """
+    Runs one model call and records it in the usage ledger: tokens (incl. cached), wall
+    time, time to first token, model and estimated cost, tagged with the current usage_scope.
+    """
+    call: Dict[str, Any] = {
+        "started": time.monotonic(),
+        "responses": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,
+        "ttft_seconds": None,
+    }
+    token = _call_usage.set(call)
+    status = "error"
+    result: Any = None
+    try:
+        result = await compute()
+        status = "ok"
+        return result
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        _call_usage.reset(token)
+        if status == "ok" and not call["responses"]:
+            call["prompt_tokens"], call["completion_tokens"] = _usage_from_result(result)
+        provider, model = route
+        record_llm_call({
+            **_usage_tags.get(),
+            "ts": time.time(),
+            "agent": agent,
+            "provider": provider,
+            "model": model,
+            "status": status,
+            "prompt_tokens": call["prompt_tokens"],
+            "completion_tokens": call["completion_tokens"],
+            "cached_tokens": call["cached_tokens"],
+            "wall_seconds": round(time.monotonic() - call["started"], 3),
+            "ttft_seconds": round(call["ttft_seconds"], 3) if call["ttft_seconds"] is not None else None,
+            "cost_usd": estimate_cost(model, call["prompt_tokens"], call["completion_tokens"], call["cached_tokens"]),
+        })
+
+
+def record_llm_call(entry: Dict[str, Any]) -> None:
+    """
+    Adds a call to the process totals and the JSONL export, and to its session's totals
+    in Redis (in the background, the ledger must never slow down or fail a call).
+    """
+    values = {
+        "calls": 1,
+        "errors": int(entry["status"] == "error"),
+        "prompt_tokens": entry["prompt_tokens"],
+        "completion_tokens": entry["completion_tokens"],
+        "cached_tokens": entry["cached_tokens"],
+        "cost_usd": entry["cost_usd"],
+        "wall_seconds": entry["wall_seconds"],
+        "ttft_seconds": entry["ttft_seconds"] or 0.0,
+    }
+    totals = _ledger_totals[(entry.get("activity") or entry["agent"], entry["model"])]
+    for field, value in values.items():
+        totals[field] += value
+
+    if USAGE_EXPORT_PATH:
+        try:
+            with open(USAGE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        except OSError as e:
+            print(f"[llm_usage] Failed to export usage: {e}")
+
+    session_id = entry.get("session_id")
+    if session_id:
+        task = asyncio.get_running_loop().create_task(
+            _add_session_usage(session_id, entry.get("activity") or entry["agent"], values)
+        )
+        _background_writes.add(task)
+        task.add_done_callback(_background_writes.discard)
+
+
+async def _add_session_usage(session_id: str, activity: str, values: Dict[str, float]) -> None:
+    from common.get_redis import get_redis
+
+    key = f"{_KEY_PREFIX}:{session_id}"
+    try:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for scope in ("total", f"activity:{activity}"):
+                for field, value in values.items():
+                    if isinstance(value, float):
+                        pipe.hincrbyfloat(key, f"{scope}:{field}", value)
+                    else:
+                        pipe.hincrby(key, f"{scope}:{field}", value)
+            pipe.expire(key, USAGE_SESSION_TTL)
+            await pipe.execute()
+    except Exception as e:
+        print(f"[llm_usage] Failed to aggregate usage of session {session_id}: {e}")
+
+
+async def get_session_usage(session_id: str) -> Dict[str, Any]:
+    """
+    Aggregated usage of a session: {"total": {...}, "by_activity": {activity: {...}}}
+    """
+    from common.get_redis import get_redis
+
+    raw = await get_redis().hgetall(f"{_KEY_PREFIX}:{session_id}")
+    total: Dict[str, float] = {f: 0.0 for f in _SUMMED_FIELDS}
+    by_activity: Dict[str, Dict[str, float]] = defaultdict(lambda: {f: 0.0 for f in _SUMMED_FIELDS})
+    for field, value in raw.items():
+        scope, _, name = field.rpartition(":")
+        if scope == "total":
+            total[name] = float(value)
+        elif scope.startswith("activity:"):
+            by_activity[scope[len("activity:"):]][name] = float(value)
+    return {"total": total, "by_activity": dict(by_activity)}
+
+
+def get_usage_ledger_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    Process totals per activity (or agent outside activities) and model.
+    """
+    return {
+        f"{activity}/{model}": {field: round(value, 6) for field, value in totals.items()}
+        for (activity, model), totals in _ledger_totals.items()
+    }
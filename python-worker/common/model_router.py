@@ -0,0 +1,308 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from common.llm_limiter import limited_call
+from common.llm_usage import tracked_call
+
+T = TypeVar("T")
+
+# (provider, model), e.g. ("gemini", "gemini-2.5-pro")
+Route = Tuple[str, str]
+
+ROUTER_WINDOW = int(os.getenv("MODEL_ROUTER_WINDOW", "50"))
+ROUTER_MIN_SAMPLES = int(os.getenv("MODEL_ROUTER_MIN_SAMPLES", "5"))
+# Routes failing more than this share of their recent calls are tried after the healthy ones
+ROUTER_MAX_ERROR_RATE = float(os.getenv("MODEL_ROUTER_MAX_ERROR_RATE", "0.5"))
+# Outcomes older than this are forgotten, so a route that stopped getting traffic recovers
+ROUTER_OUTCOME_MAX_AGE_SECONDS = float(os.getenv("MODEL_ROUTER_OUTCOME_MAX_AGE_SECONDS", "300"))
+# An unhealthy route is put back in its configured place for one call (a probe) this often;
+# a successful call clears its failures
+ROUTER_PROBE_INTERVAL_SECONDS = float(os.getenv("MODEL_ROUTER_PROBE_INTERVAL_SECONDS", "60"))
+ROUTER_HEDGING = os.getenv("MODEL_ROUTER_HEDGING", "true").lower() in ("1", "true", "yes")
+# Hedge delay = p95 latency of the primary route, clamped to [min, max]; default until enough samples
+HEDGE_MIN_SECONDS = float(os.getenv("MODEL_ROUTER_HEDGE_MIN_SECONDS", "2"))
+HEDGE_MAX_SECONDS = float(os.getenv("MODEL_ROUTER_HEDGE_MAX_SECONDS", "60"))
+HEDGE_DEFAULT_SECONDS = float(os.getenv("MODEL_ROUTER_HEDGE_DEFAULT_SECONDS", "30"))
+
+# Route that answered the last routed call of the current task, None while in flight or after a failure
+_answered_route: contextvars.ContextVar[Optional[Route]] = contextvars.ContextVar("model_router_answered_route", default=None)
+
+
+def parse_routes(raw: str) -> List[Route]:
+    """
+    "gemini:gemini-2.5-pro,openai:gpt-5.2" -> [("gemini", "gemini-2.5-pro"), ("openai", "gpt-5.2")]
+    """
+    routes: List[Route] = []
+    for part in raw.split(","):
+        provider, _, model = part.strip().partition(":")
+        if provider and model:
+            routes.append((provider.strip(), model.strip()))
+    return routes
+
+
+def configured_routes(agent: str, default_routes: List[Route]) -> List[Route]:
+    """
+    Routes of an agent in their configured order: MODEL_ROUTES_<AGENT> if set, else the defaults.
+    """
+    return parse_routes(os.getenv(f"MODEL_ROUTES_{agent.upper()}", "")) or list(default_routes)
+
+
+class RouteStats:
+    """
+    Rolling latency and outcome window of one (agent, route) pair. Only finished calls are
+    recorded; hedge losers cancelled mid-flight are not. Latencies are the provider call
+    only, time spent waiting for a concurrency slot is not the route's fault.
+    """
+
+    def __init__(self, window: int = ROUTER_WINDOW) -> None:
+        self.latencies: Deque[float] = deque(maxlen=window)
+        # (monotonic time, ok)
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.last_probe = 0.0
+
+    def _forget_old(self, now: float) -> None:
+        while self.outcomes and now - self.outcomes[0][0] > ROUTER_OUTCOME_MAX_AGE_SECONDS:
+            self.outcomes.popleft()
+
+    def record(self, latency: float, ok: bool) -> None:
+        now = time.monotonic()
+        was_healthy = self.healthy(now)
+        if ok and not was_healthy:
+            # The route answers again: don't keep it sidelined for its old failures
+            self.outcomes.clear()
+        self.outcomes.append((now, ok))
+        if was_healthy and not self.healthy(now):
+            # First probe one interval after the route was sidelined
+            self.last_probe = now
+        if ok:
+            self.latencies.append(latency)
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < ROUTER_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        self._forget_old(time.monotonic() if now is None else now)
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for _, ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def healthy(self, now: Optional[float] = None) -> bool:
+        error_rate = self.error_rate(now)
+        return len(self.outcomes) < ROUTER_MIN_SAMPLES or error_rate <= ROUTER_MAX_ERROR_RATE
+
+    def available(self, now: float) -> bool:
+        """
+        Healthy, or unhealthy with a probe due. Only checks: `take_probe` marks the probe as
+        used once a call is actually sent.
+        """
+        return self.healthy(now) or now - self.last_probe >= ROUTER_PROBE_INTERVAL_SECONDS
+
+    def take_probe(self, now: float) -> None:
+        """
+        Called when an attempt starts on the route: if it is unhealthy, that attempt is its probe.
+        """
+        if not self.healthy(now):
+            self.last_probe = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "healthy": self.healthy(),
+            "p95_seconds": round(self.p95(), 3) if self.p95() is not None else None,
+        }
+
+
+class ModelRouter:
+    """
+    Runs a model call against an ordered list of routes:
+    - unhealthy routes (high recent error rate) are moved behind the healthy ones, except for
+      one probe call every ROUTER_PROBE_INTERVAL_SECONDS; failures older than
+      ROUTER_OUTCOME_MAX_AGE_SECONDS are forgotten
+    - if the primary hasn't answered after its p95 latency, the call is hedged on the next route
+      and the first success wins, the other call is cancelled
+    - on errors the next route is tried (fallback) until one succeeds or all failed
+    Attempts run within their route's AIMD concurrency limit (common/llm_limiter.py), so a
+    saturated primary gets hedged/relieved by the next route.
+    Every decision is kept in a bounded in-memory log and optionally appended to
+    MODEL_ROUTER_LOG_PATH as JSON lines.
+    """
+
+    def __init__(self, log_size: int = 1000, log_path: Optional[str] = None) -> None:
+        self._stats: Dict[Tuple[str, Route], RouteStats] = defaultdict(RouteStats)
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"calls": 0, "hedged": 0, "fallbacks": 0, "failed": 0, "secondary_wins": 0}
+        )
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=log_size)
+        self.log_path = log_path
+
+    def routes_for(self, agent: str, default_routes: List[Route]) -> List[Route]:
+        """
+        Routes of an agent (MODEL_ROUTES_<AGENT> overrides the defaults), healthy ones and
+        those due for a probe first.
+        """
+        routes = configured_routes(agent, default_routes)
+        now = time.monotonic()
+        return sorted(routes, key=lambda route: not self._stats[(agent, route)].available(now))
+
+    def hedge_delay(self, agent: str, route: Route) -> float:
+        p95 = self._stats[(agent, route)].p95()
+        if p95 is None:
+            return HEDGE_DEFAULT_SECONDS
+        return min(HEDGE_MAX_SECONDS, max(HEDGE_MIN_SECONDS, p95))
+
+    async def call(
+        self,
+        agent: str,
+        default_routes: List[Route],
+        compute: Callable[[Route], Awaitable[T]],
+        hedge: bool = True,
+    ) -> T:
+        """
+        Runs `compute(route)` with hedging and fallback. Only hedge idempotent calls: a hedged
+        call runs twice. Raises the primary route's error when every route failed.
+        """
+        routes = self.routes_for(agent, default_routes)
+        if not routes:
+            raise ValueError(f"No model routes configured for {agent}")
+        hedge = hedge and ROUTER_HEDGING
+        _answered_route.set(None)
+
+        # task -> (route, queued at, {"started": provider call start, once a slot was granted})
+        pending: Dict["asyncio.Task[T]", Tuple[Route, float, Dict[str, float]]] = {}
+        errors: List[Tuple[Route, BaseException]] = []
+        next_index = 0
+        hedged = False
+        started_at = time.monotonic()
+
+        def _start_next() -> None:
+            nonlocal next_index
+            route = routes[next_index]
+            next_index += 1
+            self._stats[(agent, route)].take_probe(time.monotonic())
+            timing: Dict[str, float] = {}
+
+            async def _provider_call() -> T:
+                timing["started"] = time.monotonic()
+                return await tracked_call(agent, route, lambda: compute(route))
+
+            # Each attempt waits for a slot of its own route's concurrency limiter, and is
+            # recorded in the usage ledger (hedge losers as cancelled)
+            attempt = limited_call(route, _provider_call)
+            pending[asyncio.create_task(attempt)] = (route, time.monotonic(), timing)
+
+        _start_next()
+        try:
+            while pending:
+                timeout = None
+                if hedge and not hedged and len(pending) == 1 and next_index < len(routes):
+                    # Hedging counts from the queue entry: a saturated primary gets hedged too
+                    route, route_started, _ = next(iter(pending.values()))
+                    timeout = max(0.0, route_started + self.hedge_delay(agent, route) - time.monotonic())
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    _start_next()
+                    continue
+
+                for task in done:
+                    route, route_started, timing = pending.pop(task)
+                    latency = time.monotonic() - timing.get("started", route_started)
+                    error = task.exception()
+                    self._stats[(agent, route)].record(latency, error is None)
+                    if error is None:
+                        self._record(agent, routes, route, hedged, errors, time.monotonic() - started_at)
+                        _answered_route.set(route)
+                        return task.result()
+                    errors.append((route, error))
+                    print(f"[model_router] {agent} failed on {route[0]}:{route[1]} after {latency:.1f}s: {error!r}")
+
+                if not pending and next_index < len(routes):
+                    _start_next()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending.keys(), return_exceptions=True)
+
+        self._record(agent, routes, None, hedged, errors, time.monotonic() - started_at)
+        raise errors[0][1]
+
+    def _record(
+        self,
+        agent: str,
+        routes: List[Route],
+        winner: Optional[Route],
+        hedged: bool,
+        errors: List[Tuple[Route, BaseException]],
+        latency: float,
+    ) -> None:
+        counters = self._counters[agent]
+        counters["calls"] += 1
+        counters["hedged"] += int(hedged)
+        counters["fallbacks"] += int(bool(errors) and winner is not None)
+        counters["failed"] += int(winner is None)
+        counters["secondary_wins"] += int(winner is not None and winner != routes[0])
+
+        decision = {
+            "ts": time.time(),
+            "agent": agent,
+            "routes": [f"{p}:{m}" for p, m in routes],
+            "winner": f"{winner[0]}:{winner[1]}" if winner else None,
+            "hedged": hedged,
+            "errors": [{"route": f"{p}:{m}", "error": repr(e)[:300]} for (p, m), e in errors],
+            "latency_seconds": round(latency, 3),
+        }
+        self.decisions.append(decision)
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(decision) + "\n")
+            except OSError as e:
+                print(f"[model_router] Failed to write decision log: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "agents": {agent: dict(counters) for agent, counters in self._counters.items()},
+            "routes": {
+                f"{agent}/{provider}:{model}": stats.snapshot()
+                for (agent, (provider, model)), stats in self._stats.items()
+                if stats.outcomes or stats.latencies
+            },
+        }
+
+
+_router = ModelRouter(log_path=os.getenv("MODEL_ROUTER_LOG_PATH") or None)
+
+
+def get_model_router() -> ModelRouter:
+    return _router
+
+
+def answered_route() -> Optional[Route]:
+    """
+    The route whose answer the last routed call of the current task returned.
+    """
+    return _answered_route.get()
+
+
+def get_model_router_metrics() -> Dict[str, Any]:
+    return _router.metrics()
+
+
+async def routed_call(
+    agent: str,
+    default_routes: List[Route],
+    compute: Callable[[Route], Awaitable[T]],
+    hedge: bool = True,
+) -> T:
+    return await _router.call(agent, default_routes, compute, hedge=hedge)
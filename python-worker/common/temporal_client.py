@@ -1,13 +1,32 @@
 from temporalio.client import Client
 import asyncio
 import os
+from typing import Dict
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+# One connection per event loop, shared by every caller of that loop
+_clients: Dict[asyncio.AbstractEventLoop, Client] = {}
+_connect_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
 
-async def get_temporal_client() -> Client:
-    temporal = await Client.connect(os.getenv("TEMPORAL_ADDRESS", "localhost:7233"))
-    return temporal
 
+async def get_temporal_client() -> Client:
+    """
+    Process wide Temporal client, connected on first use. Clients are cached per event loop
+    since a connection is bound to the loop it was opened on.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is not None:
+        return client
+    lock = _connect_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        if loop not in _clients:
+            # Loops closed since their client was cached (e.g. the startup asyncio.run) are dropped
+            for stale in [l for l in _clients if l.is_closed()]:
+                _clients.pop(stale, None)
+                _connect_locks.pop(stale, None)
+            _clients[loop] = await Client.connect(os.getenv("TEMPORAL_ADDRESS", "localhost:7233"))
+        return _clients[loop]
@@ -0,0 +1,86 @@
+"""
+Compaction of the itinerary critique history. Every pass of the critique loop used to append
+the full itinerary and advisory blobs; the history is folded into a single entry instead:
+the latest itinerary, the last decision and one advisory per country (latest wins).
+Pure functions, used inside the workflow.
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from pois.poi_models import CritiqueItineraryContext
+from pois.travel_advisories import normalize_country
+
+
+def _advisory(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    One country's advisory in the compact shape, from any of the stored formats: index/cache
+    entries (format_advisories_for_critic), browser lookup results, or compact entries.
+    """
+    country = item.get("country")
+    if not country:
+        return None
+    return {
+        "country": country,
+        "advisory": item.get("advisory") or item.get("level"),
+        "summary": item.get("summary") or item.get("advises"),
+        "as_of": item.get("as_of") or item.get("source_updated_at") or item.get("looked_up_at"),
+        "url": item.get("url"),
+    }
+
+
+def parse_travel_advise(travel_advise: str) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+    """
+    Advisories by normalized country found in a stored `travel_advise` value, plus the text
+    itself when it is not structured (older free text lookups).
+    """
+    try:
+        data = json.loads(travel_advise)
+    except ValueError:
+        return {}, travel_advise
+    if isinstance(data, dict):
+        data = data.get("results") or []
+    if not isinstance(data, list):
+        return {}, travel_advise
+    advisories: Dict[str, Dict[str, Any]] = {}
+    unstructured: Optional[str] = None
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        advisory = _advisory(item)
+        if advisory:
+            advisories[normalize_country(advisory["country"])] = advisory
+        elif item.get("summary"):
+            # Free text carried over by an earlier compaction
+            unstructured = item["summary"]
+    return advisories, unstructured
+
+
+def compact_critique_history(entries: List[CritiqueItineraryContext]) -> List[CritiqueItineraryContext]:
+    """
+    Folds the history into at most one entry: latest itinerary, last decision and feedback,
+    and a JSON list with one advisory per country in `travel_advise`.
+    """
+    if not entries:
+        return []
+    advisories: Dict[str, Dict[str, Any]] = {}
+    unstructured: Optional[str] = None
+    last_decision: Optional[CritiqueItineraryContext] = None
+    for entry in entries:
+        if entry.travel_advise:
+            parsed, text = parse_travel_advise(entry.travel_advise)
+            advisories.update(parsed)
+            unstructured = text or unstructured
+        if entry.decision:
+            last_decision = entry
+
+    travel_advise: List[Dict[str, Any]] = list(advisories.values())
+    if unstructured:
+        travel_advise.append({"country": None, "summary": unstructured})
+    return [
+        CritiqueItineraryContext(
+            itinerary=entries[-1].itinerary,
+            decision=last_decision.decision if last_decision else "",
+            feedback=last_decision.feedback if last_decision else None,
+            travel_advise=json.dumps(travel_advise, ensure_ascii=False) if travel_advise else None,
+        )
+    ]
@@ -0,0 +1,200 @@
+"""
+Pairwise POI distances shared by the activities that need POI-to-POI geometry (route
+planning). Rows are computed in vectorized batches by a pluggable provider and cached per
+place id with LRU eviction; a cached row computed before new places were seen is extended
+with the missing columns only, instead of being recomputed. A matrix is shared by the
+activity threads of a worker, each call holds its lock.
+Pre-ranking only measures distances to the candidates' median point, which has no place id
+to cache, so it calls `haversine_km` directly.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from pois.tools.google_places_tool import DestinationPOI
+
+DISTANCE_MATRIX_PROVIDER = os.getenv("DISTANCE_MATRIX_PROVIDER", "great_circle")
+DISTANCE_MATRIX_CACHE_ROWS = int(os.getenv("DISTANCE_MATRIX_CACHE_ROWS", "2048"))
+# Known places (matrix columns) per process; past this the cache starts over
+DISTANCE_MATRIX_MAX_PLACES = int(os.getenv("DISTANCE_MATRIX_MAX_PLACES", "20000"))
+# Walking stand-in for a travel time API: great-circle distance times a detour factor, at this speed
+WALKING_SPEED_KMH = float(os.getenv("DISTANCE_MATRIX_WALKING_SPEED_KMH", "4.5"))
+WALKING_DETOUR_FACTOR = float(os.getenv("DISTANCE_MATRIX_WALKING_DETOUR_FACTOR", "1.3"))
+
+_EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances in km between every point 1 and every point 2, shape (len1, len2).
+    """
+    lat1_r, lng1_r = np.radians(lat1)[:, None], np.radians(lng1)[:, None]
+    lat2_r, lng2_r = np.radians(lat2)[None, :], np.radians(lng2)[None, :]
+    a = np.sin((lat2_r - lat1_r) / 2) ** 2 + np.cos(lat1_r) * np.cos(lat2_r) * np.sin((lng2_r - lng1_r) / 2) ** 2
+    return 2 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GreatCircleProvider:
+    """
+    Straight-line distances in km.
+    """
+
+    name = "great_circle"
+    unit = "km"
+
+    def rows(self, lat: np.ndarray, lng: np.ndarray, to_lat: np.ndarray, to_lng: np.ndarray) -> np.ndarray:
+        return haversine_km(lat, lng, to_lat, to_lng)
+
+
+class WalkingTimeProvider:
+    """
+    Walking minutes estimated locally, a stand-in with the interface a travel time API
+    provider would have.
+    """
+
+    name = "walking"
+    unit = "min"
+
+    def __init__(self, speed_kmh: float = WALKING_SPEED_KMH, detour_factor: float = WALKING_DETOUR_FACTOR) -> None:
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+
+    def rows(self, lat: np.ndarray, lng: np.ndarray, to_lat: np.ndarray, to_lng: np.ndarray) -> np.ndarray:
+        return haversine_km(lat, lng, to_lat, to_lng) * self.detour_factor / self.speed_kmh * 60.0
+
+
+# Provider name -> factory; register_provider adds others (e.g. a remote matrix API client)
+_PROVIDERS: Dict[str, Callable[[], object]] = {
+    GreatCircleProvider.name: GreatCircleProvider,
+    WalkingTimeProvider.name: WalkingTimeProvider,
+}
+
+
+def register_provider(name: str, factory: Callable[[], object]) -> None:
+    """
+    Makes a provider available under `name`. A provider has a `unit` and a
+    `rows(lat, lng, to_lat, to_lng)` method returning the (len(lat), len(to_lat)) matrix.
+    """
+    _PROVIDERS[name] = factory
+    _matrices.pop(name, None)
+
+
+class DistanceMatrix:
+    """
+    Cached distances between places by id. Every place seen gets a column; a row holds the
+    distances from one place to the columns known when it was computed or last extended.
+    Thread safe: registering, filling, reading and evicting rows happen under one lock.
+    """
+
+    def __init__(
+        self,
+        provider: object,
+        max_rows: int = DISTANCE_MATRIX_CACHE_ROWS,
+        max_places: int = DISTANCE_MATRIX_MAX_PLACES,
+    ) -> None:
+        self.provider = provider
+        self.max_rows = max(1, max_rows)
+        self.max_places = max(1, max_places)
+        self._rows: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._columns: Dict[str, int] = {}
+        self._lat = np.empty(0)
+        self._lng = np.empty(0)
+        self._counters = {"hits": 0, "misses": 0, "extended": 0, "evicted": 0, "resets": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def unit(self) -> str:
+        return self.provider.unit
+
+    def _reset(self) -> None:
+        self._rows.clear()
+        self._columns.clear()
+        self._lat = np.empty(0)
+        self._lng = np.empty(0)
+        self._counters["resets"] += 1
+
+    def _register(self, pois: List[DestinationPOI]) -> np.ndarray:
+        """
+        Column index of every POI, adding columns for places not seen before.
+        """
+        new = {p.id: p for p in pois if p.id not in self._columns}
+        if len(self._columns) + len(new) > self.max_places:
+            self._reset()
+            new = {p.id: p for p in pois}
+        if new:
+            start = len(self._columns)
+            self._columns.update((place_id, start + i) for i, place_id in enumerate(new))
+            self._lat = np.concatenate([self._lat, [p.lat for p in new.values()]])
+            self._lng = np.concatenate([self._lng, [p.lng for p in new.values()]])
+        return np.fromiter((self._columns[p.id] for p in pois), dtype=int, count=len(pois))
+
+    def _fill(self, place_ids: List[str]) -> None:
+        """
+        Computes the missing rows in one batch, and the missing columns of the stale rows in
+        another, starting at the shortest stale row.
+        """
+        known = len(self._columns)
+        missing = [place_id for place_id in place_ids if place_id not in self._rows]
+        stale = [place_id for place_id in place_ids if place_id in self._rows and len(self._rows[place_id]) < known]
+        self._counters["hits"] += len(place_ids) - len(missing)
+        self._counters["misses"] += len(missing)
+        if missing:
+            index = [self._columns[place_id] for place_id in missing]
+            block = self.provider.rows(self._lat[index], self._lng[index], self._lat, self._lng)
+            for place_id, row in zip(missing, block):
+                self._rows[place_id] = row
+        if stale:
+            first = min(len(self._rows[place_id]) for place_id in stale)
+            index = [self._columns[place_id] for place_id in stale]
+            block = self.provider.rows(self._lat[index], self._lng[index], self._lat[first:], self._lng[first:])
+            for place_id, tail in zip(stale, block):
+                row = self._rows[place_id]
+                self._rows[place_id] = np.concatenate([row, tail[len(row) - first:]])
+            self._counters["extended"] += len(stale)
+
+    def matrix(self, pois: List[DestinationPOI], to: Optional[List[DestinationPOI]] = None) -> np.ndarray:
+        """
+        Distances from every POI to every POI of `to` (default: the same POIs), shape
+        (len(pois), len(to)), in the provider's unit.
+        """
+        to = pois if to is None else to
+        with self._lock:
+            columns = self._register(list(pois) + list(to))[len(pois):]
+            place_ids = list(dict.fromkeys(p.id for p in pois))
+            self._fill(place_ids)
+            result = np.stack([self._rows[p.id][columns] for p in pois]) if pois else np.empty((0, len(to)))
+            for place_id in place_ids:
+                self._rows.move_to_end(place_id)
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+                self._counters["evicted"] += 1
+        return result
+
+    def metrics(self) -> Dict[str, object]:
+        with self._lock:
+            return {**self._counters, "provider": self.provider.name, "rows": len(self._rows), "places": len(self._columns)}
+
+
+# Provider name -> process wide matrix
+_matrices: Dict[str, DistanceMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def get_distance_matrix(provider: Optional[str] = None) -> DistanceMatrix:
+    """
+    The process wide matrix of `provider`, DISTANCE_MATRIX_PROVIDER by default.
+    """
+    name = provider or DISTANCE_MATRIX_PROVIDER
+    with _matrices_lock:
+        if name not in _matrices:
+            if name not in _PROVIDERS:
+                raise ValueError(f"Unknown distance matrix provider: {name}")
+            _matrices[name] = DistanceMatrix(_PROVIDERS[name]())
+        return _matrices[name]
+
+
+def get_distance_matrix_metrics() -> Dict[str, Dict[str, object]]:
+    return {name: matrix.metrics() for name, matrix in _matrices.items()}
@@ -0,0 +1,248 @@
+"""
+Deterministic checks of an itinerary summary, run before the critic model:
+countries (matched against the travel advisory index), dates and durations, the stay limit
+per country and the presence of the required information. Failed hard checks are answered
+with a "refine" right away; otherwise the results go to the critic as compact context.
+"""
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from pois.poi_models import CachedTravelAdvisory, CritiqueItineraryResult, ItineraryPrecheck, TravelAdvisory
+from pois.travel_advisories import find_countries, normalize_country
+
+PRECHECKS_ENABLED = os.getenv("ITINERARY_PRECHECKS_ENABLED", "true").lower() in ("1", "true", "yes")
+MAX_STAY_DAYS = int(os.getenv("ITINERARY_MAX_STAY_DAYS", "90"))
+# Missing dates/companions are detected by keywords, so by default they are only reported to the
+# critic; turn this on to answer "refine" for them without asking the model
+REFINE_MISSING = os.getenv("ITINERARY_PRECHECK_REFINE_MISSING", "false").lower() in ("1", "true", "yes")
+# Longer parsed trips or stays are taken for misparses and left to the critic
+MAX_PARSED_TRIP_DAYS = int(os.getenv("ITINERARY_MAX_PARSED_TRIP_DAYS", "366"))
+
+_MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8, "september": 9,
+    "sept": 9, "sep": 9, "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12,
+}
+_NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "fifteen": 15, "twenty": 20,
+}
+# Years are never a trip length here ("25-year anniversary", "9 years old")
+_UNIT_DAYS = {"day": 1, "night": 1, "week": 7, "fortnight": 14, "month": 30}
+
+_MONTH = r"(" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\.?"
+_NUMBER = r"(\d{1,3}|" + "|".join(_NUMBERS) + r")"
+_DAY = r"(\d{1,2})(?:st|nd|rd|th)?"
+_YEAR = r"(?:,?\s+(\d{4}))?"
+
+_ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_MONTH_DAY_RANGE_RE = re.compile(rf"\b{_MONTH}\s+{_DAY}\s*(?:-|–|to|until|through)\s*{_DAY}\b{_YEAR}", re.IGNORECASE)
+_DAY_RANGE_MONTH_RE = re.compile(rf"\b{_DAY}\s*(?:-|–|to|until|through)\s*{_DAY}\s+(?:of\s+)?{_MONTH}{_YEAR}", re.IGNORECASE)
+_MONTH_DAY_RE = re.compile(rf"\b{_MONTH}\s+{_DAY}\b{_YEAR}", re.IGNORECASE)
+_DAY_MONTH_RE = re.compile(rf"\b{_DAY}\s+(?:of\s+)?{_MONTH}{_YEAR}", re.IGNORECASE)
+# "3 months old", "2 weeks ago", "a 6-month-old baby" are not durations
+_DURATION_RE = re.compile(
+    rf"\b{_NUMBER}[\s-]*(day|night|week|fortnight|month)s?\b(?![\s-]+(?:old|ago)\b)", re.IGNORECASE
+)
+# Weeks and months only count as a trip length next to one of these
+_TRIP_BEFORE_RE = re.compile(
+    r"\b(?:for|stay(?:ing)?|spend(?:ing)?|spent|trip of|holiday of|vacation of|over|lasting|within)"
+    r"\s+(?:about\s+|around\s+|roughly\s+|only\s+|just\s+)?$",
+    re.IGNORECASE,
+)
+_TRIP_AFTER_RE = re.compile(
+    r"^[\s-]*(?:long\s+)?(?:trip|holiday|vacation|stay|tour|itinerary|getaway|break|journey|road\s+trip|visit|"
+    r"in|at|around|across|touring|exploring|travell?ing|abroad|away)\b",
+    re.IGNORECASE,
+)
+_STAY_RE = re.compile(
+    rf"\b{_NUMBER}[\s-]*(day|night|week|fortnight|month)s?\s+(?:in|at|around|across|touring|exploring)\s+((?:[^\W\d]+[ '-]?){{1,6}})",
+    re.IGNORECASE,
+)
+# Any hint of when or how long, even approximate ("in spring", "a long weekend", "03/10/2026").
+# "May" only counts where it can't be the verb: "in May", "early May", "May 3", "May 2026"
+_TIMING_HINT_RE = re.compile(
+    r"\b(\d{1,2}/\d{1,2}(?:/\d{2,4})?|weekend|spring|summer|autumn|fall|winter|holidays?|christmas|easter|"
+    r"next (?:week|month|year)|(?:january|february|march|april|june|july|august|september|october|november|december)|"
+    r"(?:in|during|by|until|till|through|from|early|mid|late|end of|beginning of|start of)[\s-]+may|may\s+\d{1,4})\b",
+    re.IGNORECASE,
+)
+_COMPANIONS_RE = re.compile(
+    r"\b(solo|alone|myself|by myself|on my own|couple|partner|wife|husband|spouse|boyfriend|girlfriend|fianc[eé]e?|"
+    r"family|kids?|children|child|son|daughter|toddler|baby|babies|parents?|mother|father|mom|dad|grand\w+|"
+    r"friends?|group|colleagues?|coworkers?|pets?|dogs?|cats?|adults?|people|persons|travell?ers|travell?ing with|companions?)\b",
+    re.IGNORECASE,
+)
+_UNKNOWN_COMPANIONS_RE = re.compile(
+    r"companions?\s*[:\-]\s*(unknown|not specified|unspecified|none given|n/?a|tbd|\?)", re.IGNORECASE
+)
+_LEVEL_4_RE = re.compile(r"level\s*4|do not travel", re.IGNORECASE)
+_LEVEL_3_RE = re.compile(r"level\s*3|reconsider travel", re.IGNORECASE)
+
+
+def _number(text: str) -> int:
+    return int(text) if text.isdigit() else _NUMBERS[text.lower()]
+
+
+def _to_date(year: Optional[str], month: str, day: str, today: date) -> Optional[date]:
+    """
+    Dates without a year are the next occurrence from `today`.
+    """
+    try:
+        month_number = int(month) if month.isdigit() else _MONTHS[month.lower().rstrip(".")]
+        if year:
+            return date(int(year), month_number, int(day))
+        parsed = date(today.year, month_number, int(day))
+        return parsed if parsed >= today else date(today.year + 1, month_number, int(day))
+    except (KeyError, ValueError):
+        return None
+
+
+def extract_dates(text: str, today: Optional[date] = None) -> List[date]:
+    """
+    Dates mentioned in `text` in order of appearance: ISO dates, "March 3, 2026", "3rd of March",
+    and ranges sharing the month ("March 3-10", "3 to 10 March 2026").
+    """
+    today = today or datetime.now().date()
+    found: List[Tuple[int, date]] = []
+    taken: List[Tuple[int, int]] = []
+
+    def _add(match: "re.Match[str]", *dates: Optional[date]) -> None:
+        if any(start < match.end() and match.start() < end for start, end in taken):
+            return
+        taken.append(match.span())
+        found.extend((match.start() + i, d) for i, d in enumerate(dates) if d is not None)
+
+    for m in _ISO_DATE_RE.finditer(text):
+        _add(m, _to_date(m.group(1), m.group(2), m.group(3), today))
+    for m in _MONTH_DAY_RANGE_RE.finditer(text):
+        _add(m, _to_date(m.group(4), m.group(1), m.group(2), today), _to_date(m.group(4), m.group(1), m.group(3), today))
+    for m in _DAY_RANGE_MONTH_RE.finditer(text):
+        _add(m, _to_date(m.group(4), m.group(3), m.group(1), today), _to_date(m.group(4), m.group(3), m.group(2), today))
+    for m in _MONTH_DAY_RE.finditer(text):
+        _add(m, _to_date(m.group(3), m.group(1), m.group(2), today))
+    for m in _DAY_MONTH_RE.finditer(text):
+        _add(m, _to_date(m.group(3), m.group(2), m.group(1), today))
+    return [d for _, d in sorted(found, key=lambda item: item[0])]
+
+
+def _is_trip_duration(text: str, match: "re.Match[str]") -> bool:
+    if match.group(2).lower() in ("day", "night"):
+        return True
+    return bool(_TRIP_BEFORE_RE.search(text[:match.start()]) or _TRIP_AFTER_RE.search(text[match.end():]))
+
+
+def extract_durations(text: str) -> List[int]:
+    """
+    Stated trip durations in days: "2 weeks in Spain" -> 14, "for three months" -> 90.
+    Days and nights always count; weeks and months only in trip context ("for", "stay", "trip",
+    "in <place>"), so "married 2 months ago" doesn't. Durations above MAX_PARSED_TRIP_DAYS are dropped.
+    """
+    durations = [
+        _number(m.group(1)) * _UNIT_DAYS[m.group(2).lower()]
+        for m in _DURATION_RE.finditer(text)
+        if _is_trip_duration(text, m)
+    ]
+    return [d for d in durations if 0 < d <= MAX_PARSED_TRIP_DAYS]
+
+
+def _duration_days(dates: List[date], durations: List[int]) -> Optional[int]:
+    if len(dates) > 1 and dates[-1] > dates[0]:
+        days = (dates[-1] - dates[0]).days + 1
+        return days if days <= MAX_PARSED_TRIP_DAYS else None
+    return max(durations) if durations else None
+
+
+def trip_duration_days(text: str, today: Optional[date] = None) -> Optional[int]:
+    """
+    Trip length in days: first to last date mentioned, else the longest stated duration.
+    """
+    return _duration_days(extract_dates(text, today), extract_durations(text))
+
+
+def _stays_per_country(text: str, countries: List[str]) -> Dict[str, int]:
+    """
+    "3 months in Spain" -> {"Spain": 90}, attributed to the first country named after the duration.
+    Stays adding up to more than MAX_PARSED_TRIP_DAYS are dropped.
+    """
+    names = {normalize_country(c): c for c in countries}
+    stays: Dict[str, int] = {}
+    for m in _STAY_RE.finditer(text):
+        matched = find_countries(m.group(3), names)
+        if matched:
+            country = names[matched[0]]
+            stays[country] = stays.get(country, 0) + _number(m.group(1)) * _UNIT_DAYS[m.group(2).lower()]
+    return {country: days for country, days in stays.items() if days <= MAX_PARSED_TRIP_DAYS}
+
+
+def _has_companions(text: str) -> bool:
+    return bool(_COMPANIONS_RE.search(_UNKNOWN_COMPANIONS_RE.sub("", text)))
+
+
+def run_itinerary_prechecks(
+    itinerary: str,
+    advisories: List[TravelAdvisory],
+    cached: List[CachedTravelAdvisory],
+    unresolved: List[str],
+    today: Optional[date] = None,
+) -> ItineraryPrecheck:
+    """
+    `advisories`, `cached` and `unresolved` are the itinerary's countries as returned by
+    `advisories_for_text` (fresh index entries, cached browser lookups, unknown to both).
+    """
+    countries = [a.country for a in advisories] + [c.country for c in cached] + unresolved
+    check = ItineraryPrecheck(countries=countries)
+
+    dates = extract_dates(itinerary, today)
+    durations = extract_durations(itinerary)
+    if dates:
+        check.start_date = dates[0].isoformat()
+        if len(dates) > 1 and dates[-1] > dates[0]:
+            check.end_date = dates[-1].isoformat()
+    check.duration_days = _duration_days(dates, durations)
+
+    check.stay_days = _stays_per_country(itinerary, countries)
+    if len(countries) == 1 and check.duration_days and countries[0] not in check.stay_days:
+        check.stay_days[countries[0]] = check.duration_days
+
+    check.do_not_travel = [a.country for a in advisories if a.level == 4]
+    check.do_not_travel += [c.country for c in cached if c.level and _LEVEL_4_RE.search(c.level)]
+    check.reconsider_travel = [a.country for a in advisories if a.level == 3]
+    check.reconsider_travel += [c.country for c in cached if c.level and _LEVEL_3_RE.search(c.level)]
+
+    if not countries:
+        # Cities alone are fine for the critic, it only can't be checked here
+        check.missing.append("destination country")
+    if not dates and not durations and not _TIMING_HINT_RE.search(itinerary):
+        check.missing.append("trip dates or approximate duration")
+    if not _has_companions(itinerary):
+        check.missing.append("travel companions")
+
+    if check.do_not_travel:
+        check.refine_reasons.append(
+            f"The US travel advisory for {', '.join(check.do_not_travel)} is Level 4 - Do Not Travel. "
+            "The user must choose another destination for safety reasons."
+        )
+    for country, days in check.stay_days.items():
+        if days > MAX_STAY_DAYS:
+            check.refine_reasons.append(
+                f"The trip stays {days} days in {country}, more than the {MAX_STAY_DAYS // 30} months allowed in "
+                "a single country. Ask the user to shorten the stay or split it across countries, and to be "
+                "aware of local tax regulations."
+            )
+    if REFINE_MISSING:
+        for field in check.missing:
+            if field != "destination country":
+                check.refine_reasons.append(f"The itinerary request is missing the {field}; ask the user for it.")
+    return check
+
+
+def precheck_decision(check: ItineraryPrecheck) -> Optional[CritiqueItineraryResult]:
+    """
+    The critique result when a hard check failed, None when the critic model has to decide.
+    """
+    if not check.refine_reasons:
+        return None
+    return CritiqueItineraryResult(decision="refine", feedback=" ".join(check.refine_reasons), tool_params=None)
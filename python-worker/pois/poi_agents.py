@@ -1,17 +1,17 @@
+import asyncio
 import json
 from typing import Dict, Any, Tuple, Optional
 import json
 import os
 import re
-from autogen_gemini import create_gemini_model_client
+import time
+from autogen_gemini import get_model_client, default_gemini_model, get_tokenizer
+from common.llm_cache import cached_llm_call, get_cached_values, set_cached_values
+from common.model_router import Route, configured_routes, routed_call
+from common.llm_usage import mark_first_token, tracked_call
 from autogen_agentchat.agents import AssistantAgent
-from autogen_agentchat.messages import TextMessage, StructuredMessage
-from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_core.models import ModelInfo, ModelFamily
-from autogen_core.memory import ListMemory, MemoryContent, MemoryMimeType
-from autogen_agentchat.teams import RoundRobinGroupChat
-from autogen_ext.agents.web_surfer import MultimodalWebSurfer
-from autogen_agentchat.conditions import ExternalTermination, TextMentionTermination
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import TextMessage, StructuredMessage, ModelClientStreamingChunkEvent
 
 
 
@@ -20,11 +20,63 @@ from datetime import timedelta
 
 
 from utils import extract_json
-from pois.poi_models import POIReviewInput, POIReview, QueryPOIParams, POISummaryInput, ChatConversationResult, ChatMessageHistory, CritiqueItineraryResult, CritiqueItineraryContext, CritiqueItineraryWebResults, CritiqueItineraryRequest, CritiqueItineraryToolParams, CritiqueItineraryWebLookupResult
+from pois.poi_models import POIReviewInput, POIReview, QueryPOIParams, POISummaryInput, POISummaryFrame, POIBlurbBatch, ChatConversationResult, ChatMessageHistory, CritiqueItineraryResult, CritiqueItineraryContext, CritiqueItineraryWebResults, CritiqueItineraryRequest, CritiqueItineraryToolParams, CritiqueItineraryWebLookupResult, ItineraryPrecheck, RoutePlan
 from pois.tools.google_places_tool import DestinationPOI
+from pois.critique_context import compact_critique_history
 
 load_dotenv()
 
+# Token budget for the history injected in Lorenzo's prompt (summary + verbatim turns),
+# and the most a single verbatim turn may take (critique JSON dumps, POI summaries)
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+CHAT_MESSAGE_TOKEN_LIMIT = int(os.getenv("CHAT_MESSAGE_TOKEN_LIMIT", "600"))
+# Hard token budget of the critique context (advisories per country + last decision)
+CRITIQUE_CONTEXT_TOKEN_BUDGET = int(os.getenv("CRITIQUE_CONTEXT_TOKEN_BUDGET", "2000"))
+
+# POI selections larger than the threshold are summarized per city/category group
+# concurrently (map), then stitched with a short intro/outro (reduce)
+SUMMARY_CHUNK_THRESHOLD = int(os.getenv("SUMMARY_CHUNK_THRESHOLD", "10"))
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", "6"))
+SUMMARY_CHUNK_CONCURRENCY = int(os.getenv("SUMMARY_CHUNK_CONCURRENCY", "4"))
+
+# Per-POI blurbs are cached by (place_id, language, style version) across sessions, so the
+# summary only generates text for POIs never described before. Bump the version whenever
+# POI_BLURB_SYSTEM_MESSAGE changes so stale blurbs are not reused.
+POI_BLURB_CACHE_ENABLED = os.getenv("POI_BLURB_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Composing from blurbs costs an intro/outro call plus one call per chunk of uncached POIs,
+# it only pays off on large selections; smaller ones use the streamed or chunked summary
+POI_BLURB_MIN_POIS = int(os.getenv("POI_BLURB_MIN_POIS", "20"))
+POI_BLURB_STYLE_VERSION = "1"
+
+# Model routes (primary first, then hedge/fallback candidates) of the agents; each list can be
+# overridden with MODEL_ROUTES_<AGENT_NAME>, e.g. MODEL_ROUTES_REVIEW_POI_RESULTS=gemini:gemini-2.5-pro,openai:gpt-5.2
+REVIEW_ROUTES: list[Route] = [("gemini", "gemini-2.5-pro"), ("openai", "gpt-5.2")]
+CRITIC_ROUTES: list[Route] = [("openai", "gpt-5.2"), ("gemini", "gemini-2.5-pro")]
+FALLBACK_ROUTE: Route = ("openai", "gpt-4o")
+
+
+def _default_routes() -> list[Route]:
+    return [("gemini", default_gemini_model()), FALLBACK_ROUTE]
+
+
+def _primary_model(agent: str) -> str:
+    """
+    Model of the agent's first configured route, the one its cached responses are keyed on.
+    """
+    return configured_routes(agent, _default_routes())[0][1]
+
+
+def _count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text))
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    tokens = get_tokenizer().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_tokenizer().decode(tokens[:max_tokens]) + " [...]"
+
+
 def _format_prev_messages_for_system(prev_messages: list[ChatMessageHistory]) -> str:
     """
     Render prior conversation turns as a plain transcript to be appended to the system prompt.
@@ -43,8 +95,173 @@ def _format_prev_messages_for_system(prev_messages: list[ChatMessageHistory]) ->
     return "\n".join(lines)
 
 
-async def initial_chat_agent(message: str, prev_messages: list[ChatMessageHistory]) -> ChatConversationResult:
-    system_message = f"""
+def _with_context_messages(context_parts: list[str], task: Optional[str]) -> list[TextMessage]:
+    """
+    Builds the task as context message(s) followed by the actual request, so dynamic data
+    comes after the static system prompt instead of being interpolated into it.
+    """
+    messages = [TextMessage(content=part, source="context") for part in context_parts if part]
+    if task or not messages:
+        messages.append(TextMessage(content=task or "", source="user"))
+    return messages
+
+
+def _fit_history_to_budget(
+    history_summary: Optional[str],
+    prev_messages: list[ChatMessageHistory],
+    token_budget: int = CHAT_HISTORY_TOKEN_BUDGET,
+) -> Tuple[Optional[str], list[ChatMessageHistory]]:
+    """
+    Keeps the rolling summary plus as many of the most recent turns as fit in the budget.
+    Single oversized turns are clipped first, the summary gets at most half the budget.
+    """
+    summary = _truncate_to_tokens(history_summary, token_budget // 2) if history_summary else None
+    remaining = token_budget - (_count_tokens(summary) if summary else 0)
+
+    kept: list[ChatMessageHistory] = []
+    for msg in reversed(prev_messages):
+        message = _truncate_to_tokens(msg.message, CHAT_MESSAGE_TOKEN_LIMIT)
+        cost = _count_tokens(f"{msg.source}: {message}")
+        if cost > remaining:
+            break
+        kept.append(ChatMessageHistory(source=msg.source, message=message))
+        remaining -= cost
+    kept.reverse()
+    return summary, kept
+
+
+def _critique_context_window(
+    context: list[CritiqueItineraryContext],
+    token_budget: int = CRITIQUE_CONTEXT_TOKEN_BUDGET,
+) -> str:
+    """
+    The critique history as compact JSON: one advisory per country and the last decision.
+    The itinerary itself is sent as the task. Over budget, the last feedback and the advisory
+    summaries are clipped (evenly across countries), then the whole text as a last resort.
+    """
+    compact = compact_critique_history(context)
+    if not compact:
+        return ""
+    entry = compact[0]
+    advisories = json.loads(entry.travel_advise) if entry.travel_advise else []
+    last_decision = {"decision": entry.decision, "feedback": entry.feedback} if entry.decision else None
+
+    def _render() -> str:
+        return json.dumps({"travel_advise": advisories, "last_decision": last_decision}, ensure_ascii=False)
+
+    window = _render()
+    if _count_tokens(window) <= token_budget:
+        return window
+    if last_decision and last_decision["feedback"]:
+        last_decision["feedback"] = _truncate_to_tokens(last_decision["feedback"], token_budget // 4)
+    if advisories:
+        overhead = _count_tokens(json.dumps([{**a, "summary": ""} for a in advisories]))
+        per_country = max(32, (token_budget * 3 // 4 - overhead) // len(advisories))
+        for advisory in advisories:
+            if advisory.get("summary"):
+                advisory["summary"] = _truncate_to_tokens(advisory["summary"], per_country)
+    return _truncate_to_tokens(_render(), token_budget)
+
+
+class _JsonStringFieldStreamer:
+    """
+    Incrementally decodes one string field out of a streamed JSON object, so structured
+    output agents can stream the user facing text ("response") instead of raw JSON.
+    """
+
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self, field: str) -> None:
+        self._start = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._raw = ""
+        self._emitted = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Adds a raw chunk and returns the newly decoded part of the field value.
+        """
+        self._raw += chunk
+        if self._done:
+            return ""
+        match = self._start.search(self._raw)
+        if not match:
+            return ""
+
+        decoded: list[str] = []
+        i = match.end()
+        while i < len(self._raw):
+            c = self._raw[i]
+            if c == '"':
+                self._done = True
+                break
+            if c == "\\":
+                # Stop before an escape sequence that isn't complete yet
+                if i + 1 >= len(self._raw):
+                    break
+                escaped = self._raw[i + 1]
+                if escaped == "u":
+                    if i + 6 > len(self._raw):
+                        break
+                    decoded.append(chr(int(self._raw[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                decoded.append(self._ESCAPES.get(escaped, escaped))
+                i += 2
+                continue
+            decoded.append(c)
+            i += 1
+
+        text = "".join(decoded)
+        new_text = text[self._emitted:]
+        self._emitted = len(text)
+        return new_text
+
+
+async def _run_agent(
+    agent: AssistantAgent,
+    task,
+    stream_session_id: Optional[str] = None,
+    stream_field: Optional[str] = None,
+) -> TaskResult:
+    """
+    Runs the agent; with a stream_session_id the model stream is pushed to the session's UI
+    channel as it arrives (only `stream_field` of structured outputs). The agent must be
+    created with model_client_stream=True for chunks to be produced.
+    """
+    if not stream_session_id:
+        return await agent.run(task=task)
+
+    from pois.stream_publisher import ClientLiStreamPublisher
+
+    publisher = ClientLiStreamPublisher(stream_session_id)
+    extractor = _JsonStringFieldStreamer(stream_field) if stream_field else None
+    result: Optional[TaskResult] = None
+    async for item in agent.run_stream(task=task):
+        if isinstance(item, ModelClientStreamingChunkEvent):
+            mark_first_token()
+            text = extractor.feed(item.content) if extractor else item.content
+            if text:
+                await publisher.push(text)
+        elif isinstance(item, TaskResult):
+            result = item
+    await publisher.flush()
+    if result is None:
+        raise RuntimeError(f"{agent.name} stream ended without a result")
+    return result
+
+
+async def initial_chat_agent(
+    message: str,
+    prev_messages: list[ChatMessageHistory],
+    history_summary: Optional[str] = None,
+    stream_session_id: Optional[str] = None,
+) -> ChatConversationResult:
+    """
+    Lorenzo, the chat agent collecting the itinerary requirements. With a stream_session_id
+    the response text is streamed to the session's UI channel while it is generated.
+    """
+    system_message = """
     You are Lorenzo, a friendly  and experienced travel assistant, that have traveled the world, and have a bit crazy but charismatic personality.
     You help users plan their trip itinerary and your mission is to interrogate the user until you have covered the **Minimal information required** (see bellow) for making a travel itinerary  so the system can provide them with the best possible travel plan.
 
@@ -94,47 +311,96 @@ async def initial_chat_agent(message: str, prev_messages: list[ChatMessageHistor
 """
 
     # ---- Inject conversation history WITHOUT altering prompt instructions ----
+    # The system message stays byte-identical across calls so providers can serve it
+    # from their prompt prefix cache; per-session context follows it as a message.
+    history_summary, prev_messages = _fit_history_to_budget(history_summary, prev_messages)
+    context_parts: list[str] = []
+    if history_summary:
+        context_parts.append(f"[Summary of the earlier conversation - for context only]\n{history_summary}")
     history_block = _format_prev_messages_for_system(prev_messages)
     if history_block:
-        system_message += f"""
+        context_parts.append(f"[Conversation History - for context only]\n{history_block}")
+
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="Lorenzo",
+            model_client=get_model_client(*route),
+            system_message=system_message,
+            output_content_type=ChatConversationResult,
+            model_client_stream=stream_session_id is not None,
+        )
+        return await _run_agent(
+            agent,
+            _with_context_messages(context_parts, message),
+            stream_session_id=stream_session_id,
+            stream_field="response",
+        )
 
-    [Conversation History - for context only]
-    {history_block}
-"""
+    # A streamed answer is not hedged (it would stream twice); a fallback restarts the stream
+    result = await routed_call("initial_chat_agent", _default_routes(), _call, hedge=stream_session_id is None)
 
-    llm_model = create_gemini_model_client()
+    msg = result.messages[-1]
+    content = msg.content
 
-    agent = AssistantAgent(
-        name="Lorenzo",
-        model_client=llm_model,
-        system_message=system_message,
-        output_content_type=ChatConversationResult,
-    )
+    if isinstance(content, ChatConversationResult):
+        return content
+    return content
 
-    try:
-        result = await agent.run(task=message)
 
-        msg = result.messages[-1]
-        content = msg.content
 
-        if isinstance(content, ChatConversationResult):
-            return content
-        return content
-    finally:
-        await llm_model.close()
+async def summarize_chat_history(
+    previous_summary: Optional[str],
+    messages: list[ChatMessageHistory],
+) -> str:
+    """
+    Folds older conversation turns into the running summary of the chat, so Lorenzo's
+    prompt keeps a bounded size as the conversation grows.
+    """
+    system_message = """
+You maintain the running summary of a conversation between a traveler and Lorenzo, a travel assistant.
+You receive the current summary (may be empty) and the next conversation turns, in order.
+Return an updated summary, in English, that merges both. Keep:
+- Destinations (cities, countries), trip dates or duration, interests, companions (including pets), budget
+- The user's language
+- Decisions and feedback from the itinerary critique (accepted, refine reasons, warnings), without raw JSON
+- POIs already suggested, by name only
+- Questions asked to the user that are still unanswered
+Drop greetings, jokes and repetition. Later turns override earlier information.
+Return only the summary text, at most 250 words.
+"""
+    task = "\n".join([
+        f"Current summary:\n{previous_summary or '(empty)'}",
+        "",
+        "Next conversation turns:",
+        _format_prev_messages_for_system(messages),
+    ])
+
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="chat_history_summarizer",
+            model_client=get_model_client(*route),
+            system_message=system_message,
+        )
+        return await agent.run(task=task)
 
+    result = await routed_call("summarize_chat_history", _default_routes(), _call)
+    summary = result.messages[-1].content
+    return _truncate_to_tokens(str(summary).strip(), CHAT_HISTORY_TOKEN_BUDGET // 2)
 
 
-async def critize_user_itinerary(itinerary: str, context: list[CritiqueItineraryContext]) -> CritiqueItineraryResult:
+async def critize_user_itinerary(
+    itinerary: str,
+    context: list[CritiqueItineraryContext],
+    prechecks: Optional[ItineraryPrecheck] = None,
+) -> CritiqueItineraryResult:
     """
-    Agent that reviews the produced itinerary and approves it or request changes if something needs improvement
+    Agent that reviews the produced itinerary and approves it or request changes if something needs improvement.
+    `prechecks` are the results of the deterministic checks (pois/itinerary_prechecks.py).
     """
 
-    context_window = ""
-    if context:
-        context_window = f"{json.dumps([p.model_dump() for p in context])}"
+    context_window = _critique_context_window(context)
 
-    SYSTEM_INSTRUCTIONS = f"""
+    SYSTEM_INSTRUCTIONS = """
     You are the travel search itinerary expert reviewer and critic.
     Your mission is to  review if the provided summary (in English) contains the minimal required information and complies with the rules 
 
@@ -152,11 +418,16 @@ async def critize_user_itinerary(itinerary: str, context: list[CritiqueItinerary
     - All the information in the trip itinerary must be complete and accurate enough and not contain any gaps.
     - You have to validate the  the countries mentioned in the itinerary summary with the travel advise information. If any of those says "No Travel",  you must reply with "decision": "refine" and provide a feedback , in natural language, of what countries are a no-go and why
         
+    [Pre-checks]
+    A "prechecks" message may precede the itinerary. It holds the results of automatic checks of the summary: the countries found, the trip dates and duration (duration_days), the known stay per country (stay_days), the countries at advisory level 4 (do_not_travel) and 3 (reconsider_travel), and the information not found (missing).
+    Trust its dates, durations and advisory levels. Keyword detection can miss information, so double check the "missing" entries against the summary.
+
     Process:
-    1. Review all the entries of your context to see if the countries mentioned in the itinerary are present in any previous travel_advise field and contains enough travel advise information (ignore errors or irrelevant content). If you have the information for some countries, use it to validate the Hard Rules (see instructions bellow)
+    1. Review your context: "travel_advise" holds the travel advise already known, one entry per country, and "last_decision" your previous decision and feedback on an earlier version of the itinerary. Check if the countries mentioned in the itinerary have an entry with enough travel advise information (ignore errors or irrelevant content). If you have the information for some countries, use it to validate the Hard Rules (see instructions bellow)
     2. Only if you don't already have enough travel_advise information in your context for a country (or set of countries) present in in the summary, require the system to fetch them by setting your decision to 'use_tool' and adding the following 'tool_params' to your response (DO NOT call this tool again if you already have the travel advise information in your context):
             - url https://travel.state.gov/en/international-travel/travel-advisories.html
             - query: Natural language description of which countries in the itinerary you are missing travel advise information for. Do not include those that you already have found in your context, in the previous step.
+            - countries: The list of those same country names (in English), one entry per country. Each country is looked up separately.
     3. If the travel advise is "Do Not travel" for even just one of the countries, your decision is 'refine'; explain the previous agent that the user must chose another destination due to safety concerns, detailing the countries and reasons.
     4. If the advise is NOT a "Do Not Travel" level but it does contain warnings, your decision is 'warning'; explain the previous agent the warnings to be aware of, detailing the countries and reasons in your feedback field.
     5. Identify if there is  any missing minimal information required for making a travel itinerary. If so, your decision is 'refine' and a natural language  description in EN for the previous agent so it can collect the missing information.
@@ -171,49 +442,40 @@ async def critize_user_itinerary(itinerary: str, context: list[CritiqueItinerary
      - tool_params Parameters used for doing a web lookup on the travel advise website on the us. Required if the decision is 'use_tool', null otherwise
      - Important: Do not use the tool to find travel advise for countries that you already have in your context history. Only you may only call it for those countries that you need and you don't have any entries yet in your context 
 
-     context:
-     {context_window}
+     Your context is sent in the message before the itinerary.
     """
 
- #   llm_client = create_gemini_model_client()
+ #   llm_client = get_model_client()
 
-    llm_client = OpenAIChatCompletionClient(
-    model="gpt-5.2",
-    api_key=os.environ["OPEN_AI_API_KEY"],  # note: .env var name
-    model_info={
-        "vision": False,
-       "function_calling": True,
-        "json_output": True,
-        "structured_output": True,
-        "family": ModelFamily.GPT_5,
-    },
-)
+    # Static instructions stay in the system prompt (cacheable prefix), the context and the
+    # itinerary follow as messages
+    task = f"Review this itinerary:\n{itinerary}"
 
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="ItineraryCritic",
+            model_client=get_model_client(*route),
+            system_message=SYSTEM_INSTRUCTIONS,
+            output_content_type=CritiqueItineraryResult,
+        )
+        context_parts = [f"context:\n{context_window}"] if context_window else []
+        if prechecks is not None:
+            context_parts.append(f"prechecks:\n{prechecks.model_dump_json(exclude_defaults=True)}")
+        return await agent.run(task=_with_context_messages(context_parts, task))
 
-    agent = AssistantAgent(
-        name="ItineraryCritic",
-        model_client=llm_client,
-        system_message=SYSTEM_INSTRUCTIONS,
-        output_content_type=CritiqueItineraryResult,
-    )
-
-    try:
-        # Only pass the current itinerary in the task, context is in memory
-        task = f"Review this itinerary:\n{itinerary}"
-        run_result = await agent.run(task=task)
+    run_result = await routed_call("critize_user_itinerary", CRITIC_ROUTES, _call)
 
-        final_msg = run_result.messages[-1]
-        content = final_msg.content
-        return content
-    finally:
-        await llm_client.close()
+    final_msg = run_result.messages[-1]
+    content = final_msg.content
+    return content
 
 
 
-async def propose_poi_query(user_request: str) -> Tuple[Dict[str, Any], dict]:
+async def propose_poi_query(user_request: str, use_cache: bool = True) -> Tuple[Dict[str, Any], dict]:
     """
     Agent that converts a natural-language travel request into structured params
-    for our Google Places tool.
+    for our Google Places tool. Identical requests are served from the response cache
+    unless use_cache is False.
     """
     system_message = """
 You are a travel research assistant that prepares parameters for a
@@ -243,24 +505,32 @@ Given the user's request, you must:
    - If the user doesnt specify a city, you may search for popular destinations matching the requested country.
 """
 
-    llm_client = create_gemini_model_client()
-
-    agent = AssistantAgent(
-        name="poi_search_planner_agent",
-        model_client=llm_client,
-        system_message=system_message,
-        output_content_type= QueryPOIParams
-    )
-    
-    try:
-        result = await agent.run(
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_search_planner_agent",
+            model_client=get_model_client(*route),
+            system_message=system_message,
+            output_content_type= QueryPOIParams
+        )
+        return await agent.run(
             task = user_request
         )
+
+    async def _run() -> QueryPOIParams:
+        result = await routed_call("propose_poi_query", _default_routes(), _call)
         msg = result.messages[-1]
         text = msg.content
         return text
-    finally:
-        await llm_client.close()
+
+    return await cached_llm_call(
+        agent="propose_poi_query",
+        model=_primary_model("propose_poi_query"),
+        system_prompt=system_message,
+        input_message=user_request,
+        compute=_run,
+        output_type=QueryPOIParams,
+        use_cache=use_cache,
+    )
 
 
 
@@ -308,70 +578,348 @@ You MUST respond with the pure JSON contents  only, not extra markdown nor comme
    #    api_key=os.getenv("OPEN_AI_API_KEY","")
  #)
 
-    llm_client = create_gemini_model_client("gemini-2.5-pro")
-    
-    agent = AssistantAgent(
-        name="poi_review_agent",
-        model_client=llm_client,
-        system_message=system_message,
-        output_content_type=POIReview,
-    )
     msg = StructuredMessage[POIReviewInput](content=input, source="user")
-    try:
-        result = await agent.run(task = [msg])
-        msg = result.messages[-1]
-        text = msg.content
-        return text
-    finally:
-       await llm_client.close()
 
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_review_agent",
+            model_client=get_model_client(*route),
+            system_message=system_message,
+            output_content_type=POIReview,
+        )
+        return await agent.run(task = [msg])
 
-async def summarize_poi_results(
-   input: POISummaryInput
-) -> str:
-    """
-    Summarizes a list of POIs into a brief text summary.
-    """
-    system_message = """
+    result = await routed_call("review_poi_results", REVIEW_ROUTES, _call)
+    msg = result.messages[-1]
+    text = msg.content
+    return text
+
+
+SUMMARY_SYSTEM_MESSAGE = """
 You are a helpful travel assistant with a charismatic personality that must do the following:
 1. Explain all the given POIs to the user in an engaging summary of each one highlighting the best aspects of them.
 2. Do not omit any POIs; include all provided in your response.
 3. Write your narrative in a friendly and appealing manner, suitable for a travel itinerary, in the user's language inferred from the request.
+4. When a route_plan is given, present the POIs day by day, in the order of each day's poi_ids.
 
 You receive:
 - original user request
 - the list of POIs returned (name, address, category, rating, etc.)
+- optionally the route_plan: the POIs' place ids grouped by trip day, in walking order
+"""
+
+SUMMARY_CHUNK_SYSTEM_MESSAGE = """
+You are a helpful travel assistant with a charismatic personality writing ONE section of a longer travel summary.
+1. Start the section with a short heading naming the group (city, category or trip day) you receive in your context; present the POIs in the order given.
+2. Explain all the given POIs in an engaging way, highlighting the best aspects of each one.
+3. Do not omit any POIs; include all provided in your response.
+4. Do NOT write a greeting, an introduction to the whole trip or a closing; other sections and the intro/outro are written separately.
+5. Write in the user's language (user_language).
+
+You receive:
+- original user request
+- the POIs of this section (name, address, category, rating, etc.)
+"""
+
+SUMMARY_FRAME_SYSTEM_MESSAGE = """
+You are a helpful travel assistant with a charismatic personality. A travel summary is being written section by section
+(one per trip day, city or category); your task is to write only its frame:
+- intro: 2-3 sentences presenting the selection as a whole, referring to the user's request and the sections it covers.
+- outro: 1-2 sentences of friendly wrap-up.
+Do not describe individual POIs. Write in the user's language.
+
+You receive the original user request, the user language and the section names with their POI names.
 """
-    llm_client = create_gemini_model_client()
-    agent = AssistantAgent(
-        name="poi_summarization_agent",
-        model_client=llm_client,
-        system_message=system_message,
+
+
+POI_BLURB_SYSTEM_MESSAGE = """
+You are a helpful travel assistant with a charismatic personality writing short descriptions of points of interest.
+For EACH POI you receive write one blurb of 2-3 engaging sentences highlighting its best aspects.
+Rules:
+- Write in the language given as user_language.
+- Describe the place itself only: do not address a specific traveller, their dates or their plans, the blurb is reused for other users.
+- Do not omit any POI; return exactly one blurb per POI, with the POI's id.
+"""
+
+
+def _poi_group_key(poi: DestinationPOI) -> str:
+    """
+    City of the POI parsed from its formatted address ("Street, 00184 Roma RM, Italy" -> "Roma"),
+    falling back to its category when the address has no usable city part.
+    """
+    parts = [p.strip() for p in poi.address.split(",") if p.strip()]
+    if len(parts) >= 2:
+        # Drop postal codes and short region codes around the city name
+        words = [w for w in parts[-2].split() if not any(c.isdigit() for c in w) and not (w.isupper() and len(w) <= 3)]
+        if words:
+            return " ".join(words)
+    return poi.category or "other"
+
+
+def _chunk_pois(
+    pois: list[DestinationPOI],
+    chunk_size: int = SUMMARY_CHUNK_SIZE,
+    route_plan: Optional[RoutePlan] = None,
+) -> list[Tuple[str, list[DestinationPOI]]]:
+    """
+    Groups POIs by city (or category), in order of first appearance, and splits groups
+    larger than chunk_size. The order is deterministic for a given POI list.
+    With a route plan the groups are its days instead, each in walking order; POIs the plan
+    doesn't cover keep their city group after the days.
+    """
+    groups: Dict[str, list[DestinationPOI]] = {}
+    by_id = {poi.id: poi for poi in pois}
+    for day in route_plan.days if route_plan else []:
+        stops = [by_id.pop(poi_id) for poi_id in day.poi_ids if poi_id in by_id]
+        if stops:
+            groups[f"Day {day.day}"] = stops
+    for poi in pois:
+        if poi.id in by_id:
+            groups.setdefault(_poi_group_key(poi), []).append(poi)
+
+    chunks: list[Tuple[str, list[DestinationPOI]]] = []
+    for name, group in groups.items():
+        for i in range(0, len(group), chunk_size):
+            chunks.append((name, group[i:i + chunk_size]))
+    return chunks
+
+
+async def _summarize_poi_chunk(input: POISummaryInput, group: str, use_cache: bool) -> str:
+    msg = StructuredMessage[POISummaryInput](content=input, source="user")
+    context = f"Section group: {group}"
+
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_summarization_chunk_agent",
+            model_client=get_model_client(*route),
+            system_message=SUMMARY_CHUNK_SYSTEM_MESSAGE,
+        )
+        return await agent.run(task=[TextMessage(content=context, source="context"), msg])
+
+    async def _run() -> str:
+        result = await routed_call("summarize_poi_results", _default_routes(), _call)
+        return str(result.messages[-1].content).strip()
+
+    return await cached_llm_call(
+        agent="summarize_poi_results",
+        model=_primary_model("summarize_poi_results"),
+        system_prompt=SUMMARY_CHUNK_SYSTEM_MESSAGE,
+        input_message=f"{context}\n{msg.to_model_text()}",
+        compute=_run,
+        use_cache=use_cache,
+    )
+
+
+async def _summarize_poi_frame(
+    input: POISummaryInput,
+    chunks: list[Tuple[str, list[DestinationPOI]]],
+    use_cache: bool,
+) -> POISummaryFrame:
+    sections = "\n".join(f"- {group}: {', '.join(p.name for p in pois)}" for group, pois in chunks)
+    task = "\n".join([
+        f"User request: {input.user_request}",
+        f"User language: {input.user_language}",
+        f"Sections:\n{sections}",
+    ])
+
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_summary_frame_agent",
+            model_client=get_model_client(*route),
+            system_message=SUMMARY_FRAME_SYSTEM_MESSAGE,
+            output_content_type=POISummaryFrame,
+        )
+        return await agent.run(task=task)
+
+    async def _run() -> POISummaryFrame:
+        result = await routed_call("summarize_poi_results", _default_routes(), _call)
+        return result.messages[-1].content
+
+    return await cached_llm_call(
+        agent="summarize_poi_results",
+        model=_primary_model("summarize_poi_results"),
+        system_prompt=SUMMARY_FRAME_SYSTEM_MESSAGE,
+        input_message=task,
+        compute=_run,
+        output_type=POISummaryFrame,
+        use_cache=use_cache,
+    )
+
+
+async def _summarize_poi_results_chunked(input: POISummaryInput, use_cache: bool) -> str:
+    """
+    Map-reduce summary: every chunk and the intro/outro run concurrently (bounded by
+    SUMMARY_CHUNK_CONCURRENCY), so wall-clock time follows the slowest chunk instead of
+    the total length. Sections are stitched in chunk order, whatever order they finish in.
+    """
+    chunks = _chunk_pois(input.pois, route_plan=input.route_plan)
+    semaphore = asyncio.Semaphore(max(1, SUMMARY_CHUNK_CONCURRENCY))
+
+    async def _bounded(coro):
+        async with semaphore:
+            return await coro
+
+    frame, *sections = await asyncio.gather(
+        _bounded(_summarize_poi_frame(input, chunks, use_cache)),
+        *(
+            _bounded(_summarize_poi_chunk(
+                POISummaryInput(user_language=input.user_language, user_request=input.user_request, pois=pois),
+                group,
+                use_cache,
+            ))
+            for group, pois in chunks
+        ),
+    )
+    print(f"[summarize_poi_results] Summarized {len(input.pois)} POIs in {len(chunks)} chunks")
+    return "\n\n".join([frame.intro.strip(), *sections, frame.outro.strip()])
+
+
+def _blurb_key(poi: DestinationPOI, language: str) -> str:
+    return f"{poi.id}:{language.strip().lower()}:{POI_BLURB_STYLE_VERSION}"
+
+
+async def _generate_poi_blurbs(pois: list[DestinationPOI], language: str) -> Dict[str, str]:
+    """
+    Writes blurbs for the given POIs in one call, returns place_id -> blurb.
+    """
+    payload = json.dumps(
+        {
+            "user_language": language,
+            "pois": [p.model_dump(include={"id", "name", "address", "category", "rating", "description"}) for p in pois],
+        },
+        ensure_ascii=False,
+    )
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_blurb_agent",
+            model_client=get_model_client(*route),
+            system_message=POI_BLURB_SYSTEM_MESSAGE,
+            output_content_type=POIBlurbBatch,
+        )
+        return await agent.run(task=payload)
+
+    result = await routed_call("summarize_poi_results", _default_routes(), _call)
+    batch: POIBlurbBatch = result.messages[-1].content
+    wanted = {p.id for p in pois}
+    return {b.id: b.blurb.strip() for b in batch.blurbs if b.id in wanted and b.blurb.strip()}
+
+
+def _compose_poi_summary(
+    frame: POISummaryFrame,
+    chunks: list[Tuple[str, list[DestinationPOI]]],
+    blurbs: Dict[str, str],
+) -> str:
+    sections: Dict[str, list[str]] = {}
+    for group, pois in chunks:
+        lines = sections.setdefault(group, [f"### {group}"])
+        for poi in pois:
+            # POIs the model skipped fall back to their plain data instead of failing the summary
+            text = blurbs.get(poi.id) or poi.description or f"{poi.category}, {poi.address}"
+            rating = f" ({poi.rating}★)" if poi.rating else ""
+            lines.append(f"- **{poi.name}**{rating}: {text}")
+    parts = [frame.intro.strip(), *("\n".join(lines) for lines in sections.values()), frame.outro.strip()]
+    return "\n\n".join(parts)
+
+
+async def _summarize_poi_results_from_blurbs(input: POISummaryInput, use_cache: bool) -> str:
+    """
+    Composes the summary from per-POI blurbs: cached blurbs are reused, the missing ones are
+    generated in concurrent chunks alongside the intro/outro pass and cached for later sessions.
+    """
+    keys = {poi.id: _blurb_key(poi, input.user_language) for poi in input.pois}
+    cached = await get_cached_values("poi_blurb", list(keys.values())) if use_cache else {}
+    blurbs = {poi_id: cached[key] for poi_id, key in keys.items() if key in cached}
+
+    missing = [poi for poi in input.pois if poi.id not in blurbs]
+    chunks = _chunk_pois(input.pois, route_plan=input.route_plan)
+    semaphore = asyncio.Semaphore(max(1, SUMMARY_CHUNK_CONCURRENCY))
+
+    async def _bounded(coro):
+        async with semaphore:
+            return await coro
+
+    frame, *generated = await asyncio.gather(
+        _bounded(_summarize_poi_frame(input, chunks, use_cache)),
+        *(
+            _bounded(_generate_poi_blurbs(pois, input.user_language))
+            for _, pois in _chunk_pois(missing)
+        ),
+    )
+    new_blurbs: Dict[str, str] = {}
+    for batch in generated:
+        new_blurbs.update(batch)
+    if use_cache:
+        await set_cached_values("poi_blurb", {keys[poi_id]: blurb for poi_id, blurb in new_blurbs.items()})
+    blurbs.update(new_blurbs)
+
+    print(
+        f"[summarize_poi_results] {len(input.pois)} POIs: {len(input.pois) - len(missing)} cached blurbs, "
+        f"{len(new_blurbs)} generated"
     )
+    return _compose_poi_summary(frame, chunks, blurbs)
+
+
+async def summarize_poi_results(
+   input: POISummaryInput,
+   use_cache: bool = True,
+   stream_session_id: Optional[str] = None,
+) -> str:
+    """
+    Summarizes a list of POIs into a brief text summary.
+    The same request, language and POI set is served from the response cache unless use_cache is False.
+    With a stream_session_id, a freshly generated summary is streamed to the session's UI channel.
+    Selections above SUMMARY_CHUNK_THRESHOLD POIs are summarized in concurrent chunks instead
+    (not streamed, the sections complete out of order).
+    With POI_BLURB_CACHE_ENABLED, selections above POI_BLURB_MIN_POIS are composed from cached
+    per-POI blurbs instead, only POIs without a blurb in the user's language are sent to the model.
+    """
+    if POI_BLURB_CACHE_ENABLED and len(input.pois) > max(POI_BLURB_MIN_POIS, SUMMARY_CHUNK_THRESHOLD):
+        return await _summarize_poi_results_from_blurbs(input, use_cache)
+    if len(input.pois) > SUMMARY_CHUNK_THRESHOLD:
+        return await _summarize_poi_results_chunked(input, use_cache)
+
     msg = StructuredMessage[POISummaryInput](content=input, source="user")
-    try:
-        result = await agent.run(task = [msg])
-        msg = result.messages[-1]
-        text = msg.content
+
+    async def _call(route: Route) -> TaskResult:
+        agent = AssistantAgent(
+            name="poi_summarization_agent",
+            model_client=get_model_client(*route),
+            system_message=SUMMARY_SYSTEM_MESSAGE,
+            model_client_stream=stream_session_id is not None,
+        )
+        return await _run_agent(agent, [msg], stream_session_id=stream_session_id)
+
+    async def _run() -> str:
+        result = await routed_call("summarize_poi_results", _default_routes(), _call, hedge=stream_session_id is None)
+        text = result.messages[-1].content
         return text
-    finally:
-       await llm_client.close()
+
+    return await cached_llm_call(
+        agent="summarize_poi_results",
+        model=_primary_model("summarize_poi_results"),
+        system_prompt=SUMMARY_SYSTEM_MESSAGE,
+        input_message=msg.to_model_text(),
+        compute=_run,
+        use_cache=use_cache,
+    )
 
 
 async def generate_update_title(
     update_content: str,
     user_language: str,
+    use_cache: bool = True,
 ) -> str:
     """
     Tiny agent that generates a brief title for update messages in the user's language.
     Creates a short, descriptive title (3-5 words) explaining what action is being taken.
+    Repeated (content, language) pairs are served from the response cache unless use_cache is False.
     """
-    system_message = f"""
+    system_message = """
 You are a helpful assistant that creates brief titles for update messages.
 Your task is to generate a very short, descriptive title (3-5 words maximum) that summarizes what's happening.
 
 Rules:
-- Write in {user_language} language
+- Write in the user language you receive
 - Keep titles extremely short (3-5 words maximum)
 - Be descriptive but concise
 - Examples: "Refining search", "Finding places", "Reviewing results", "Expanding search area"
@@ -393,55 +941,102 @@ Generate a brief, descriptive title.
     
     task = "\n".join(context_parts)
     
-    # Use the cheap Gemini model via AssistantAgent
-    llm_client = create_gemini_model_client()
-    
-    agent = AssistantAgent(
-        name="update_title_agent",
-        model_client=llm_client,
-        system_message=system_message,
-    )
-    
-    try:
-        result = await agent.run(task=task)
+    async def _call(route: Route) -> TaskResult:
+        # Use the cheap Gemini model via AssistantAgent
+        agent = AssistantAgent(
+            name="update_title_agent",
+            model_client=get_model_client(*route),
+            system_message=system_message,
+        )
+        return await agent.run(task=task)
+
+    async def _run() -> str:
+        result = await routed_call("generate_update_title", _default_routes(), _call)
         msg = result.messages[-1]
         content = msg.content
         return content
-    finally:
-        await llm_client.close()
+
+    return await cached_llm_call(
+        agent="generate_update_title",
+        model=_primary_model("generate_update_title"),
+        system_prompt=system_message,
+        input_message=task,
+        compute=_run,
+        use_cache=use_cache,
+    )
+
+
+async def _bounded_lookup(
+    params: CritiqueItineraryToolParams,
+    surfer: Any,
+    timeout: Optional[float],
+    deadline: Optional[float],
+) -> str:
+    """
+    Runs the lookup team within `timeout` seconds, and never past the `deadline`
+    (time.monotonic()); the clock starts here, once the browser is ready.
+    """
+    limits = [t for t in (timeout, deadline - time.monotonic() if deadline is not None else None) if t is not None]
+    if not limits:
+        return await _run_advisory_lookup_team(params, surfer)
+    limit = min(limits)
+    if limit <= 0:
+        raise asyncio.TimeoutError("no time left before the activity deadline")
+    try:
+        return await asyncio.wait_for(_run_advisory_lookup_team(params, surfer), timeout=limit)
+    except asyncio.TimeoutError:
+        raise asyncio.TimeoutError(f"no answer within {limit:.0f}s") from None
 
 
 async def travel_advisory_lookup(
     params: CritiqueItineraryToolParams,
+    timeout: Optional[float] = None,
+    deadline: Optional[float] = None,
 ) -> str:
     """
     Two-agent team: WebSurfer finds data, Summarizer filters it and terminates.
+    `timeout` and `deadline` (time.monotonic()) bound the browsing itself, waiting for a
+    pooled browser doesn't count.
     """
-    #flash_client = create_gemini_model_client()
+    # The browser stack (Playwright) is only loaded by processes that actually browse
+    from autogen_ext.agents.web_surfer import MultimodalWebSurfer
+    from pois.tools.browser_pool import BROWSER_POOL_ENABLED, get_browser_pool
+
+    #flash_client = get_model_client()
+
+    if not BROWSER_POOL_ENABLED:
+        surfer = MultimodalWebSurfer(
+            name="WebSurfer",
+            model_client=get_model_client("openai", "gpt-4o-2024-08-06"),
+            headless=False,
+            start_page=params.url,
+            use_ocr= False
+        )
+        try:
+            return await _bounded_lookup(params, surfer, timeout, deadline)
+        finally:
+            await surfer.close()
+
+    # Warm browser from the worker's pool; the pool closes the context on checkin, so
+    # surfer.close() (which would stop the shared playwright) must not be called
+    async with get_browser_pool().checkout() as (playwright, context):
+        surfer = MultimodalWebSurfer(
+            name="WebSurfer",
+            model_client=get_model_client("openai", "gpt-4o-2024-08-06"),
+            start_page=params.url,
+            use_ocr= False,
+            playwright=playwright,
+            context=context,
+        )
+        return await _bounded_lookup(params, surfer, timeout, deadline)
 
-    client = OpenAIChatCompletionClient(
-        model="gpt-4o-2024-08-06",
-        api_key=os.environ["OPEN_AI_API_KEY"],
-    )
-    summarizer_client = OpenAIChatCompletionClient(
-        model="gpt-4o-mini",
-        api_key=os.environ["OPEN_AI_API_KEY"],
-        model_info={
-            "vision": False,
-            "function_calling": False,
-            "json_output": False,
-            "structured_output": False,
-            "family": ModelFamily.GPT_4
-        }
-    )
 
-    surfer = MultimodalWebSurfer(
-        name="WebSurfer",
-        model_client=client,
-        headless=False,
-        start_page=params.url,
-        use_ocr= False
-    )
+async def _run_advisory_lookup_team(params: CritiqueItineraryToolParams, surfer: Any) -> str:
+    from autogen_core.memory import ListMemory
+    from autogen_agentchat.teams import RoundRobinGroupChat
+    from autogen_agentchat.conditions import TextMentionTermination
+
+    client = get_model_client("openai", "gpt-4o-2024-08-06")
     summarizer_memory = ListMemory()
     summarizer = AssistantAgent(
         name="Summarizer",
@@ -468,16 +1063,15 @@ async def travel_advisory_lookup(
     - Summarize the contents from WebSurfer relevant to answer the query
     """
 
-    try:
-        run_result = await team.run(task=task)
-        # We return the last message content (from the Summarizer)
-        final_output = str(run_result.messages[-1].content)
-        # Strip the TERMINATE keyword from the result sent to the workflow
-        if len(final_output) < 2:
-            raise RuntimeError("Couldn't find the information for the query, please try again")
-        return final_output.replace("TERMINATE", "").strip()
-    finally:
-        await surfer.close()
-        await client.close()
-        await summarizer_client.close()
-    #    await flash_client.close()
+    # The whole browsing session is one ledger entry, its model calls are summed up
+    run_result = await tracked_call(
+        "travel_advisory_lookup",
+        ("openai", "gpt-4o-2024-08-06"),
+        lambda: team.run(task=task),
+    )
+    # We return the last message content (from the Summarizer)
+    final_output = str(run_result.messages[-1].content)
+    # Strip the TERMINATE keyword from the result sent to the workflow
+    if len(final_output) < 2:
+        raise RuntimeError("Couldn't find the information for the query, please try again")
+    return final_output.replace("TERMINATE", "").strip()
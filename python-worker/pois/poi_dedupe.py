@@ -0,0 +1,178 @@
+"""
+Entity resolution of POIs: merges listings of the same place under different place ids
+(entrances, sub-venues, alternative names such as "Louvre Museum" and "Musée du Louvre -
+Pyramid"). POIs are bucketed in a grid of the merge distance, so only neighbouring cells are
+compared, and pairs that are close and similarly named are joined with union-find.
+Deterministic, no I/O and numpy free: imported by the activity and workflow modules, which
+only load numpy in the processes that need it.
+"""
+import math
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, FrozenSet, List, Tuple
+
+from pois.tools.google_places_tool import DestinationPOI
+
+POI_DEDUPE_ENABLED = os.getenv("POI_DEDUPE_ENABLED", "true").lower() in ("1", "true", "yes")
+POI_DEDUPE_DISTANCE_M = float(os.getenv("POI_DEDUPE_DISTANCE_M", "150"))
+POI_DEDUPE_NAME_SIMILARITY = float(os.getenv("POI_DEDUPE_NAME_SIMILARITY", "0.7"))
+
+# Same radius as pois.distance_matrix.haversine_km
+_EARTH_RADIUS_M = 6_371_008.8
+
+# Words that don't tell two places apart; translations map to one form
+_STOPWORDS = {"the", "of", "and", "de", "du", "des", "la", "le", "les", "l", "d", "el", "los", "las", "del", "di", "da", "dos", "das", "der", "die", "van", "von", "st", "saint", "san", "santa"}
+_GENERIC = {
+    "musee": "museum", "museo": "museum", "museu": "museum", "museum": "museum", "muzeum": "museum",
+    "eglise": "church", "iglesia": "church", "chiesa": "church", "church": "church", "kirche": "church",
+    "cathedrale": "cathedral", "catedral": "cathedral", "cattedrale": "cathedral", "cathedral": "cathedral",
+    "palais": "palace", "palacio": "palace", "palazzo": "palace", "palace": "palace",
+    "parc": "park", "parque": "park", "parco": "park", "park": "park", "jardin": "garden", "jardim": "garden", "garden": "garden", "gardens": "garden",
+    "chateau": "castle", "castillo": "castle", "castello": "castle", "castle": "castle",
+    "place": "square", "plaza": "square", "piazza": "square", "square": "square",
+    "tour": "tower", "torre": "tower", "tower": "tower", "pont": "bridge", "puente": "bridge", "ponte": "bridge", "bridge": "bridge",
+    "entrance": "entrance", "entree": "entrance", "entrada": "entrance", "ingresso": "entrance", "gate": "entrance",
+}
+# A restaurant named after a landmark next to it is another place
+_VENUE_WORDS = {"cafe", "restaurant", "bar", "bistro", "brasserie", "pub", "hotel", "hostel", "shop", "store", "boutique", "bakery", "parking", "station"}
+_VENUE_CATEGORIES = {"restaurant", "cafe", "bar", "bakery", "lodging", "store", "shopping_mall", "parking", "food", "meal_takeaway", "night_club", "transit_station"}
+
+
+def normalize_name(name: str) -> str:
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def _name_tokens(name: str) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """
+    (distinctive tokens, generic tokens) of a name: "Musée du Louvre" -> ({louvre}, {museum})
+    """
+    distinctive, generic = set(), set()
+    for token in normalize_name(name).split():
+        if token in _STOPWORDS:
+            continue
+        if token in _GENERIC:
+            generic.add(_GENERIC[token])
+        else:
+            distinctive.add(token)
+    return frozenset(distinctive), frozenset(generic)
+
+
+def name_similarity(a: str, b: str) -> float:
+    """
+    Highest of: containment of the distinctive words of one name in the other's, their
+    Jaccard index, and their character similarity.
+    """
+    (dist_a, gen_a), (dist_b, gen_b) = _name_tokens(a), _name_tokens(b)
+    if not dist_a or not dist_b:
+        # Names made of generic words only ("Grand Palais" -> {grand}, {palace}): compare all words
+        dist_a, dist_b = dist_a | gen_a, dist_b | gen_b
+        if not dist_a or not dist_b:
+            return 0.0
+    common = len(dist_a & dist_b)
+    token_score = max(common / min(len(dist_a), len(dist_b)), common / len(dist_a | dist_b))
+    # Spelling variants of the distinctive words ("Colosseo" / "Colosseum")
+    char_score = SequenceMatcher(None, " ".join(sorted(dist_a)), " ".join(sorted(dist_b))).ratio()
+    return max(token_score, char_score)
+
+
+def _is_venue(poi: DestinationPOI) -> bool:
+    return poi.category in _VENUE_CATEGORIES or bool(set(normalize_name(poi.name).split()) & _VENUE_WORDS)
+
+
+def _similar_places(a: DestinationPOI, b: DestinationPOI, min_similarity: float) -> bool:
+    """
+    The name side of `same_place`, for POIs already known to be close.
+    """
+    if a.id == b.id:
+        return True
+    if _is_venue(a) != _is_venue(b):
+        return False
+    return name_similarity(a.name, b.name) >= min_similarity
+
+
+def _distance_m(a: DestinationPOI, b: DestinationPOI) -> float:
+    """
+    Great-circle distance of one pair, the scalar form of pois.distance_matrix.haversine_km.
+    """
+    lat1, lat2 = math.radians(a.lat), math.radians(b.lat)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(b.lng - a.lng) / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h)))
+
+
+def same_place(a: DestinationPOI, b: DestinationPOI, max_distance_m: float, min_similarity: float) -> bool:
+    if a.id == b.id:
+        return True
+    return _distance_m(a, b) <= max_distance_m and _similar_places(a, b, min_similarity)
+
+
+def _signal(poi: DestinationPOI) -> Tuple[int, float, bool, bool]:
+    return (poi.user_ratings_total or 0, poi.rating or 0.0, bool(poi.description), bool(poi.photo_url))
+
+
+def _find(parents: List[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def dedupe_pois(
+    pois: List[DestinationPOI],
+    max_distance_m: float = POI_DEDUPE_DISTANCE_M,
+    min_similarity: float = POI_DEDUPE_NAME_SIMILARITY,
+) -> List[DestinationPOI]:
+    """
+    One POI per place, in order of first appearance. The record with the most ratings is kept
+    for each cluster, its missing description/url/photo are filled from the others.
+    """
+    if not POI_DEDUPE_ENABLED:
+        return list({p.id: p for p in pois}.values())
+    if len(pois) < 2:
+        return list(pois)
+
+    # Cells at least max_distance wide everywhere: the longitude step uses the highest latitude
+    lat_step = max_distance_m / 111_320.0
+    max_lat = min(max(abs(p.lat) for p in pois), 89.0)
+    lng_step = lat_step / max(math.cos(math.radians(max_lat)), 0.01)
+    grid: Dict[Tuple[int, int], List[int]] = {}
+    for i, poi in enumerate(pois):
+        grid.setdefault((math.floor(poi.lat / lat_step), math.floor(poi.lng / lng_step)), []).append(i)
+
+    parents = list(range(len(pois)))
+    first_by_id: Dict[str, int] = {}
+    for i, poi in enumerate(pois):
+        if poi.id in first_by_id:
+            parents[_find(parents, i)] = _find(parents, first_by_id[poi.id])
+        else:
+            first_by_id[poi.id] = i
+
+    for (row, col), members in grid.items():
+        neighbours = [j for dr in (-1, 0, 1) for dc in (-1, 0, 1) for j in grid.get((row + dr, col + dc), ())]
+        for i in members:
+            for j in neighbours:
+                if j <= i:
+                    continue
+                root_i, root_j = _find(parents, i), _find(parents, j)
+                if root_i != root_j and same_place(pois[i], pois[j], max_distance_m, min_similarity):
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters: Dict[int, List[DestinationPOI]] = {}
+    for i, poi in enumerate(pois):
+        clusters.setdefault(_find(parents, i), []).append(poi)
+
+    merged: List[DestinationPOI] = []
+    for members in clusters.values():
+        best = max(members, key=_signal)
+        missing = {
+            field: next((getattr(m, field) for m in members if getattr(m, field)), None)
+            for field in ("description", "url", "photo_url")
+            if not getattr(best, field)
+        }
+        missing = {field: value for field, value in missing.items() if value}
+        merged.append(best.model_copy(update=missing) if missing else best)
+    if len(merged) < len(pois):
+        print(f"[poi_dedupe] Merged {len(pois)} POIs into {len(merged)}")
+    return merged
@@ -50,12 +50,46 @@ class POIReviewInput(BaseModel):
         None, description="Context history of previous reviews to consider"
     )
     last_error: Optional[str] = Field(None, description="Last error message from the POI search tool, if any")
+    attempt: Optional[int] = Field(None, description="Search attempt number of this review, starting at 1")
+
+
+class RoutePlanRequest(BaseModel):
+    pois: List[DestinationPOI] = Field(..., description="Selected POIs to distribute over the trip days")
+    days: Optional[int] = Field(None, description="Trip length in days, when known")
+    trip_description: Optional[str] = Field(None, description="Itinerary text the trip length is read from when days is not given")
+
+
+class DayRoute(BaseModel):
+    day: int = Field(..., description="Day number, starting at 1")
+    poi_ids: List[str] = Field(..., description="Place ids of the day's POIs in visiting order")
+    distance_km: float = Field(..., description="Great-circle length of the day's path")
+    travel_minutes: Optional[float] = Field(None, description="Estimated travel time of the day's path, with a travel time provider")
+
+
+class RoutePlan(BaseModel):
+    days: List[DayRoute] = Field(default_factory=list, description="Routes in day order")
+    total_distance_km: float = Field(0.0, description="Sum of the day routes' lengths")
 
 
 class POISummaryInput(BaseModel):
     user_language: str = Field(..., description = "The language in which the summary must be written")
     user_request: str = Field(..., description="Original user request for POIs")
     pois: List[DestinationPOI] = Field(..., description="Final list of selected POIs to summarize")
+    route_plan: Optional[RoutePlan] = Field(None, description="Day by day visiting order of the POIs, when planned")
+
+
+class POISummaryFrame(BaseModel):
+    intro: str = Field(..., description="Short opening paragraph presenting the selection as a whole")
+    outro: str = Field(..., description="Short closing paragraph with a friendly wrap-up")
+
+
+class POIBlurb(BaseModel):
+    id: str = Field(..., description="placeId of the POI the blurb describes")
+    blurb: str = Field(..., description="Engaging 2-3 sentence description of the POI")
+
+
+class POIBlurbBatch(BaseModel):
+    blurbs: List[POIBlurb]
 
 
 
@@ -79,6 +113,7 @@ class CritiqueFeedbackMessage(BaseModel):
 class CritiqueItineraryToolParams(BaseModel):
     url: str
     query: str = Field(..., description="Natural language description of which countries are in the list that you are looking information about.") 
+    countries: Optional[List[str]] = Field(None, description="Names of the countries to look up, in English, one per entry")
 
 class CritiqueItineraryResult(BaseModel):
     decision: str = Field(..., decription = "The decision of the initial itinerary critique. Should be 'approve' if everything is complete and follows the rules, 'refine' if something must be refined or 'use_tool' if you need to fetch external information"),
@@ -89,7 +124,7 @@ class CritiqueItineraryResult(BaseModel):
 
 class CritiqueItineraryWebResults(BaseModel):
     url: Optional[str] = Field(..., description="URL where the advisory was found")
-    country: str = Field(..., description="Country name as shown on the site")
+    country: str = Field(..., description="Country name as shown on the site, empty when the countries were not known")
     advises: str = Field(..., description="Natural language advisory summary for this country")
     level: Optional[str] = Field(None, description="If available (e.g., Level 4 - Do Not Travel)")
 
@@ -99,6 +134,36 @@ class CritiqueItineraryWebLookupResult(BaseModel):
     termination_state: Optional[str]
 
 
+class TravelAdvisory(BaseModel):
+    country: str = Field(..., description="Country name as shown on the advisories page")
+    level: int = Field(..., ge=1, le=4, description="Advisory level, 4 is Do Not Travel")
+    level_label: str = Field(..., description="e.g. Exercise Increased Caution")
+    summary: str = Field(..., description="Short advisory summary")
+    url: Optional[str] = Field(None, description="Country advisory page")
+    source_updated_at: Optional[str] = Field(None, description="Date the source last updated the advisory (ISO date when parseable)")
+    fetched_at: str = Field(..., description="ISO timestamp of the ingestion that produced this entry")
+
+
+class CachedTravelAdvisory(BaseModel):
+    country: str
+    advises: str = Field(..., description="Advisory text found by the browser lookup")
+    level: Optional[str] = Field(None, description="e.g. Level 4 - Do Not Travel, when known")
+    url: Optional[str] = Field(None, description="Page the advisory was read from")
+    looked_up_at: str = Field(..., description="ISO timestamp of the lookup")
+
+
+class ItineraryPrecheck(BaseModel):
+    countries: List[str] = Field(default_factory=list, description="Countries recognized in the itinerary")
+    start_date: Optional[str] = Field(None, description="ISO start date, when found")
+    end_date: Optional[str] = Field(None, description="ISO end date, when found")
+    duration_days: Optional[int] = Field(None, description="Trip length from the dates or a stated duration")
+    stay_days: Dict[str, int] = Field(default_factory=dict, description="Known length of stay per country")
+    do_not_travel: List[str] = Field(default_factory=list, description="Countries at advisory level 4")
+    reconsider_travel: List[str] = Field(default_factory=list, description="Countries at advisory level 3")
+    missing: List[str] = Field(default_factory=list, description="Required information not found")
+    refine_reasons: List[str] = Field(default_factory=list, description="Failed hard checks, answered without the model")
+
+
 class CritiqueItineraryContext(BaseModel):
     itinerary: str
     decision: Optional[str]
@@ -113,7 +178,29 @@ class ChatConversationRequest(BaseModel):
     message: Optional[str]
     history: list[ChatMessageHistory]
     critique_feedback: Optional[CritiqueFeedbackMessage] = None
+    history_summary: Optional[str] = Field(None, description="Running summary of the turns no longer sent verbatim in history")
+
+class ChatHistorySummaryRequest(BaseModel):
+    previous_summary: Optional[str] = None
+    messages: list[ChatMessageHistory]
 
 class GenerateUpdateTitleRequest(BaseModel):
     content: str
     user_language: str
+    refine_attempt: Optional[int] = Field(None, description="Search attempt the update belongs to, for usage accounting")
+
+
+class UsageTotals(BaseModel):
+    calls: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+    wall_seconds: float = 0.0
+    ttft_seconds: float = Field(0.0, description="Sum of the time to first token of the calls")
+
+
+class SessionUsageSummary(BaseModel):
+    total: UsageTotals = UsageTotals()
+    by_activity: Dict[str, UsageTotals] = {}
@@ -0,0 +1,126 @@
+"""
+Local pre-ranking of POI candidates before the reviewer agent. Candidates accumulate across
+search attempts; only the top-K by a cheap deterministic score are sent for review.
+Scores are computed with numpy over all candidates at once.
+"""
+import os
+import time
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from pois.distance_matrix import haversine_km
+from pois.tools.google_places_tool import DestinationPOI
+
+POI_RANKING_ENABLED = os.getenv("POI_RANKING_ENABLED", "true").lower() in ("1", "true", "yes")
+POI_RANKING_TOP_K = int(os.getenv("POI_RANKING_TOP_K", "40"))
+# Bayesian rating: ratings are pulled towards the candidates' mean as if each had this many extra votes
+POI_RANKING_PRIOR_VOTES = float(os.getenv("POI_RANKING_PRIOR_VOTES", "50"))
+# Each further candidate of an already represented category has its score multiplied by this
+POI_RANKING_DIVERSITY_DECAY = float(os.getenv("POI_RANKING_DIVERSITY_DECAY", "0.85"))
+# Distance at which the proximity score halves; 0 uses the candidates' median distance to the centroid
+POI_RANKING_DISTANCE_SCALE_KM = float(os.getenv("POI_RANKING_DISTANCE_SCALE_KM", "0"))
+RATING_WEIGHT = float(os.getenv("POI_RANKING_RATING_WEIGHT", "0.5"))
+CATEGORY_WEIGHT = float(os.getenv("POI_RANKING_CATEGORY_WEIGHT", "0.3"))
+PROXIMITY_WEIGHT = float(os.getenv("POI_RANKING_PROXIMITY_WEIGHT", "0.2"))
+
+
+def bayesian_ratings(ratings: np.ndarray, votes: np.ndarray, prior_votes: float = POI_RANKING_PRIOR_VOTES) -> np.ndarray:
+    """
+    (v * R + m * C) / (v + m) with C the vote weighted mean rating; unrated candidates get C.
+    """
+    rated = ~np.isnan(ratings) & (votes > 0)
+    ratings = np.where(rated, ratings, 0.0)
+    votes = np.where(rated, votes, 0.0)
+    mean = float((ratings * votes).sum() / votes.sum()) if votes.sum() else 0.0
+    return (votes * ratings + prior_votes * mean) / (votes + prior_votes)
+
+
+def category_matches(pois: List[DestinationPOI], poi_types: Optional[List[str]], query: Optional[str]) -> np.ndarray:
+    """
+    1 for a category among the searched poi_types, 0.5 when the name/category shares a word with
+    the query, else 0. Neutral (all 1) when the search had neither.
+    """
+    types = {t.lower() for t in poi_types or []}
+    words = {w for w in (query or "").lower().split() if len(w) > 3}
+    if not types and not words:
+        return np.ones(len(pois))
+    type_match = np.fromiter((p.category.lower() in types for p in pois), dtype=float, count=len(pois))
+    query_match = np.fromiter(
+        (bool(words & set(f"{p.name} {p.category.replace('_', ' ')}".lower().split())) for p in pois),
+        dtype=float,
+        count=len(pois),
+    )
+    return np.maximum(type_match, 0.5 * query_match)
+
+
+def centroid_distances_km(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distance of every candidate to the median point of all candidates, a
+    stand-in for the city center that ignores results from the wrong city.
+    """
+    return haversine_km(lat, lng, np.median(lat, keepdims=True), np.median(lng, keepdims=True))[:, 0]
+
+
+def _ranks_within_category(categories: List[str], scores: np.ndarray) -> np.ndarray:
+    """
+    0 for the best candidate of each category, 1 for the second best, ...
+    """
+    _, category_ids = np.unique(np.array(categories, dtype=object).astype(str), return_inverse=True)
+    order = np.lexsort((-scores, category_ids))
+    sorted_ids = category_ids[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_ids)) + 1]
+    group_start = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    ranks = np.empty(len(scores), dtype=int)
+    ranks[order] = np.arange(len(order)) - group_start
+    return ranks
+
+
+def score_pois(
+    pois: List[DestinationPOI],
+    poi_types: Optional[List[str]] = None,
+    query: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Weighted rating/category/proximity score of each candidate in [0, 1], with a diversity
+    decay for candidates of categories that already have better ones.
+    """
+    ratings = np.array([p.rating if p.rating is not None else np.nan for p in pois], dtype=float)
+    votes = np.array([p.user_ratings_total or 0 for p in pois], dtype=float)
+    lat = np.array([p.lat for p in pois], dtype=float)
+    lng = np.array([p.lng for p in pois], dtype=float)
+
+    distances = centroid_distances_km(lat, lng)
+    scale = POI_RANKING_DISTANCE_SCALE_KM or max(float(np.median(distances)), 1.0)
+    proximity = 1.0 / (1.0 + (distances / scale) ** 2)
+
+    base = (
+        RATING_WEIGHT * bayesian_ratings(ratings, votes) / 5.0
+        + CATEGORY_WEIGHT * category_matches(pois, poi_types, query)
+        + PROXIMITY_WEIGHT * proximity
+    )
+    return base * POI_RANKING_DIVERSITY_DECAY ** _ranks_within_category([p.category for p in pois], base)
+
+
+def rank_pois(
+    pois: List[DestinationPOI],
+    poi_types: Optional[List[str]] = None,
+    query: Optional[str] = None,
+    top_k: int = POI_RANKING_TOP_K,
+    keep_ids: Iterable[str] = (),
+) -> List[DestinationPOI]:
+    """
+    The top_k candidates by score, best first. Candidates in keep_ids (already selected by the
+    reviewer) are always kept and come first. Lists within top_k are returned unchanged.
+    """
+    if len(pois) <= top_k:
+        return pois
+    started = time.perf_counter()
+    scores = score_pois(pois, poi_types, query)
+    keep_set = set(keep_ids)
+    keep = np.fromiter((p.id in keep_set for p in pois), dtype=bool, count=len(pois))
+    # Kept candidates first, then by score
+    order = np.lexsort((-scores, ~keep))
+    chosen = order[: max(top_k, int(keep.sum()))]
+    print(f"[poi_ranking] Kept {len(chosen)} of {len(pois)} candidates in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return [pois[i] for i in chosen]
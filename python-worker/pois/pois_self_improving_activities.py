@@ -1,9 +1,29 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any
 
 from temporalio import activity
 
 from pois.tools.google_places_tool import DestinationPOI, search_google_places
-from common.get_redis import get_redis
+from common.get_redis import publish_batched
+from common.llm_usage import usage_scope, get_session_usage
+from pois.stream_publisher import clientli_channel, streaming_enabled
+from pois.poi_dedupe import dedupe_pois
+from pois.itinerary_prechecks import PRECHECKS_ENABLED, precheck_decision, run_itinerary_prechecks
+from pois.travel_advisories import (
+    advisories_for_text,
+    cache_lookups,
+    find_countries,
+    format_advisories_for_critic,
+    get_cached_lookups,
+    known_country_names,
+    normalize_country,
+    refresh_advisory_index,
+)
 from pois.poi_models import ClientLiEvent
 import json
 
@@ -15,51 +35,307 @@ from pois.poi_models import (
     ChatConversationResult, 
     ChatMessageHistory,
     ChatConversationRequest,
+    ChatHistorySummaryRequest,
     CritiqueItineraryRequest,
+    CritiqueItineraryContext,
     CritiqueItineraryResult,
     CritiqueItineraryToolParams,
     CritiqueItineraryWebLookupResult,
-    GenerateUpdateTitleRequest
-)
-from pois.poi_agents import (
-    propose_poi_query,
-    review_poi_results,
-    summarize_poi_results,
-    initial_chat_agent,
-    critize_user_itinerary,
-    travel_advisory_lookup,
-    generate_update_title
+    CritiqueItineraryWebResults,
+    CachedTravelAdvisory,
+    TravelAdvisory,
+    GenerateUpdateTitleRequest,
+    RoutePlan,
+    RoutePlanRequest,
+    SessionUsageSummary,
 )
 
+
+def _stream_session_id() -> Optional[str]:
+    """
+    Session whose UI channel receives streamed tokens. Workflows are started with the
+    Chainlit session id as workflow id.
+    """
+    return activity.info().workflow_id if streaming_enabled() else None
+
+
+def _usage_scope(refine_attempt: Optional[int] = None):
+    """
+    Tags the model calls of the running activity in the usage ledger.
+    """
+    info = activity.info()
+    return usage_scope(
+        session_id=info.workflow_id,
+        activity=info.activity_type,
+        refine_attempt=refine_attempt,
+        retry_attempt=info.attempt,
+    )
+
+
+def _agents():
+    """
+    The agents module pulls in autogen, the model clients and the browser stack.
+    It is imported on first activity execution so importing this module (e.g. from the
+    workflow sandbox or the UI process) stays cheap.
+    """
+    import pois.poi_agents as poi_agents
+    return poi_agents
+
+
 @activity.defn
 async def initial_chat_activity(params: ChatConversationRequest) -> ChatConversationResult:
     """
     Initiates / continues a conversation and emits a ChatConversationResult, which contains either
     the user summary for search , or a follow up message to the user 
     """
-    conversation_result = await initial_chat_agent(params.message, params.history)
+    with _usage_scope():
+        conversation_result = await _agents().initial_chat_agent(
+            params.message,
+            params.history,
+            params.history_summary,
+            stream_session_id=_stream_session_id(),
+        )
     return conversation_result
 
+@activity.defn
+async def summarize_chat_history_activity(params: ChatHistorySummaryRequest) -> str:
+    """
+    Folds older chat turns into the running conversation summary
+    """
+    with _usage_scope():
+        return await _agents().summarize_chat_history(params.previous_summary, params.messages)
+
+async def _itinerary_advisories(itinerary: str) -> tuple:
+    """
+    (fresh index entries, cached browser lookups, unknown countries) of the itinerary's countries.
+    """
+    try:
+        return await advisories_for_text(itinerary)
+    except Exception as e:
+        print(f"[critique] Travel advisory index unavailable: {e}")
+        return [], [], []
+
+
+def _indexed_advisory_context(
+    itinerary: str,
+    advisories: List[TravelAdvisory],
+    cached: List[CachedTravelAdvisory],
+    unresolved: List[str],
+) -> list[CritiqueItineraryContext]:
+    """
+    Advisories of the itinerary's countries from the offline index and from browser lookups
+    cached by any session, as critique context. The critic only asks for a browser lookup
+    for the countries known by neither.
+    """
+    if unresolved:
+        print(f"[critique] No fresh travel advisory for {unresolved}, left to the browser lookup")
+    if not advisories and not cached:
+        return []
+    return [
+        CritiqueItineraryContext(
+            itinerary=itinerary,
+            decision="",
+            feedback=None,
+            travel_advise=format_advisories_for_critic(advisories, cached),
+        )
+    ]
+
+
 @activity.defn
 async def critize_user_itinerary_activity(params: CritiqueItineraryRequest) -> CritiqueItineraryResult:
     """
-    Critizies the initial itinerary draft looking for missing information, and compliance with business policy
+    Critizies the initial itinerary draft looking for missing information, and compliance with business policy.
+    Deterministic pre-checks run first: a failed hard check is answered with "refine" without
+    calling the critic, otherwise their results are passed to it.
     """
-    critize_result = await critize_user_itinerary(
-        itinerary=params.itinerary,
-        context=params.context
-    )
+    advisories, cached, unresolved = await _itinerary_advisories(params.itinerary)
+    prechecks = None
+    if PRECHECKS_ENABLED:
+        prechecks = run_itinerary_prechecks(params.itinerary, advisories, cached, unresolved)
+        decision = precheck_decision(prechecks)
+        if decision is not None:
+            print(f"[critique] Refined by the pre-checks: {prechecks.refine_reasons}")
+            return decision
+
+    context = params.context + _indexed_advisory_context(params.itinerary, advisories, cached, unresolved)
+    with _usage_scope():
+        critize_result = await _agents().critize_user_itinerary(
+            itinerary=params.itinerary,
+            context=context,
+            prechecks=prechecks,
+        )
     return critize_result 
 
+@asynccontextmanager
+async def _heartbeating(interval_seconds: float = 10):
+    """
+    Heartbeats while the block runs, so a worker stuck in a browser is noticed by Temporal
+    (heartbeat timeout) and the activity retried elsewhere, and cancellations reach the block.
+    """
+    async def _beat() -> None:
+        while True:
+            activity.heartbeat()
+            await asyncio.sleep(interval_seconds)
+
+    task = asyncio.create_task(_beat())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+
+# Browser lookups of one activity running at the same time, and the most browsing time a
+# country gets; the activity's own deadline is shared out between the countries below that
+ADVISORY_LOOKUP_CONCURRENCY = int(os.getenv("TRAVEL_ADVISORY_LOOKUP_CONCURRENCY", "2"))
+ADVISORY_COUNTRY_TIMEOUT_SECONDS = float(os.getenv("TRAVEL_ADVISORY_COUNTRY_TIMEOUT_SECONDS", "90"))
+# Kept free at the end of the activity to merge and return the results
+ADVISORY_DEADLINE_RESERVE_SECONDS = float(os.getenv("TRAVEL_ADVISORY_DEADLINE_RESERVE_SECONDS", "10"))
+
+_ADVISORY_LEVEL_RE = re.compile(r"level\s*[1-4][^\n.,;]*", re.IGNORECASE)
+
+
+async def _lookup_countries(params: CritiqueItineraryToolParams) -> List[str]:
+    """
+    Countries the lookup is for: as listed by the critic, else as found in its query.
+    """
+    if params.countries:
+        return list(dict.fromkeys(c.strip() for c in params.countries if c.strip()))
+    try:
+        names = await known_country_names()
+        return [names[key] for key in find_countries(params.query, names)]
+    except Exception as e:
+        print(f"[travel_advisories] Could not resolve the countries of {params.query!r}: {e}")
+        return []
+
+
+def _activity_deadline() -> Optional[float]:
+    """
+    time.monotonic() by which the current activity attempt must have returned, less
+    ADVISORY_DEADLINE_RESERVE_SECONDS; None outside an activity or without a start_to_close timeout.
+    """
+    try:
+        info = activity.info()
+    except RuntimeError:
+        return None
+    if not info.start_to_close_timeout:
+        return None
+    ends_at = info.started_time + info.start_to_close_timeout
+    left = (ends_at - datetime.now(timezone.utc)) / timedelta(seconds=1)
+    return time.monotonic() + left - ADVISORY_DEADLINE_RESERVE_SECONDS
+
+
+def _country_timeout(countries: int, deadline: Optional[float]) -> float:
+    """
+    Browsing time of each country: the time left split over the rounds of
+    ADVISORY_LOOKUP_CONCURRENCY lookups, at most ADVISORY_COUNTRY_TIMEOUT_SECONDS.
+    """
+    if deadline is None or countries <= 0:
+        return ADVISORY_COUNTRY_TIMEOUT_SECONDS
+    rounds = -(-countries // max(1, ADVISORY_LOOKUP_CONCURRENCY))
+    return max(0.0, min(ADVISORY_COUNTRY_TIMEOUT_SECONDS, (deadline - time.monotonic()) / rounds))
+
+
+async def _browse_country_advisory(
+    params: CritiqueItineraryToolParams,
+    country: str,
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+    deadline: Optional[float],
+) -> CachedTravelAdvisory:
+    """
+    Browser lookup of one country, cached for the next sessions. Its `timeout` starts once a
+    browser is checked out, and the lookup never runs past the activity `deadline`.
+    """
+    async with semaphore:
+        browse = _agents().travel_advisory_lookup(
+            params=CritiqueItineraryToolParams(
+                url=params.url,
+                query=f"Current travel advisory level and main risks for {country}",
+                countries=[country],
+            ),
+            timeout=timeout,
+            deadline=deadline,
+        )
+        if deadline is None:
+            text = await browse
+        else:
+            # The deadline also bounds the wait for a pooled browser
+            text = await asyncio.wait_for(browse, timeout=max(0.0, deadline - time.monotonic()))
+    level = _ADVISORY_LEVEL_RE.search(text)
+    lookup = CachedTravelAdvisory(
+        country=country,
+        advises=text,
+        level=level.group(0).strip() if level else None,
+        url=params.url,
+        looked_up_at=datetime.now(timezone.utc).isoformat(),
+    )
+    try:
+        await cache_lookups([lookup])
+    except Exception as e:
+        print(f"[travel_advisories] Failed to cache lookup for {country}: {e}")
+    return lookup
+
+
 @activity.defn
-async def travel_advisory_lookup_activity(params: CritiqueItineraryToolParams) -> str:
+async def travel_advisory_lookup_activity(params: CritiqueItineraryToolParams) -> CritiqueItineraryWebLookupResult:
     """
-    Runs a web lookup into the travels itinerary website and return the information for the requested countries
+    Looks up the travel advisory of each requested country in its own browser task, a few at a
+    time, and merges the results. The time left before the activity's start_to_close deadline
+    is split between the countries (at most TRAVEL_ADVISORY_COUNTRY_TIMEOUT_SECONDS each), so
+    the activity returns partial results instead of timing out. Countries cached by an earlier
+    session are not browsed again. A slow or failing country is reported in `err` without
+    holding back the others; the activity only fails when no country could be looked up.
     """
-    travel_advisory_lookup_result = await travel_advisory_lookup(
-        params=params
+    countries = await _lookup_countries(params)
+    if not countries:
+        # Countries unknown, single lookup of the critic's query. The result has no country and
+        # is not cached: the per-country cache would file it under the free-text query
+        with _usage_scope():
+            async with _heartbeating():
+                text = await _agents().travel_advisory_lookup(params=params, deadline=_activity_deadline())
+        return CritiqueItineraryWebLookupResult(
+            results=[CritiqueItineraryWebResults(url=params.url, country="", advises=text)],
+            err=None,
+            termination_state="complete",
+        )
+
+    try:
+        cached = await get_cached_lookups(countries)
+    except Exception as e:
+        print(f"[travel_advisories] Lookup cache unavailable: {e}")
+        cached = {}
+    to_browse = [c for c in countries if normalize_country(c) not in cached]
+
+    semaphore = asyncio.Semaphore(max(1, ADVISORY_LOOKUP_CONCURRENCY))
+    deadline = _activity_deadline()
+    timeout = _country_timeout(len(to_browse), deadline)
+    with _usage_scope():
+        async with _heartbeating():
+            outcomes = await asyncio.gather(
+                *(_browse_country_advisory(params, country, semaphore, timeout, deadline) for country in to_browse),
+                return_exceptions=True,
+            )
+    browsed = dict(zip(to_browse, outcomes))
+
+    results: List[CritiqueItineraryWebResults] = []
+    errors: List[str] = []
+    for country in countries:
+        outcome = cached.get(normalize_country(country)) or browsed[country]
+        if isinstance(outcome, asyncio.TimeoutError):
+            errors.append(f"{country}: timed out ({outcome})")
+        elif isinstance(outcome, BaseException):
+            errors.append(f"{country}: {outcome!r}")
+        else:
+            results.append(CritiqueItineraryWebResults(
+                url=outcome.url, country=outcome.country, advises=outcome.advises, level=outcome.level
+            ))
+    if not results:
+        raise RuntimeError(f"Travel advisory lookup failed for every country: {'; '.join(errors)}")
+    return CritiqueItineraryWebLookupResult(
+        results=results,
+        err="; ".join(errors) or None,
+        termination_state="partial" if errors else "complete",
     )
-    return travel_advisory_lookup_result
 
 @activity.defn
 async def propose_poi_query_activity(user_request: str) -> QueryPOIParams:
@@ -67,7 +343,8 @@ async def propose_poi_query_activity(user_request: str) -> QueryPOIParams:
     Activity that wraps the parameter-proposing agent.
     Returns (params, usage).
     """
-    params = await propose_poi_query(user_request)
+    with _usage_scope():
+        params = await _agents().propose_poi_query(user_request)
     return params
 
 
@@ -83,7 +360,8 @@ async def google_places_activity_with_params(params: QueryPOIParams) -> List[Des
         max_results=params.max_results,
         poi_types=params.poi_types,
     )
-    return pois
+    # Entrances and alternative listings of the same place come back under other place ids
+    return dedupe_pois(pois)
 
 
 @activity.defn
@@ -94,9 +372,30 @@ async def review_poi_results_activity(
     Activity that wraps the reviewer agent.
     Returns (review_dict, usage_dict).
     """
-    return await review_poi_results(
-        payload
+    payload = _prerank_review_candidates(payload)
+    with _usage_scope(refine_attempt=payload.attempt):
+        return await _agents().review_poi_results(
+            payload
+        )
+
+
+def _prerank_review_candidates(payload: POIReviewInput) -> POIReviewInput:
+    """
+    Keeps the reviewer input to the top POI_RANKING_TOP_K candidates by local score; the
+    candidates accumulate across search attempts. POIs selected so far are always kept.
+    """
+    # numpy is only loaded by the processes running reviews
+    from pois.poi_ranking import POI_RANKING_ENABLED, rank_pois
+
+    if not POI_RANKING_ENABLED:
+        return payload
+    candidates = rank_pois(
+        payload.last_search_pois,
+        poi_types=payload.params.poi_types,
+        query=payload.params.query,
+        keep_ids=[p.id for p in payload.pois_selected_so_far or []],
     )
+    return payload.model_copy(update={"last_search_pois": candidates})
 
 @activity.defn
 async def summarize_pois_activity(
@@ -107,12 +406,29 @@ async def summarize_pois_activity(
     Returns (summary_dict, usage_dict).
     """
 
-    summary = await summarize_poi_results(
-       payload
-    )
+    with _usage_scope():
+        summary = await _agents().summarize_poi_results(
+           payload,
+           stream_session_id=_stream_session_id(),
+        )
     return summary
 
 
+@activity.defn
+def plan_poi_routes_activity(payload: RoutePlanRequest) -> Optional[RoutePlan]:
+    """
+    Splits the selected POIs into trip days and orders each day as a walking path.
+    None when route planning is disabled. Synchronous: CPU bound, hosted on the cpu queue
+    whose worker runs activities in a thread pool.
+    """
+    # numpy is only loaded by the processes planning routes
+    from pois.route_planner import ROUTE_PLANNER_ENABLED, plan_routes
+
+    if not ROUTE_PLANNER_ENABLED:
+        return None
+    return plan_routes(payload.pois, days=payload.days, trip_description=payload.trip_description)
+
+
 @activity.defn
 async def generate_update_title_activity(
     payload: GenerateUpdateTitleRequest
@@ -121,14 +437,29 @@ async def generate_update_title_activity(
     Activity that wraps the update title agent.
     Generates a brief title for update messages in the user's language.
     """
-    return await generate_update_title(
-        update_content=payload.content,
-        user_language=payload.user_language,
-    )
+    with _usage_scope(refine_attempt=payload.refine_attempt):
+        return await _agents().generate_update_title(
+            update_content=payload.content,
+            user_language=payload.user_language,
+        )
 
 
 @activity.defn
 async def publish_clientli_message_activity(event: ClientLiEvent) -> None:
-    redis = get_redis()
-    channel = f"chainlit:poi:events:{event.session_id}"
-    redis.publish(channel, event.model_dump_json())
\ No newline at end of file
+    await publish_batched(clientli_channel(event.session_id), event.model_dump_json())
+
+
+@activity.defn
+async def refresh_travel_advisories_activity() -> int:
+    """
+    Re-ingests the travel advisories page into the offline index, returns the number of countries.
+    """
+    return await refresh_advisory_index()
+
+
+@activity.defn
+async def get_session_usage_activity(session_id: str) -> SessionUsageSummary:
+    """
+    Token, cost and latency totals of the session's model calls, aggregated by the usage ledger.
+    """
+    return SessionUsageSummary.model_validate(await get_session_usage(session_id))
@@ -0,0 +1,198 @@
+"""
+Day by day routes through the selected POIs. The POIs are split into days with
+capacity-constrained k-means over their positions, then each day is ordered as an open
+walking path (nearest neighbour, improved with 2-opt) on the shared distance matrix, in
+the configured provider's unit (great-circle km, or travel minutes).
+Deterministic: the same POIs and trip length always give the same plan.
+"""
+import math
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from pois.distance_matrix import get_distance_matrix
+from pois.itinerary_prechecks import trip_duration_days
+from pois.poi_models import DayRoute, RoutePlan
+from pois.tools.google_places_tool import DestinationPOI
+
+ROUTE_PLANNER_ENABLED = os.getenv("ROUTE_PLANNER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Stops per day when the trip length is unknown
+ROUTE_PLANNER_STOPS_PER_DAY = int(os.getenv("ROUTE_PLANNER_STOPS_PER_DAY", "5"))
+ROUTE_PLANNER_MAX_DAYS = int(os.getenv("ROUTE_PLANNER_MAX_DAYS", "30"))
+
+_EARTH_RADIUS_KM = 6371.0088
+_KMEANS_ITERATIONS = 20
+_TWO_OPT_PASSES = 50
+
+
+def _project(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """
+    Equirectangular km coordinates around the POIs' mean, shape (n, 2); accurate enough to
+    cluster places within a country.
+    """
+    lat_r, lng_r = np.radians(lat), np.radians(lng)
+    lat0 = lat_r.mean()
+    return _EARTH_RADIUS_KM * np.column_stack(((lng_r - lng_r.mean()) * np.cos(lat0), lat_r - lat0))
+
+
+def _initial_centers(points: np.ndarray, k: int) -> np.ndarray:
+    """
+    Farthest-first traversal starting from the point farthest from the mean: spread out like
+    k-means++ seeding, without its randomness.
+    """
+    chosen = [int(np.argmax(((points - points.mean(axis=0)) ** 2).sum(axis=1)))]
+    nearest = ((points - points[chosen[0]]) ** 2).sum(axis=1)
+    for _ in range(k - 1):
+        chosen.append(int(np.argmax(nearest)))
+        nearest = np.minimum(nearest, ((points - points[chosen[-1]]) ** 2).sum(axis=1))
+    return points[chosen].copy()
+
+
+def _assign(points: np.ndarray, centers: np.ndarray, capacity: int) -> np.ndarray:
+    """
+    Nearest center with room left for every point. Points that lose the most by not getting
+    their nearest center choose first.
+    """
+    sq = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    nearest = sq.argmin(axis=1)
+    if np.bincount(nearest, minlength=centers.shape[0]).max() <= capacity:
+        return nearest
+    preferences = np.argsort(sq, axis=1, kind="stable")
+    regret = np.take_along_axis(sq, preferences[:, 1:2], axis=1)[:, 0] - sq.min(axis=1)
+    labels = np.empty(len(points), dtype=int)
+    loads = [0] * centers.shape[0]
+    for i in np.argsort(-regret, kind="stable").tolist():
+        for label in preferences[i].tolist():
+            if loads[label] < capacity:
+                labels[i] = label
+                loads[label] += 1
+                break
+    return labels
+
+
+def cluster_days(points: np.ndarray, days: int) -> np.ndarray:
+    """
+    Day index of every point; no day holds more than ceil(n / days) points.
+    """
+    capacity = math.ceil(len(points) / days)
+    centers = _initial_centers(points, days)
+    labels = _assign(points, centers, capacity)
+    for _ in range(_KMEANS_ITERATIONS):
+        for day in range(days):
+            members = points[labels == day]
+            if len(members):
+                centers[day] = members.mean(axis=0)
+        new_labels = _assign(points, centers, capacity)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    return labels
+
+
+def _nearest_neighbour_path(dist: np.ndarray, start: int) -> np.ndarray:
+    visited = np.zeros(len(dist), dtype=bool)
+    path = [start]
+    visited[start] = True
+    for _ in range(len(dist) - 1):
+        nxt = int(np.argmin(np.where(visited, np.inf, dist[path[-1]])))
+        path.append(nxt)
+        visited[nxt] = True
+    return np.array(path)
+
+
+def _two_opt(path: np.ndarray, dist: np.ndarray) -> np.ndarray:
+    """
+    Open path 2-opt: reverses path[i..j] while that shortens the path, the best j for each i
+    evaluated at once.
+    """
+    m = len(path)
+    if m < 3:
+        return path
+    path = path.copy()
+    for _ in range(_TWO_OPT_PASSES):
+        improved = False
+        for i in range(m - 1):
+            j = np.arange(i + 1, m)
+            has_next = j < m - 1
+            after_j = path[np.minimum(j + 1, m - 1)]
+            removed = np.where(has_next, dist[path[j], after_j], 0.0)
+            added = np.where(has_next, dist[path[i], after_j], 0.0)
+            if i > 0:
+                removed = removed + dist[path[i - 1], path[i]]
+                added = added + dist[path[i - 1], path[j]]
+            gain = removed - added
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                path[i:j[best] + 1] = path[i:j[best] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return path
+
+
+def order_stops(dist: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    Visiting order of one day's stops, as indexes into `dist`. The path starts at the stop
+    farthest from the day's center, so it sweeps across the area instead of out and back.
+    """
+    start = int(np.argmax(((points - points.mean(axis=0)) ** 2).sum(axis=1)))
+    return _two_opt(_nearest_neighbour_path(dist, start), dist)
+
+
+def _path_length(dist: np.ndarray, path: np.ndarray) -> float:
+    return float(dist[path[:-1], path[1:]].sum()) if len(path) > 1 else 0.0
+
+
+def _day_count(n: int, days: Optional[int], trip_description: Optional[str]) -> int:
+    if days is None and trip_description:
+        days = trip_duration_days(trip_description)
+    if days is None:
+        days = math.ceil(n / max(1, ROUTE_PLANNER_STOPS_PER_DAY))
+    return max(1, min(days, n, ROUTE_PLANNER_MAX_DAYS))
+
+
+def plan_routes(
+    pois: List[DestinationPOI],
+    days: Optional[int] = None,
+    trip_description: Optional[str] = None,
+) -> RoutePlan:
+    """
+    Splits the POIs into days and orders each day. Without `days` the trip length is read
+    from `trip_description`, else ROUTE_PLANNER_STOPS_PER_DAY stops per day are planned.
+    Days follow each other by proximity; days left without stops are dropped.
+    """
+    if not pois:
+        return RoutePlan()
+    started = time.perf_counter()
+    lat = np.array([p.lat for p in pois], dtype=float)
+    lng = np.array([p.lng for p in pois], dtype=float)
+    matrix = get_distance_matrix()
+    cost = matrix.matrix(pois)
+    dist = cost if matrix.unit == "km" else get_distance_matrix("great_circle").matrix(pois)
+    points = _project(lat, lng)
+    labels = cluster_days(points, _day_count(len(pois), days, trip_description))
+
+    groups = [np.flatnonzero(labels == day) for day in range(labels.max() + 1)]
+    groups = [g for g in groups if len(g)]
+    # Day order: nearest neighbour over the day centers, from the outermost one
+    centers = np.array([points[g].mean(axis=0) for g in groups])
+    day_order = order_stops(np.sqrt(((centers[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)), centers)
+
+    routes: List[DayRoute] = []
+    for number, g in enumerate(day_order, start=1):
+        members = groups[g]
+        path = members[order_stops(cost[np.ix_(members, members)], points[members])]
+        routes.append(DayRoute(
+            day=number,
+            poi_ids=[pois[i].id for i in path],
+            distance_km=round(_path_length(dist, path), 2),
+            travel_minutes=round(_path_length(cost, path), 1) if matrix.unit == "min" else None,
+        ))
+    plan = RoutePlan(days=routes, total_distance_km=round(sum(r.distance_km for r in routes), 2))
+    print(
+        f"[route_planner] {len(pois)} POIs in {len(routes)} days, {plan.total_distance_km}km, "
+        f"{(time.perf_counter() - started) * 1000:.1f}ms"
+    )
+    return plan
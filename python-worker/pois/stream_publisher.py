@@ -0,0 +1,54 @@
+import os
+import time
+from typing import List
+
+from common.get_redis import publish_batched
+from pois.poi_models import ClientLiEvent
+
+
+def clientli_channel(session_id: str) -> str:
+    return f"chainlit:poi:events:{session_id}"
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
+
+
+class ClientLiStreamPublisher:
+    """
+    Buffers streamed model tokens and publishes them to the session channel at most once
+    per flush interval, as "stream" events. The first event of each publisher is a
+    "stream_start", which tells the UI to drop any partial output of a previous
+    (retried) activity attempt.
+    """
+
+    def __init__(self, session_id: str, flush_interval_seconds: float | None = None) -> None:
+        self.session_id = session_id
+        self.flush_interval_seconds = (
+            flush_interval_seconds
+            if flush_interval_seconds is not None
+            else float(os.getenv("LLM_STREAM_FLUSH_MS", "150")) / 1000
+        )
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        self._started = False
+
+    async def push(self, text: str) -> None:
+        self._buffer.append(text)
+        if time.monotonic() - self._last_flush >= self.flush_interval_seconds:
+            await self.flush()
+
+    async def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        content = "".join(self._buffer)
+        self._buffer.clear()
+        event = ClientLiEvent(
+            session_id=self.session_id,
+            type="stream" if self._started else "stream_start",
+            content=content,
+            is_final=False,
+        )
+        self._started = True
+        await publish_batched(clientli_channel(self.session_id), event.model_dump_json())
@@ -0,0 +1,80 @@
+import os
+from typing import Dict, List
+
+
+# The workflow queue keeps its historical name so already running workflows keep
+# being picked up after a deploy. Activities are routed to dedicated queues by cost
+# class so cheap, latency sensitive steps never wait behind browser sessions.
+WORKFLOW_TASK_QUEUE = os.getenv("POIS_WORKFLOW_TASK_QUEUE", "pois-self-improving-v2")
+IO_TASK_QUEUE = os.getenv("POIS_IO_TASK_QUEUE", f"{WORKFLOW_TASK_QUEUE}-io")
+LLM_TASK_QUEUE = os.getenv("POIS_LLM_TASK_QUEUE", f"{WORKFLOW_TASK_QUEUE}-llm")
+BROWSER_TASK_QUEUE = os.getenv("POIS_BROWSER_TASK_QUEUE", f"{WORKFLOW_TASK_QUEUE}-browser")
+CPU_TASK_QUEUE = os.getenv("POIS_CPU_TASK_QUEUE", f"{WORKFLOW_TASK_QUEUE}-cpu")
+
+# Activity class name -> task queue
+TASK_QUEUES: Dict[str, str] = {
+    "workflow": WORKFLOW_TASK_QUEUE,
+    "io": IO_TASK_QUEUE,
+    "llm": LLM_TASK_QUEUE,
+    "browser": BROWSER_TASK_QUEUE,
+    "cpu": CPU_TASK_QUEUE,
+}
+
+# Activity class name -> activity names hosted on that class' queue
+ACTIVITY_CLASSES: Dict[str, List[str]] = {
+    "workflow": [],
+    "io": [
+        "publish_clientli_message_activity",
+        "google_places_activity_with_params",
+        "get_session_usage_activity",
+        "refresh_travel_advisories_activity",
+    ],
+    "llm": [
+        "initial_chat_activity",
+        "summarize_chat_history_activity",
+        "critize_user_itinerary_activity",
+        "propose_poi_query_activity",
+        "review_poi_results_activity",
+        "summarize_pois_activity",
+        "generate_update_title_activity",
+    ],
+    "browser": [
+        "travel_advisory_lookup_activity",
+    ],
+    # Synchronous numpy work, run in a thread pool so it never blocks the event loop
+    "cpu": [
+        "plan_poi_routes_activity",
+    ],
+}
+
+# Default max concurrent activity slots per class, overridable per worker process
+_DEFAULT_MAX_CONCURRENT_ACTIVITIES: Dict[str, int] = {
+    "workflow": 0,
+    "io": 200,
+    "llm": 20,
+    "browser": 2,
+    "cpu": 2,
+}
+
+
+def max_concurrent_activities(activity_class: str) -> int:
+    """
+    Per-queue concurrency limit, e.g. POIS_LLM_MAX_CONCURRENT_ACTIVITIES=10
+    """
+    env_name = f"POIS_{activity_class.upper()}_MAX_CONCURRENT_ACTIVITIES"
+    return int(os.getenv(env_name, str(_DEFAULT_MAX_CONCURRENT_ACTIVITIES[activity_class])))
+
+
+def worker_activity_classes() -> List[str]:
+    """
+    Activity classes hosted by this process, e.g. POIS_WORKER_CLASSES=workflow,io,llm
+    Defaults to all of them (single process setup).
+    """
+    raw = os.getenv("POIS_WORKER_CLASSES", "")
+    classes = [c.strip() for c in raw.split(",") if c.strip()]
+    if not classes:
+        return list(TASK_QUEUES.keys())
+    unknown = [c for c in classes if c not in TASK_QUEUES]
+    if unknown:
+        raise RuntimeError(f"Unknown POIS_WORKER_CLASSES entries: {unknown}. Valid: {list(TASK_QUEUES.keys())}")
+    return classes
@@ -1,13 +1,15 @@
-from datetime import timedelta
-from typing import Dict, Any, List
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from temporalio.exceptions import ActivityError
 from temporalio.client import Client
 from temporalio.worker import Worker
 
 from pois.workflow_poi_self_improving import SelfImprovingDestinationWorkflow
+from pois.workflow_travel_advisories import TravelAdvisoryIngestionWorkflow, ensure_advisory_ingestion
 from pois.pois_self_improving_activities import (
     initial_chat_activity,
+    summarize_chat_history_activity,
     critize_user_itinerary_activity,
     travel_advisory_lookup_activity,
     publish_clientli_message_activity,
@@ -15,25 +17,118 @@ from pois.pois_self_improving_activities import (
     google_places_activity_with_params,
     review_poi_results_activity,
     summarize_pois_activity,
-    generate_update_title_activity
+    generate_update_title_activity,
+    get_session_usage_activity,
+    refresh_travel_advisories_activity,
+    plan_poi_routes_activity,
 )
+from pois.tools.browser_pool import BROWSER_POOL_ENABLED, get_browser_pool
+from pois.task_queues import (
+    ACTIVITY_CLASSES,
+    BROWSER_TASK_QUEUE,
+    TASK_QUEUES,
+    WORKFLOW_TASK_QUEUE,
+    max_concurrent_activities,
+    worker_activity_classes,
+)
+
+
+ALL_ACTIVITIES = [
+    initial_chat_activity,
+    summarize_chat_history_activity,
+    critize_user_itinerary_activity,
+    travel_advisory_lookup_activity,
+    publish_clientli_message_activity,
+    propose_poi_query_activity,
+    google_places_activity_with_params,
+    review_poi_results_activity,
+    summarize_pois_activity,
+    generate_update_title_activity,
+    get_session_usage_activity,
+    refresh_travel_advisories_activity,
+    plan_poi_routes_activity,
+]
+
 
+def _activities_for_class(activity_class: str) -> list:
+    names = set(ACTIVITY_CLASSES[activity_class])
+    return [a for a in ALL_ACTIVITIES if a.__name__ in names]
 
-def get_pois_worker(client: Client, queue: str = "pois-self-improving-v2") -> Worker:
+
+def get_pois_worker(client: Client, activity_class: str = "workflow") -> Worker:
+    """
+    Worker for a single activity class. The "workflow" class hosts the workflow
+    definitions only; every other class hosts the activities routed to its queue.
+    """
+    queue = TASK_QUEUES[activity_class]
+    if activity_class == "workflow":
+        return Worker(
+            client,
+            task_queue= queue,
+            identity= queue,
+            workflows=[ SelfImprovingDestinationWorkflow, TravelAdvisoryIngestionWorkflow],
+        )
+    max_concurrent = max_concurrent_activities(activity_class)
     return Worker(
         client,
         task_queue= queue,
         identity= queue,
-        workflows=[ SelfImprovingDestinationWorkflow],
-        activities=[
-            initial_chat_activity,
-            critize_user_itinerary_activity,
-            travel_advisory_lookup_activity,
-            publish_clientli_message_activity,
-            propose_poi_query_activity,
-            google_places_activity_with_params,
-            review_poi_results_activity,
-            summarize_pois_activity,
-            generate_update_title_activity
-        ],
-    ) 
\ No newline at end of file
+        activities=_activities_for_class(activity_class),
+        max_concurrent_activities=max_concurrent,
+        # Synchronous activities (the cpu class) run in threads, off the event loop
+        activity_executor=ThreadPoolExecutor(max_workers=max_concurrent) if activity_class == "cpu" else None,
+    )
+
+
+def get_pois_workers(client: Client, activity_classes: Optional[List[str]] = None) -> List[Worker]:
+    """
+    One worker per hosted activity class, defaults to POIS_WORKER_CLASSES (all classes if unset)
+    """
+    classes = activity_classes or worker_activity_classes()
+    return [get_pois_worker(client, c) for c in classes]
+
+
+async def close_worker_resources() -> None:
+    """
+    Releases per-process resources shared by activities (model clients).
+    """
+    from autogen_gemini import close_model_clients
+    from common.llm_cache import get_llm_cache_metrics
+    from common.llm_usage import get_prompt_cache_metrics, get_usage_ledger_metrics
+    from common.llm_limiter import get_llm_limiter_metrics
+    from common.model_router import get_model_router_metrics
+    from pois.tools.browser_pool import close_browser_pool, get_browser_pool_metrics
+    from pois.distance_matrix import get_distance_matrix_metrics
+    from common.get_redis import get_redis_pool_metrics
+
+    print(f"[worker] LLM cache metrics: {get_llm_cache_metrics()}")
+    print(f"[worker] Prompt prefix cache metrics: {get_prompt_cache_metrics()}")
+    print(f"[worker] LLM usage ledger: {get_usage_ledger_metrics()}")
+    print(f"[worker] Model router metrics: {get_model_router_metrics()}")
+    print(f"[worker] LLM concurrency limiter metrics: {get_llm_limiter_metrics()}")
+    print(f"[worker] Browser pool metrics: {get_browser_pool_metrics()}")
+    print(f"[worker] Distance matrix metrics: {get_distance_matrix_metrics()}")
+    print(f"[worker] Redis pool metrics: {get_redis_pool_metrics()}")
+    await close_browser_pool()
+    await close_model_clients()
+
+
+async def main() -> None:
+    from common.temporal_client import get_temporal_client
+
+    client = await get_temporal_client()
+    workers = get_pois_workers(client)
+    print(f"[worker] Hosting queues: {[w.task_queue for w in workers]}")
+    if WORKFLOW_TASK_QUEUE in [w.task_queue for w in workers]:
+        await ensure_advisory_ingestion(client)
+    if BROWSER_TASK_QUEUE in [w.task_queue for w in workers] and BROWSER_POOL_ENABLED:
+        # Browsers are launched before the first lookup needs one
+        await get_browser_pool().start()
+    try:
+        await asyncio.gather(*(w.run() for w in workers))
+    finally:
+        await close_worker_resources()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
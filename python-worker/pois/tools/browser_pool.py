@@ -0,0 +1,252 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+# Worker level pool of pre-launched headless browsers for the web surfer.
+# Each checkout gets a fresh browser context (no cookies/storage of previous sessions),
+# created and warmed up ahead of time; the browser process itself is reused until recycled.
+BROWSER_POOL_ENABLED = os.getenv("BROWSER_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+# Browsers are relaunched after this many checkouts (memory growth, leaked renderer state)
+BROWSER_POOL_MAX_USES = int(os.getenv("BROWSER_POOL_MAX_USES", "20"))
+# Checkouts held longer than this are reclaimed by the reaper (their context is closed)
+BROWSER_POOL_LEASE_TIMEOUT = float(os.getenv("BROWSER_POOL_LEASE_TIMEOUT_SECONDS", "600"))
+BROWSER_POOL_HEADLESS = os.getenv("BROWSER_POOL_HEADLESS", "true").lower() in ("1", "true", "yes")
+# Loaded once in every new context so its HTTP cache already holds the usual entry page
+BROWSER_POOL_WARM_URL = os.getenv("BROWSER_POOL_WARM_URL") or None
+
+_REAPER_INTERVAL_SECONDS = 30
+
+
+class _BrowserSlot:
+    def __init__(self, browser: Any) -> None:
+        self.browser = browser
+        self.context: Any = None
+        self.uses = 0
+        self.leased_at: Optional[float] = None
+
+    def healthy(self) -> bool:
+        return self.context is not None and self.browser.is_connected()
+
+
+class BrowserPool:
+    """
+    Up to `size` browsers, each with one ready context. `checkout()` hands out
+    (playwright, context) for one surfer session; on checkin the context is closed and a new
+    one is prepared in the background, or the browser is relaunched once it reached `max_uses`
+    or died. Slots that fail their health check at checkout are replaced.
+    """
+
+    def __init__(
+        self,
+        size: int = BROWSER_POOL_SIZE,
+        max_uses: int = BROWSER_POOL_MAX_USES,
+        lease_timeout: float = BROWSER_POOL_LEASE_TIMEOUT,
+        headless: bool = BROWSER_POOL_HEADLESS,
+        warm_url: Optional[str] = BROWSER_POOL_WARM_URL,
+    ) -> None:
+        self.size = max(1, size)
+        self.max_uses = max(1, max_uses)
+        self.lease_timeout = lease_timeout
+        self.headless = headless
+        self.warm_url = warm_url
+        self._playwright: Any = None
+        self._idle: "asyncio.Queue[_BrowserSlot]" = asyncio.Queue()
+        self._leased: Dict[int, _BrowserSlot] = {}
+        # Slots alive or being prepared, at most `size`
+        self._slots = 0
+        self._start_lock = asyncio.Lock()
+        self._reaper: Optional["asyncio.Task[None]"] = None
+        self._background: Set["asyncio.Task[None]"] = set()
+        self._counters = {"checkouts": 0, "cold_starts": 0, "launches": 0, "recycled": 0, "unhealthy": 0, "reclaimed": 0}
+        self._total_wait = 0.0
+
+    async def start(self, prewarm: bool = True) -> None:
+        async with self._start_lock:
+            if self._playwright is None:
+                # Playwright is only loaded by processes that actually browse
+                from playwright.async_api import async_playwright
+
+                self._playwright = await async_playwright().start()
+                self._reaper = asyncio.create_task(self._reap())
+        if prewarm:
+            await asyncio.gather(*(self._add_slot() for _ in range(self.size - self._slots)), return_exceptions=True)
+
+    async def _new_context(self, slot: _BrowserSlot) -> None:
+        context = await slot.browser.new_context()
+        if self.warm_url:
+            try:
+                page = await context.new_page()
+                await page.goto(self.warm_url, wait_until="domcontentloaded")
+                await page.close()
+            except Exception as e:
+                print(f"[browser_pool] Warm up of {self.warm_url} failed: {e}")
+        slot.context = context
+
+    async def _launch(self) -> _BrowserSlot:
+        browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._counters["launches"] += 1
+        slot = _BrowserSlot(browser)
+        try:
+            await self._new_context(slot)
+        except BaseException:
+            await _close_quietly(browser)
+            raise
+        return slot
+
+    async def _add_slot(self) -> None:
+        """
+        Launches a browser into the idle queue, in the place of a slot that was dropped.
+        """
+        self._slots += 1
+        try:
+            slot = await self._launch()
+        except BaseException as e:
+            self._slots -= 1
+            print(f"[browser_pool] Browser launch failed: {e!r}")
+            raise
+        self._idle.put_nowait(slot)
+
+    async def _acquire(self) -> _BrowserSlot:
+        started = time.monotonic()
+        while True:
+            if self._idle.empty() and self._slots < self.size:
+                self._counters["cold_starts"] += 1
+                await self._add_slot()
+            try:
+                # Re-checked periodically: a slot whose relaunch failed leaves room for a cold start
+                slot = await asyncio.wait_for(self._idle.get(), timeout=5)
+            except asyncio.TimeoutError:
+                continue
+            if slot.healthy():
+                self._total_wait += time.monotonic() - started
+                return slot
+            self._counters["unhealthy"] += 1
+            self._drop(slot)
+
+    def _drop(self, slot: _BrowserSlot) -> None:
+        self._slots -= 1
+        self._spawn(_close_quietly(slot.browser))
+
+    def _spawn(self, coro: Any) -> None:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _checkin(self, slot: _BrowserSlot) -> None:
+        """
+        Closes the session's context (and with it every page and all storage), then readies
+        the slot for the next checkout.
+        """
+        await _close_quietly(slot.context)
+        slot.context = None
+        slot.leased_at = None
+        slot.uses += 1
+        if slot.uses >= self.max_uses or not slot.browser.is_connected():
+            self._counters["recycled"] += 1
+            self._drop(slot)
+            try:
+                await self._add_slot()
+            except Exception:
+                pass
+            return
+        try:
+            await self._new_context(slot)
+        except Exception as e:
+            print(f"[browser_pool] New context failed, relaunching browser: {e!r}")
+            self._drop(slot)
+            try:
+                await self._add_slot()
+            except Exception:
+                pass
+            return
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def checkout(self) -> AsyncIterator[Tuple[Any, Any]]:
+        """
+        `async with pool.checkout() as (playwright, context):` pass both to the surfer and do
+        not close them, the pool does.
+        """
+        await self.start(prewarm=False)
+        slot = await self._acquire()
+        self._counters["checkouts"] += 1
+        slot.leased_at = time.monotonic()
+        self._leased[id(slot)] = slot
+        try:
+            yield self._playwright, slot.context
+        finally:
+            if self._leased.pop(id(slot), None) is not None:
+                # Checkin in the background: the caller's result doesn't wait for the next context
+                self._spawn(self._checkin(slot))
+
+    async def _reap(self) -> None:
+        """
+        Reclaims slots whose holder is stuck: closing the context fails the holder's browsing.
+        """
+        while True:
+            await asyncio.sleep(_REAPER_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for key, slot in list(self._leased.items()):
+                if slot.leased_at is not None and now - slot.leased_at > self.lease_timeout:
+                    print(f"[browser_pool] Reclaiming browser leased for {now - slot.leased_at:.0f}s")
+                    self._counters["reclaimed"] += 1
+                    del self._leased[key]
+                    self._spawn(self._checkin(slot))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "slots": self._slots,
+            "idle": self._idle.qsize(),
+            "leased": len(self._leased),
+            "avg_wait_seconds": round(self._total_wait / self._counters["checkouts"], 4) if self._counters["checkouts"] else 0.0,
+        }
+
+    async def close(self) -> None:
+        if self._reaper:
+            self._reaper.cancel()
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        slots = list(self._leased.values())
+        while not self._idle.empty():
+            slots.append(self._idle.get_nowait())
+        await asyncio.gather(*(_close_quietly(s.browser) for s in slots), return_exceptions=True)
+        self._leased.clear()
+        self._slots = 0
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+async def _close_quietly(resource: Any) -> None:
+    if resource is None:
+        return
+    try:
+        await resource.close()
+    except Exception:
+        pass
+
+
+_pool: Optional[BrowserPool] = None
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool()
+    return _pool
+
+
+def get_browser_pool_metrics() -> Dict[str, Any]:
+    return _pool.metrics() if _pool else {}
+
+
+async def close_browser_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
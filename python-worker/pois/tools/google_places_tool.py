@@ -3,8 +3,6 @@ import os
 from typing import List, Optional
 from pydantic import BaseModel, Field
 
-import googlemaps
-
 
 class DestinationPOI(BaseModel):
     id: str = Field(..., description="Google's placeId, unique identifier for the POI")
@@ -56,6 +54,9 @@ async def search_google_places(
     if not api_key:
         raise RuntimeError("GOOGLE_PLACES_API_KEY not set in environment")
 
+    # Imported lazily, DestinationPOI is shared with processes that never search
+    import googlemaps
+
     gmaps = googlemaps.Client(key=api_key)
 
     # Default tourist-friendly POI types
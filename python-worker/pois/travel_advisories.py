@@ -0,0 +1,410 @@
+"""
+Offline index of the US travel advisories: country -> level / summary / source date.
+
+Filled by the periodic TravelAdvisoryIngestionWorkflow (or the CLI) from the advisories
+listing page, and read synchronously by the itinerary critique. The browser lookup is only
+the fallback for countries missing from the index or with a stale entry.
+
+    python -m pois.travel_advisories parse saved_page.html     # parse a saved page, print JSON
+    python -m pois.travel_advisories refresh [--html saved_page.html] [--file index.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from pois.poi_models import TravelAdvisory, CachedTravelAdvisory
+
+ADVISORIES_URL = os.getenv(
+    "TRAVEL_ADVISORIES_URL",
+    "https://travel.state.gov/content/travel/en/traveladvisories/traveladvisories.html",
+)
+# Optional JSON copy of the index, used when Redis has no index (or isn't reachable)
+INDEX_PATH = os.getenv("TRAVEL_ADVISORY_INDEX_PATH") or None
+# Entries older than this are treated as missing: the critic falls back to the browser lookup
+MAX_AGE_HOURS = float(os.getenv("TRAVEL_ADVISORY_MAX_AGE_HOURS", "48"))
+# Browser lookup results are shared by all sessions for this long, per country
+LOOKUP_CACHE_TTL_HOURS = float(os.getenv("TRAVEL_ADVISORY_CACHE_TTL_HOURS", "24"))
+# In-process copy of the index, so critiques don't read Redis every time
+_MEMORY_TTL_SECONDS = float(os.getenv("TRAVEL_ADVISORY_MEMORY_TTL_SECONDS", "300"))
+
+ADVISORY_LEVELS: Dict[int, str] = {
+    1: "Exercise Normal Precautions",
+    2: "Exercise Increased Caution",
+    3: "Reconsider Travel",
+    4: "Do Not Travel",
+}
+
+# Names travellers use that don't appear as such on the advisories page
+COUNTRY_ALIASES: Dict[str, str] = {
+    "uk": "united kingdom",
+    "england": "united kingdom",
+    "scotland": "united kingdom",
+    "wales": "united kingdom",
+    "great britain": "united kingdom",
+    "holland": "netherlands",
+    "czechia": "czech republic",
+    "turkiye": "turkey",
+    "ivory coast": "cote d ivoire",
+    "myanmar": "burma",
+    "north korea": "north korea",
+    "dprk": "north korea",
+    "uae": "united arab emirates",
+}
+
+_INDEX_KEY = "travel_advisories:v1:index"
+_LOOKUP_KEY = "travel_advisories:v1:lookup"
+# normalized name -> display name of every country with a cached lookup, so countries
+# missing from the index can still be recognized in itineraries
+_LOOKUP_NAMES_KEY = "travel_advisories:v1:lookup_names"
+_LEVEL_RE = re.compile(r"level\s*([1-4])\s*[:\-–]?\s*([^\n]*)", re.IGNORECASE)
+_memory_index: Tuple[float, Dict[str, TravelAdvisory]] = (0.0, {})
+
+
+def normalize_country(name: str) -> str:
+    """
+    "Côte d'Ivoire" -> "cote d ivoire", "The Bahamas" -> "bahamas"
+    """
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    text = re.sub(r"[^a-z0-9]+", " ", text).strip()
+    return re.sub(r"^the ", "", text)
+
+
+def country_variants(name: str) -> List[str]:
+    """
+    Normalized names a country can be mentioned by: "Burma (Myanmar)" -> burma, myanmar;
+    "Congo, Democratic Republic of the" -> also "democratic republic of the congo";
+    "Mainland China" -> also "china".
+    """
+    base = re.sub(r"\s*\(.*?\)", "", name).replace(" Travel Advisory", "").strip()
+    variants = {normalize_country(base)}
+    variants.update(normalize_country(p) for p in re.findall(r"\((.*?)\)", name))
+    if "," in base:
+        head, _, tail = base.partition(",")
+        variants.add(normalize_country(f"{tail} {head}"))
+    if base.lower().startswith("mainland "):
+        variants.add(normalize_country(base[len("mainland "):]))
+    return sorted(v for v in variants if v)
+
+
+class _TableParser(HTMLParser):
+    """
+    Collects the rows of every <table> as lists of (cell text, first link href).
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[Tuple[str, Optional[str]]]] = []
+        self._row: Optional[List[Tuple[str, Optional[str]]]] = None
+        self._cell: Optional[List[str]] = None
+        self._href: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell, self._href = [], None
+        elif tag == "a" and self._cell is not None and self._href is None:
+            self._href = dict(attrs).get("href")
+        elif tag == "br" and self._cell is not None:
+            self._cell.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._row is not None and self._cell is not None:
+            text = re.sub(r"[ \t\r\f\v]+", " ", "".join(self._cell)).strip()
+            self._row.append((text, self._href))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if self._row:
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _parse_date(text: str) -> Optional[str]:
+    for fmt in ("%B %d, %Y", "%b %d, %Y", "%m/%d/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text.strip(), fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_advisories_html(html: str, source_url: str = ADVISORIES_URL) -> List[TravelAdvisory]:
+    """
+    Parses the advisories listing table (Advisory | Level | Date Updated). Rows without a
+    recognizable "Level N" cell (headers, layout tables) are skipped.
+    """
+    parser = _TableParser()
+    parser.feed(html)
+    fetched_at = datetime.now(timezone.utc).isoformat()
+
+    advisories: Dict[str, TravelAdvisory] = {}
+    for row in parser.rows:
+        level_cell = next(((i, m) for i, (text, _) in enumerate(row) if (m := _LEVEL_RE.search(text))), None)
+        if level_cell is None or level_cell[0] == 0:
+            continue
+        index, match = level_cell
+        country_text, href = row[0]
+        country = re.sub(r"\s*Travel Advisory\s*$", "", country_text.split("\n")[0]).strip()
+        if not country:
+            continue
+        level = int(match.group(1))
+        label = match.group(2).strip() or ADVISORY_LEVELS[level]
+        source_updated_at = None
+        for text, _ in row[index + 1:]:
+            source_updated_at = _parse_date(text) or source_updated_at
+        extra = " ".join(text for text, _ in row[index + 1:] if text and not _parse_date(text))
+        advisories[normalize_country(country)] = TravelAdvisory(
+            country=country,
+            level=level,
+            level_label=label,
+            summary=f"Level {level}: {label}" + (f". {extra}" if extra else ""),
+            url=urljoin(source_url, href) if href else None,
+            source_updated_at=source_updated_at,
+            fetched_at=fetched_at,
+        )
+    return list(advisories.values())
+
+
+async def fetch_advisories_html(url: str = ADVISORIES_URL) -> str:
+    import httpx
+
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True, headers={"User-Agent": "travel-planner-advisory-ingestion"}) as client:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.text
+
+
+async def save_advisory_index(advisories: List[TravelAdvisory], path: Optional[str] = None) -> None:
+    """
+    Replaces the index in Redis (and in the JSON file when configured).
+    """
+    global _memory_index
+    from common.get_redis import get_redis
+
+    entries = {normalize_country(a.country): a.model_dump_json() for a in advisories}
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.delete(_INDEX_KEY)
+        pipe.hset(_INDEX_KEY, mapping=entries)
+        await pipe.execute()
+    path = path or INDEX_PATH
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([a.model_dump() for a in advisories], f, ensure_ascii=False, indent=1)
+    _memory_index = (time.monotonic(), {k: TravelAdvisory.model_validate_json(v) for k, v in entries.items()})
+
+
+async def refresh_advisory_index(url: str = ADVISORIES_URL, html: Optional[str] = None) -> int:
+    """
+    Fetches (unless `html` is given) and parses the advisories page, then replaces the index.
+    Refuses to replace the index with an empty parse, which means the page layout changed.
+    """
+    html = html if html is not None else await fetch_advisories_html(url)
+    advisories = parse_advisories_html(html, url)
+    if not advisories:
+        raise RuntimeError(f"No advisories parsed from {url}, the page layout may have changed")
+    await save_advisory_index(advisories)
+    print(f"[travel_advisories] Indexed {len(advisories)} countries from {url}")
+    return len(advisories)
+
+
+async def load_advisory_index() -> Dict[str, TravelAdvisory]:
+    """
+    Normalized country name -> advisory. Reads Redis (falling back to the JSON file),
+    memoized in-process for TRAVEL_ADVISORY_MEMORY_TTL_SECONDS.
+    """
+    global _memory_index
+    loaded_at, index = _memory_index
+    if index and time.monotonic() - loaded_at < _MEMORY_TTL_SECONDS:
+        return index
+
+    try:
+        from common.get_redis import get_redis
+
+        raw = await get_redis().hgetall(_INDEX_KEY)
+        index = {k: TravelAdvisory.model_validate_json(v) for k, v in raw.items()}
+    except Exception as e:
+        print(f"[travel_advisories] Redis index read failed: {e}")
+        index = {}
+    if not index and INDEX_PATH and os.path.exists(INDEX_PATH):
+        with open(INDEX_PATH, encoding="utf-8") as f:
+            index = {normalize_country(a["country"]): TravelAdvisory.model_validate(a) for a in json.load(f)}
+
+    _memory_index = (time.monotonic(), index)
+    return index
+
+
+def is_stale(advisory: TravelAdvisory, max_age_hours: float = MAX_AGE_HOURS) -> bool:
+    fetched_at = datetime.fromisoformat(advisory.fetched_at)
+    return datetime.now(timezone.utc) - fetched_at > timedelta(hours=max_age_hours)
+
+
+def find_countries(text: str, names: Dict[str, str]) -> List[str]:
+    """
+    Keys of `names` (normalized name -> display name) of the countries mentioned in `text`, in
+    order of first mention. Longer names win over names they contain ("Papua New Guinea" is
+    not also "Guinea").
+    """
+    variants: Dict[str, str] = {}
+    for key, name in names.items():
+        for variant in country_variants(name):
+            variants.setdefault(variant, key)
+    for alias, target in COUNTRY_ALIASES.items():
+        if target in variants:
+            variants.setdefault(alias, variants[target])
+
+    normalized = f" {normalize_country(text)} "
+    found: List[Tuple[int, str]] = []
+    for variant in sorted(variants, key=len, reverse=True):
+        for match in re.finditer(rf" {re.escape(variant)} ", normalized):
+            found.append((match.start(), variants[variant]))
+            # Blank the match so shorter names inside it don't match again
+            normalized = normalized[:match.start() + 1] + "#" * len(variant) + normalized[match.end() - 1:]
+    keys: List[str] = []
+    for _, key in sorted(found):
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+async def known_country_names() -> Dict[str, str]:
+    """
+    normalized name -> display name of the countries in the index or the lookup cache.
+    """
+    names = {key: advisory.country for key, advisory in (await load_advisory_index()).items()}
+    try:
+        from common.get_redis import get_redis
+
+        for key, name in (await get_redis().hgetall(_LOOKUP_NAMES_KEY)).items():
+            names.setdefault(key, name)
+    except Exception as e:
+        print(f"[travel_advisories] Redis lookup names read failed: {e}")
+    return names
+
+
+async def get_cached_lookups(countries: List[str]) -> Dict[str, CachedTravelAdvisory]:
+    """
+    Unexpired browser lookup results by normalized country name.
+    """
+    if not countries:
+        return {}
+    from common.get_redis import get_redis
+
+    keys = [normalize_country(c) for c in countries]
+    values = await get_redis().mget([f"{_LOOKUP_KEY}:{k}" for k in keys])
+    return {k: CachedTravelAdvisory.model_validate_json(v) for k, v in zip(keys, values) if v}
+
+
+async def cache_lookups(lookups: List[CachedTravelAdvisory]) -> None:
+    """
+    Shares browser lookup results with every session for TRAVEL_ADVISORY_CACHE_TTL_HOURS.
+    """
+    if not lookups:
+        return
+    from common.get_redis import get_redis
+
+    ttl = int(LOOKUP_CACHE_TTL_HOURS * 3600)
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for lookup in lookups:
+            key = normalize_country(lookup.country)
+            pipe.set(f"{_LOOKUP_KEY}:{key}", lookup.model_dump_json(), ex=ttl)
+            pipe.hset(_LOOKUP_NAMES_KEY, key, lookup.country)
+        await pipe.execute()
+
+
+async def advisories_for_text(text: str) -> Tuple[List[TravelAdvisory], List[CachedTravelAdvisory], List[str]]:
+    """
+    What is known about the countries mentioned in `text`:
+    fresh index entries, cached browser lookups (for countries stale or missing in the index),
+    and the names of the countries known by neither (left to the browser fallback).
+    """
+    index = await load_advisory_index()
+    names = await known_country_names()
+    fresh: List[TravelAdvisory] = []
+    unresolved: List[str] = []
+    for key in find_countries(text, names):
+        advisory = index.get(key)
+        if advisory is not None and not is_stale(advisory):
+            fresh.append(advisory)
+        else:
+            unresolved.append(names[key])
+
+    cached: List[CachedTravelAdvisory] = []
+    if unresolved:
+        try:
+            found = await get_cached_lookups(unresolved)
+        except Exception as e:
+            print(f"[travel_advisories] Redis lookup cache read failed: {e}")
+            found = {}
+        cached = list(found.values())
+        unresolved = [name for name in unresolved if normalize_country(name) not in found]
+    return fresh, cached, unresolved
+
+
+def format_advisories_for_critic(
+    advisories: List[TravelAdvisory],
+    cached: Optional[List[CachedTravelAdvisory]] = None,
+) -> str:
+    entries = [
+        {
+            "country": a.country,
+            "advisory": f"Level {a.level}: {a.level_label}",
+            "summary": a.summary,
+            "source_updated_at": a.source_updated_at,
+            "url": a.url,
+        }
+        for a in advisories
+    ]
+    entries += [
+        {
+            "country": c.country,
+            "advisory": c.level,
+            "summary": c.advises,
+            "looked_up_at": c.looked_up_at,
+            "url": c.url,
+        }
+        for c in cached or []
+    ]
+    return json.dumps(entries, ensure_ascii=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    parse_cmd = commands.add_parser("parse", help="Parse a saved advisories page and print the entries as JSON")
+    parse_cmd.add_argument("html_file")
+    refresh_cmd = commands.add_parser("refresh", help="Refresh the index in Redis")
+    refresh_cmd.add_argument("--html", help="Saved page to ingest instead of fetching it")
+    refresh_cmd.add_argument("--url", default=ADVISORIES_URL)
+    refresh_cmd.add_argument("--file", help="Also write the index to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        with open(args.html_file, encoding="utf-8") as f:
+            advisories = parse_advisories_html(f.read())
+        print(json.dumps([a.model_dump() for a in advisories], ensure_ascii=False, indent=1))
+        print(f"{len(advisories)} countries parsed")
+        return
+
+    global INDEX_PATH
+    INDEX_PATH = args.file or INDEX_PATH
+    html = None
+    if args.html:
+        with open(args.html, encoding="utf-8") as f:
+            html = f.read()
+    asyncio.run(refresh_advisory_index(args.url, html))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 # workflow_poi_self_improving.py
+import asyncio
 from datetime import timedelta
 from typing import Dict, Any, List, Optional
 import json
 from dotenv import load_dotenv
 import os
 from temporalio import workflow
+from temporalio.common import RetryPolicy
 from temporalio.exceptions import ActivityError
 from pydantic import BaseModel
 
@@ -14,6 +16,7 @@ load_dotenv()
 with workflow.unsafe.imports_passed_through():
     from pois.pois_self_improving_activities import (
         initial_chat_activity,
+        summarize_chat_history_activity,
         propose_poi_query_activity,
         google_places_activity_with_params,
         review_poi_results_activity,
@@ -22,19 +25,63 @@ with workflow.unsafe.imports_passed_through():
         critize_user_itinerary_activity,
         travel_advisory_lookup_activity,
         generate_update_title_activity,
+        get_session_usage_activity,
+        plan_poi_routes_activity,
     )
     from pois.poi_models import (
         QueryPOIParams, DestinationPOI, POIReview, POISummaryInput, POIReviewInput, ChatConversationResult, ClientLiEvent,
-        ChatMessageHistory, ChatConversationRequest,
+        ChatMessageHistory, ChatConversationRequest, ChatHistorySummaryRequest,
           CritiqueFeedbackMessage, 
           CritiqueItineraryContext, 
           CritiqueItineraryRequest,
           CritiqueItineraryResult,
           CritiqueItineraryWebLookupResult,
           CritiqueItineraryToolParams,
-          GenerateUpdateTitleRequest
+          GenerateUpdateTitleRequest,
+          RoutePlan,
+          RoutePlanRequest,
+          SessionUsageSummary,
     )
     from pois.tools.google_places_tool import DestinationPOI
+    from pois.critique_context import compact_critique_history
+    from pois.poi_dedupe import dedupe_pois
+    from pois.task_queues import IO_TASK_QUEUE, LLM_TASK_QUEUE, BROWSER_TASK_QUEUE, CPU_TASK_QUEUE
+    from pois.workflow_stubs import WORKFLOW_NAME, USER_REPLY_SIGNAL, USAGE_QUERY
+
+
+# Chat turns always sent verbatim to the chat agent; older turns are folded into the
+# running summary, in batches so the summarizer doesn't run on every turn
+CHAT_HISTORY_VERBATIM_TURNS = 8
+CHAT_HISTORY_FOLD_BATCH = 4
+CHAT_HISTORY_FOLD_PATCH = "fold-chat-history"
+SESSION_USAGE_PATCH = "refresh-session-usage"
+ROUTE_PLAN_PATCH = "plan-poi-routes"
+
+
+def _advisory_lookup_text(result: Any) -> str:
+    """
+    Lookup activity result as kept in the critique history. The activity returned the combined
+    text before lookups were split per country, and those results are still in the histories
+    of workflows started earlier, so both shapes are read.
+    """
+    if isinstance(result, str):
+        return result
+    return CritiqueItineraryWebLookupResult.model_validate(result).model_dump_json()
+
+
+def _route_stops(pois: List[DestinationPOI], route_plan: Optional[RoutePlan]) -> List[tuple]:
+    """
+    (poi, day, stop number) in walking order; POIs missing from the plan come last without a day.
+    """
+    if route_plan is None:
+        return [(poi, None, None) for poi in pois]
+    by_id = {poi.id: poi for poi in pois}
+    stops = []
+    for day in route_plan.days:
+        for order, poi_id in enumerate(day.poi_ids, start=1):
+            if poi_id in by_id:
+                stops.append((by_id.pop(poi_id), day.day, order))
+    return stops + [(poi, None, None) for poi in pois if poi.id in by_id]
 
 
 class SelfImprovingDestinationWorkflowContext(BaseModel):
@@ -42,8 +89,13 @@ class SelfImprovingDestinationWorkflowContext(BaseModel):
     user_language: Optional[str] = None
     main_chat_history: list[ChatMessageHistory] = []
     itinerary_critique_history: list[CritiqueItineraryContext] = []
+    # Running summary of main_chat_history[:chat_history_summarized_count]
+    chat_history_summary: Optional[str] = None
+    chat_history_summarized_count: int = 0
+    # Token/cost/latency totals of the session, refreshed from the usage ledger while idle
+    usage: SessionUsageSummary = SessionUsageSummary()
 
-@workflow.defn
+@workflow.defn(name=WORKFLOW_NAME)
 class SelfImprovingDestinationWorkflow:
     """
     Self-improving POI search:
@@ -59,11 +111,18 @@ class SelfImprovingDestinationWorkflow:
         # for future interactive mode
         self._pending_user_reply: str | None = None
         self.context = SelfImprovingDestinationWorkflowContext()
+        # Set once a turn ran model activities, the usage totals are reloaded after it
+        self._usage_stale = False
+        self._usage_refresh: Optional[asyncio.Task] = None
 
 
-    @workflow.signal
+    @workflow.signal(name=USER_REPLY_SIGNAL)
     async def user_reply(self, message: str) -> None:
         self._pending_user_reply = message
+
+    @workflow.query(name=USAGE_QUERY)
+    def usage_summary(self) -> SessionUsageSummary:
+        return self.context.usage
         
 
     @workflow.run
@@ -91,16 +150,20 @@ class SelfImprovingDestinationWorkflow:
                          post-itinerary mode (continues looping).
         """
         while(True):
+            self._start_usage_refresh()
             await workflow.wait_condition(lambda: self._pending_user_reply is not None)
             self.context.main_chat_history.append(ChatMessageHistory(source="user", message=self._pending_user_reply))
             print("waiting for user reply")
+            await self._fold_chat_history()
             result: ChatConversationResult = await workflow.execute_activity(
                 initial_chat_activity,
                 ChatConversationRequest(
                     message= self._pending_user_reply if self._pending_user_reply is not None else "",
-                    history = self.context.main_chat_history
-                ), start_to_close_timeout = timedelta(minutes=2)
+                    history = self._recent_chat_history(),
+                    history_summary = self.context.chat_history_summary
+                ), start_to_close_timeout = timedelta(minutes=2), task_queue=LLM_TASK_QUEUE
             )
+            self._usage_stale = True
             self.context.main_chat_history.append(ChatMessageHistory(source="Lorenzo", message= result.response))
             await self._send_user_message("message", result.response, is_final=result.user_itinerary_request_summary is None)
             if result.user_language is not None:
@@ -121,6 +184,7 @@ class SelfImprovingDestinationWorkflow:
                                 source="critique"
                             )
                         )
+                        await self._fold_chat_history()
                         warning_message = await workflow.execute_activity(
                              initial_chat_activity,
                              ChatConversationRequest(
@@ -129,8 +193,9 @@ class SelfImprovingDestinationWorkflow:
                                         current_itinerary = result.user_itinerary_request_summary,
                                         critique_feedback = critique_result.feedback  
                                     ),
-                                    history = self.context.main_chat_history
-                            ), start_to_close_timeout = timedelta(minutes=2)
+                                    history = self._recent_chat_history(),
+                                    history_summary = self.context.chat_history_summary
+                            ), start_to_close_timeout = timedelta(minutes=2), task_queue=LLM_TASK_QUEUE
                         )
                         self._pending_user_reply = None
                         # Warnings might still require additional information, in which case the summary will be null
@@ -152,6 +217,7 @@ class SelfImprovingDestinationWorkflow:
                                 source="critique"
                             )
                         )
+                        await self._fold_chat_history()
                         refine_message = await workflow.execute_activity(
                              initial_chat_activity,
                              ChatConversationRequest(
@@ -160,8 +226,9 @@ class SelfImprovingDestinationWorkflow:
                                         current_itinerary = current_itinerary,
                                         critique_feedback = critique_result.feedback  
                                     ),
-                                    history = self.context.main_chat_history
-                            ), start_to_close_timeout = timedelta(minutes=2)
+                                    history = self._recent_chat_history(),
+                                    history_summary = self.context.chat_history_summary
+                            ), start_to_close_timeout = timedelta(minutes=2), task_queue=LLM_TASK_QUEUE
                         )
                         self.context.main_chat_history.append(
                             ChatMessageHistory(source="Lorenzo", message=refine_message.response)
@@ -173,6 +240,67 @@ class SelfImprovingDestinationWorkflow:
 
 
 
+    def _start_usage_refresh(self) -> None:
+        """
+        Reloads the session usage totals in the background after turns that ran model
+        activities, so the refresh never delays handling the next user reply.
+        """
+        if not self._usage_stale or (self._usage_refresh is not None and not self._usage_refresh.done()):
+            return
+        # Histories recorded before the usage activity existed replay without it
+        if not workflow.patched(SESSION_USAGE_PATCH):
+            return
+        self._usage_stale = False
+        self._usage_refresh = asyncio.create_task(self._refresh_usage())
+
+    async def _refresh_usage(self) -> None:
+        try:
+            self.context.usage = await workflow.execute_activity(
+                get_session_usage_activity,
+                self.context.user_session_id,
+                start_to_close_timeout=timedelta(seconds=30),
+                task_queue=IO_TASK_QUEUE,
+                # Stale totals are fine, never hold the chat on the ledger
+                retry_policy=RetryPolicy(maximum_attempts=2),
+            )
+        except ActivityError as e:
+            workflow.logger.warning("Failed to refresh session usage: %s", e)
+
+    def _recent_chat_history(self) -> list[ChatMessageHistory]:
+        return self.context.main_chat_history[self.context.chat_history_summarized_count:]
+
+    async def _fold_chat_history(self) -> None:
+        """
+        Folds the turns older than the last CHAT_HISTORY_VERBATIM_TURNS into the running
+        summary, so the chat prompt stops growing with the conversation length.
+        """
+        recent = self._recent_chat_history()
+        if len(recent) < CHAT_HISTORY_VERBATIM_TURNS + CHAT_HISTORY_FOLD_BATCH:
+            return
+        # Histories recorded before the summarize activity existed replay without it
+        if not workflow.patched(CHAT_HISTORY_FOLD_PATCH):
+            return
+        to_fold = recent[:len(recent) - CHAT_HISTORY_VERBATIM_TURNS]
+        self.context.chat_history_summary = await workflow.execute_activity(
+            summarize_chat_history_activity,
+            ChatHistorySummaryRequest(
+                previous_summary=self.context.chat_history_summary,
+                messages=to_fold,
+            ),
+            start_to_close_timeout=timedelta(minutes=2),
+            task_queue=LLM_TASK_QUEUE,
+        )
+        self.context.chat_history_summarized_count += len(to_fold)
+
+    def _record_critique(self, entry: CritiqueItineraryContext) -> None:
+        """
+        Keeps the critique history folded into one entry (latest itinerary, last decision, one
+        advisory per country), so it doesn't grow with every refine cycle.
+        """
+        self.context.itinerary_critique_history = compact_critique_history(
+            self.context.itinerary_critique_history + [entry]
+        )
+
     async def _critique_initial_itinerary(self, itinerary_summary: str) -> CritiqueItineraryResult:
         print(f"Calling critique for summary: \n{itinerary_summary}")
         while(True):
@@ -181,9 +309,9 @@ class SelfImprovingDestinationWorkflow:
                 CritiqueItineraryRequest(
                     itinerary = itinerary_summary,
                     context = self.context.itinerary_critique_history
-                ),  start_to_close_timeout = timedelta(minutes=2)                
+                ),  start_to_close_timeout = timedelta(minutes=2), task_queue=LLM_TASK_QUEUE                
             )
-            self.context.itinerary_critique_history.append(
+            self._record_critique(
                 CritiqueItineraryContext(
                     itinerary = itinerary_summary,
                     decision= critique_result.decision,
@@ -194,17 +322,22 @@ class SelfImprovingDestinationWorkflow:
             if critique_result.decision.lower().strip() == "use_tool" and critique_result.tool_params is not None:
                 print(f"Executing web search, params {json.dumps(critique_result.model_dump())}")
                 try:
-                    web_lookup_results: str = await workflow.execute_activity(
+                    # One browser task per country, each with its own timeout inside the activity.
+                    # Decoded untyped: older histories hold a str result (see _advisory_lookup_text)
+                    web_lookup_results = await workflow.execute_activity(
                         travel_advisory_lookup_activity,
                         critique_result.tool_params,
-                         start_to_close_timeout = timedelta(minutes=2)
+                         start_to_close_timeout = timedelta(minutes=5), task_queue=BROWSER_TASK_QUEUE,
+                         # The activity heartbeats while browsing, a stuck browser fails it early
+                         heartbeat_timeout = timedelta(seconds=60),
+                         result_type=Any,
                     )
-                    self.context.itinerary_critique_history.append(
+                    self._record_critique(
                         CritiqueItineraryContext(
                             itinerary =  itinerary_summary,
                             decision = "",
                             feedback = None,
-                            travel_advise=web_lookup_results
+                            travel_advise=_advisory_lookup_text(web_lookup_results)
                         )
                     )
                 except Exception as e:
@@ -228,6 +361,7 @@ class SelfImprovingDestinationWorkflow:
             propose_poi_query_activity,
             user_request,
             start_to_close_timeout=timedelta(minutes=2),
+            task_queue=LLM_TASK_QUEUE,
         )
         
         log.info("[POI] Initial params: %s", params)
@@ -252,9 +386,10 @@ class SelfImprovingDestinationWorkflow:
                     google_places_activity_with_params,
                     params,
                     start_to_close_timeout=timedelta(minutes=2),
+                    task_queue=IO_TASK_QUEUE,
                 )
                 
-                last_pois = list({p.id: p for p in last_pois + pois}.values())
+                last_pois = dedupe_pois(last_pois + pois)
                 
             except ActivityError as e:
                 last_error = f"[POI] Error calling Google Places: {e}"
@@ -273,8 +408,10 @@ class SelfImprovingDestinationWorkflow:
                     pois_selected_so_far=total_selected_pois,
                     previous_reviews=last_reviews,
                     last_error=last_error,
+                    attempt=attempt,
                 ),
                 start_to_close_timeout=timedelta(minutes=3),
+                task_queue=LLM_TASK_QUEUE,
             )
             
             decision = review.decision
@@ -283,7 +420,7 @@ class SelfImprovingDestinationWorkflow:
                 # Done
                 if review.selected_pois is not None:
                     last_pois = review.selected_pois
-                total_selected_pois = list({p.id: p for p in total_selected_pois + last_pois}.values())
+                total_selected_pois = dedupe_pois(total_selected_pois + last_pois)
                 break
             
             # Generate dynamic title for the update message
@@ -291,9 +428,11 @@ class SelfImprovingDestinationWorkflow:
                 generate_update_title_activity,
                 GenerateUpdateTitleRequest(
                     content = review.reason,
-                    user_language = self.context.user_language
+                    user_language = self.context.user_language,
+                    refine_attempt = attempt,
                 ),
                 start_to_close_timeout=timedelta(minutes=2),
+                task_queue=LLM_TASK_QUEUE,
             )
             
             await self._send_user_message(
@@ -312,19 +451,26 @@ class SelfImprovingDestinationWorkflow:
             params = new_params
             if selected_pois is not None:
                 last_pois = selected_pois
-            total_selected_pois = list({p.id: p for p in total_selected_pois + last_pois}.values())
+            total_selected_pois = dedupe_pois(total_selected_pois + last_pois)
         
+        # Days and walking order, followed by the summary and the map
+        route_plan = await self._plan_routes(total_selected_pois, user_request)
+        stops = _route_stops(total_selected_pois, route_plan)
+        total_selected_pois = [poi for poi, _, _ in stops]
+
         # Summarization
         summary_input = POISummaryInput(
             user_language=self.context.user_language or "",
             user_request=user_request,
             pois=total_selected_pois,
+            route_plan=route_plan,
         )
         
         summary = await workflow.execute_activity(
             summarize_pois_activity,
             summary_input,
             start_to_close_timeout=timedelta(minutes=2),
+            task_queue=LLM_TASK_QUEUE,
         )
         
         # Send the full summary to the user
@@ -338,13 +484,39 @@ class SelfImprovingDestinationWorkflow:
         )
         
         # Send POI data for map display
-        poi_data = [poi.model_dump() for poi in total_selected_pois]
+        poi_data = [
+            {**poi.model_dump(), "day": day, "order": order} if day is not None else poi.model_dump()
+            for poi, day, order in stops
+        ]
         await self._send_pois(
             is_final=True,
             poi_data=poi_data
         )
+        self._usage_stale = True
         self._pending_user_reply = None
 
+    async def _plan_routes(self, pois: List[DestinationPOI], user_request: str) -> Optional[RoutePlan]:
+        """
+        Day by day route of the selected POIs, the trip length is read from the itinerary.
+        A failed plan only costs the ordering: the POIs are summarized and mapped unordered.
+        """
+        if not pois:
+            return None
+        # Histories recorded before route planning existed replay with the POIs unordered
+        if not workflow.patched(ROUTE_PLAN_PATCH):
+            return None
+        try:
+            return await workflow.execute_activity(
+                plan_poi_routes_activity,
+                RoutePlanRequest(pois=pois, trip_description=user_request),
+                start_to_close_timeout=timedelta(seconds=30),
+                task_queue=CPU_TASK_QUEUE,
+                retry_policy=RetryPolicy(maximum_attempts=2),
+            )
+        except ActivityError as e:
+            workflow.logger.warning("[POI] Route planning failed: %s", e)
+            return None
+
     async def _send_user_message(
         self, 
         type: str, 
@@ -362,6 +534,7 @@ class SelfImprovingDestinationWorkflow:
                     title=title,
                 ),
                 start_to_close_timeout=timedelta(minutes=2),
+                task_queue=IO_TASK_QUEUE,
             )
 
 
@@ -379,6 +552,7 @@ class SelfImprovingDestinationWorkflow:
                 publish_clientli_message_activity,
                 event,
                 start_to_close_timeout=timedelta(minutes=2),
+                task_queue=IO_TASK_QUEUE,
             )
 
 
@@ -0,0 +1,7 @@
+# Thin handles to SelfImprovingDestinationWorkflow for processes that only start and
+# signal it (the Chainlit server). Keep this module import-free: loading the workflow
+# definition pulls in activities, agents and the browser stack.
+
+WORKFLOW_NAME = "SelfImprovingDestinationWorkflow"
+USER_REPLY_SIGNAL = "user_reply"
+USAGE_QUERY = "usage_summary"
@@ -0,0 +1,59 @@
+# workflow_travel_advisories.py
+from datetime import timedelta
+import os
+
+from temporalio import workflow
+from temporalio.client import Client
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, WorkflowAlreadyStartedError
+
+with workflow.unsafe.imports_passed_through():
+    from pois.pois_self_improving_activities import refresh_travel_advisories_activity
+    from pois.task_queues import IO_TASK_QUEUE, WORKFLOW_TASK_QUEUE
+
+
+ADVISORY_INGESTION_WORKFLOW_ID = "travel-advisory-ingestion"
+# Refreshes per run before continuing as new, keeps the event history short
+_REFRESHES_PER_RUN = 50
+
+
+@workflow.defn(name="TravelAdvisoryIngestionWorkflow")
+class TravelAdvisoryIngestionWorkflow:
+    """
+    Periodically re-ingests the travel advisories page into the offline index read by the
+    itinerary critique. A failed refresh keeps the previous index, it is retried on the next tick.
+    """
+
+    @workflow.run
+    async def run(self, interval_hours: float = 12) -> None:
+        for _ in range(_REFRESHES_PER_RUN):
+            try:
+                count = await workflow.execute_activity(
+                    refresh_travel_advisories_activity,
+                    start_to_close_timeout=timedelta(minutes=5),
+                    task_queue=IO_TASK_QUEUE,
+                    retry_policy=RetryPolicy(maximum_attempts=3, initial_interval=timedelta(seconds=30)),
+                )
+                workflow.logger.info("Travel advisory index refreshed: %s countries", count)
+            except ActivityError as e:
+                workflow.logger.warning("Travel advisory refresh failed: %s", e)
+            await workflow.sleep(timedelta(hours=interval_hours))
+        workflow.continue_as_new(interval_hours)
+
+
+async def ensure_advisory_ingestion(client: Client) -> None:
+    """
+    Starts the ingestion workflow unless it is already running (one per Temporal namespace).
+    """
+    if os.getenv("TRAVEL_ADVISORY_INGESTION_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return
+    try:
+        await client.start_workflow(
+            TravelAdvisoryIngestionWorkflow.run,
+            float(os.getenv("TRAVEL_ADVISORY_REFRESH_HOURS", "12")),
+            id=ADVISORY_INGESTION_WORKFLOW_ID,
+            task_queue=WORKFLOW_TASK_QUEUE,
+        )
+        print("[travel_advisories] Ingestion workflow started")
+    except WorkflowAlreadyStartedError:
+        pass
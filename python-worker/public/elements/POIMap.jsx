@@ -3,6 +3,8 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { MapPin, Star } from 'lucide-react';
 
+const ROUTE_COLORS = ['#1a73e8', '#d93025', '#188038', '#f9ab00', '#9334e6', '#e8710a', '#12b5cb', '#c5221f'];
+
 export default function POIMap() {
     const mapRef = useRef(null);
     const [loading, setLoading] = useState(true);
@@ -71,7 +73,8 @@ export default function POIMap() {
                         map: map,
                         title: poi.name,
                         label: {
-                            text: String(index + 1),
+                            // Planned POIs carry their route day and stop number: "2.3" is day 2, third stop
+                            text: poi.day ? `${poi.day}.${poi.order}` : String(index + 1),
                             color: 'white',
                             fontWeight: 'bold',
                             fontSize: '14px'
@@ -115,6 +118,27 @@ export default function POIMap() {
                     });
                 });
 
+                // One walking path per route day, POIs arrive in visiting order
+                const days = {};
+                pois.forEach((poi) => {
+                    if (poi.day) {
+                        (days[poi.day] = days[poi.day] || []).push(poi);
+                    }
+                });
+                Object.keys(days).forEach((day) => {
+                    const path = days[day]
+                        .sort((a, b) => a.order - b.order)
+                        .map((poi) => ({ lat: poi.lat, lng: poi.lng }));
+                    new window.google.maps.Polyline({
+                        path: path,
+                        map: map,
+                        geodesic: true,
+                        strokeColor: ROUTE_COLORS[(Number(day) - 1) % ROUTE_COLORS.length],
+                        strokeOpacity: 0.8,
+                        strokeWeight: 4
+                    });
+                });
+
                 // Fit map to show all markers with padding
                 if (pois.length > 1) {
                     map.fitBounds(bounds, {
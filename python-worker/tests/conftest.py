@@ -0,0 +1,33 @@
+from typing import Optional
+
+import pytest
+
+from pois.tools.google_places_tool import DestinationPOI
+
+
+def make_poi(
+    id: str,
+    lat: float,
+    lng: float,
+    name: Optional[str] = None,
+    category: str = "tourist_attraction",
+    rating: Optional[float] = 4.5,
+    user_ratings_total: Optional[int] = 100,
+    **fields,
+) -> DestinationPOI:
+    return DestinationPOI(
+        id=id,
+        name=name or id,
+        address=fields.pop("address", "Paris, France"),
+        category=category,
+        rating=rating,
+        user_ratings_total=user_ratings_total,
+        lat=lat,
+        lng=lng,
+        **fields,
+    )
+
+
+@pytest.fixture
+def poi():
+    return make_poi
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pois.distance_matrix import DistanceMatrix, GreatCircleProvider, haversine_km
+
+
+def _grid(poi, start, count):
+    return [poi(f"p{i}", 48.85 + 0.001 * (i % 20), 2.33 + 0.001 * (i // 20)) for i in range(start, start + count)]
+
+
+def _expected(pois):
+    lat = np.array([p.lat for p in pois])
+    lng = np.array([p.lng for p in pois])
+    return haversine_km(lat, lng, lat, lng)
+
+
+def test_rows_are_extended_with_new_places(poi):
+    matrix = DistanceMatrix(GreatCircleProvider())
+    first = _grid(poi, 0, 5)
+    matrix.matrix(first)
+    both = first + _grid(poi, 5, 5)
+    assert np.allclose(matrix.matrix(both), _expected(both))
+    metrics = matrix.metrics()
+    assert metrics["hits"] == 5 and metrics["extended"] == 5 and metrics["places"] == 10
+
+
+def test_concurrent_calls_with_eviction_and_resets(poi):
+    # Small enough that calls evict each other's rows and reset the columns
+    matrix = DistanceMatrix(GreatCircleProvider(), max_rows=30, max_places=60)
+    batches = [_grid(poi, 7 * k % 50, 25) for k in range(40)]
+
+    def _check(pois):
+        assert np.allclose(matrix.matrix(pois), _expected(pois))
+        matrix.metrics()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(5):
+            list(pool.map(_check, batches))
+    assert matrix.metrics()["evicted"] > 0
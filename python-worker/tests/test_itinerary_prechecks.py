@@ -0,0 +1,147 @@
+from datetime import date
+
+import pytest
+
+from pois import itinerary_prechecks
+from pois.itinerary_prechecks import (
+    extract_dates,
+    extract_durations,
+    precheck_decision,
+    run_itinerary_prechecks,
+    trip_duration_days,
+)
+from pois.poi_models import TravelAdvisory
+from pois.route_planner import _day_count
+
+TODAY = date(2026, 1, 10)
+
+
+def _advisory(country: str, level: int = 2) -> TravelAdvisory:
+    return TravelAdvisory(
+        country=country,
+        level=level,
+        level_label="Exercise Increased Caution",
+        summary=f"Level {level}",
+        fetched_at="2026-01-10T00:00:00+00:00",
+    )
+
+
+def _check(itinerary: str, *countries: str, level: int = 2):
+    return run_itinerary_prechecks(itinerary, [_advisory(c, level) for c in countries], [], [], today=TODAY)
+
+
+@pytest.mark.parametrize(
+    "text, durations",
+    [
+        ("4 nights in Tokyo", [4]),
+        ("a 2-week trip to Japan", [14]),
+        ("honeymoon in Bali for two weeks", [14]),
+        ("3 months in Spain then 2 weeks in Portugal", [90, 14]),
+        ("staying about 3 weeks", [21]),
+        # Not trip lengths
+        ("celebrating our 25-year anniversary in Paris", []),
+        ("with our kids, 9 years old and 12 years old", []),
+        ("with a 6-month-old baby", []),
+        ("we got married 2 months ago", []),
+        ("I have been learning Italian, 3 months of lessons", []),
+        # Implausible trip lengths are left to the critic
+        ("500 days in Peru", []),
+    ],
+)
+def test_extract_durations(text, durations):
+    assert extract_durations(text) == durations
+
+
+@pytest.mark.parametrize(
+    "text, dates",
+    [
+        ("Lisbon May 3-10", [date(2026, 5, 3), date(2026, 5, 10)]),
+        ("from 3rd of March 2026", [date(2026, 3, 3)]),
+        ("2026-07-01 to 2026-07-14", [date(2026, 7, 1), date(2026, 7, 14)]),
+        # Past dates without a year are next year's
+        ("January 5", [date(2027, 1, 5)]),
+    ],
+)
+def test_extract_dates(text, dates):
+    assert extract_dates(text, today=TODAY) == dates
+
+
+def test_trip_duration_prefers_the_date_range():
+    assert trip_duration_days("Two weeks in Portugal, June 1 to June 10", today=TODAY) == 10
+
+
+def test_trip_duration_ignores_ages_and_anniversaries():
+    assert trip_duration_days("Couple celebrating our 25-year anniversary, son is 9 years old", today=TODAY) is None
+
+
+@pytest.mark.parametrize(
+    "itinerary",
+    [
+        "Solo traveler going to Rome, Italy in May",
+        "Solo traveler going to Rome, Italy in early May",
+        "Solo traveler going to Rome, Italy, May 3",
+        "Solo traveler going to Rome, Italy, May 2026",
+        "Solo traveler going to Rome, Italy in spring",
+        "Solo traveler, a week in Rome, Italy",
+    ],
+)
+def test_timing_is_found(itinerary):
+    assert "trip dates or approximate duration" not in _check(itinerary, "Italy").missing
+
+
+def test_may_as_a_verb_is_not_a_date():
+    check = _check("Solo traveler, we may go to Rome, Italy", "Italy")
+    assert "trip dates or approximate duration" in check.missing
+
+
+@pytest.mark.parametrize(
+    "itinerary, companions_missing",
+    [
+        ("Going to Rome, Italy in May with my wife", False),
+        ("Family trip to Rome, Italy in May", False),
+        ("Going to Rome, Italy in May", True),
+        ("Going to Rome, Italy in May. Companions: unknown", True),
+    ],
+)
+def test_companions(itinerary, companions_missing):
+    assert ("travel companions" in _check(itinerary, "Italy").missing) is companions_missing
+
+
+def test_missing_information_goes_to_the_critic_by_default():
+    check = _check("Going to Rome, Italy", "Italy")
+    assert check.missing == ["trip dates or approximate duration", "travel companions"]
+    assert precheck_decision(check) is None
+
+
+def test_missing_information_refines_when_enabled(monkeypatch):
+    monkeypatch.setattr(itinerary_prechecks, "REFINE_MISSING", True)
+    decision = precheck_decision(_check("Going to Rome, Italy", "Italy"))
+    assert decision is not None and decision.decision == "refine"
+    assert "travel companions" in decision.feedback
+
+
+def test_long_stay_in_one_country_refines():
+    check = _check("Solo, 4 months in Spain from March", "Spain")
+    assert check.stay_days == {"Spain": 120}
+    assert precheck_decision(check).decision == "refine"
+
+
+def test_anniversary_and_ages_do_not_refine():
+    check = _check(
+        "Couple celebrating our 25-year anniversary with our 9 years old son, 10 days in France in June", "France"
+    )
+    assert check.duration_days == 10
+    assert check.stay_days == {"France": 10}
+    assert precheck_decision(check) is None
+
+
+def test_level_4_refines():
+    decision = precheck_decision(_check("Solo, 5 days in Burma in May", "Burma", level=4))
+    assert decision.decision == "refine"
+    assert "Do Not Travel" in decision.feedback
+
+
+def test_route_planner_day_count_ignores_ages():
+    # 12 stops, 5 per day when the trip length is unknown
+    assert _day_count(12, None, "Family trip to Rome, our daughter is 9 years old") == 3
+    assert _day_count(12, None, "4 nights in Rome") == 4
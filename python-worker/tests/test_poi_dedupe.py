@@ -0,0 +1,84 @@
+import pytest
+
+from pois.poi_dedupe import dedupe_pois, name_similarity, same_place
+
+LOUVRE = (48.8606, 2.3376)
+PYRAMID = (48.8610, 2.3358)
+
+
+def _louvre_listings(poi):
+    return [
+        poi("louvre", *LOUVRE, name="Louvre Museum", category="museum", user_ratings_total=250000),
+        poi(
+            "musee",
+            LOUVRE[0] + 0.0002,
+            LOUVRE[1] - 0.0003,
+            name="Musée du Louvre",
+            category="museum",
+            user_ratings_total=1200,
+            description="Former royal palace, home of the Mona Lisa",
+        ),
+        poi("pyramid", *PYRAMID, name="Musée du Louvre - Pyramid", category="tourist_attraction", user_ratings_total=300),
+    ]
+
+
+def test_louvre_variants_merge(poi):
+    merged = dedupe_pois(_louvre_listings(poi))
+    assert len(merged) == 1
+    louvre = merged[0]
+    # The most rated listing is kept, missing fields come from the others
+    assert louvre.id == "louvre"
+    assert louvre.description == "Former royal palace, home of the Mona Lisa"
+
+
+def test_nearby_cafe_is_not_merged(poi):
+    cafe = poi("cafe", LOUVRE[0] + 0.0003, LOUVRE[1], name="Café du Louvre", category="cafe")
+    merged = dedupe_pois(_louvre_listings(poi) + [cafe])
+    assert [p.id for p in merged] == ["louvre", "cafe"]
+
+
+def test_venue_named_after_a_landmark_is_another_place(poi):
+    museum = poi("museum", *LOUVRE, name="Louvre Museum", category="museum")
+    restaurant = poi("restaurant", *LOUVRE, name="Louvre Restaurant", category="tourist_attraction")
+    assert not same_place(museum, restaurant, 150, 0.7)
+
+
+def test_same_name_far_apart_is_not_merged(poi):
+    a = poi("a", 48.8530, 2.3499, name="Saint-Pierre Church", category="church")
+    b = poi("b", 48.8867, 2.3431, name="Saint-Pierre Church", category="church")
+    assert len(dedupe_pois([a, b])) == 2
+
+
+def test_different_places_next_to_each_other_are_kept(poi):
+    a = poi("a", *LOUVRE, name="Louvre Museum", category="museum")
+    b = poi("b", LOUVRE[0] + 0.0005, LOUVRE[1] + 0.0005, name="Palais Royal", category="tourist_attraction")
+    assert len(dedupe_pois([a, b])) == 2
+
+
+def test_duplicate_ids_are_merged_in_first_appearance_order(poi):
+    pois = [
+        poi("x", 48.85, 2.35, name="Sainte-Chapelle"),
+        poi("y", 48.86, 2.29, name="Eiffel Tower"),
+        poi("x", 48.85, 2.35, name="Sainte-Chapelle"),
+    ]
+    assert [p.id for p in dedupe_pois(pois)] == ["x", "y"]
+
+
+def test_merges_across_grid_cells(poi):
+    # Two listings on either side of a cell boundary, about 60 m apart
+    a = poi("a", 48.8600, 2.33995, name="Pont des Arts", category="tourist_attraction")
+    b = poi("b", 48.8600, 2.34075, name="Pont des Arts Bridge", category="tourist_attraction")
+    assert len(dedupe_pois([a, b])) == 1
+
+
+@pytest.mark.parametrize(
+    "a, b, similar",
+    [
+        ("Louvre Museum", "Musée du Louvre", True),
+        ("Colosseum", "Colosseo", True),
+        ("Louvre Museum", "Musée d'Orsay", False),
+        ("Grand Palais", "Petit Palais", False),
+    ],
+)
+def test_name_similarity(a, b, similar):
+    assert (name_similarity(a, b) >= 0.7) is similar
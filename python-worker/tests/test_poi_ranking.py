@@ -0,0 +1,70 @@
+import numpy as np
+
+from pois.poi_ranking import bayesian_ratings, rank_pois, score_pois
+
+# Around the Louvre; a few hundred meters apart
+LAT, LNG = 48.8606, 2.3376
+
+
+def _ids(pois):
+    return [p.id for p in pois]
+
+
+def test_short_lists_are_returned_unchanged(poi):
+    pois = [poi("b", LAT, LNG, rating=3.0), poi("a", LAT, LNG, rating=5.0)]
+    assert rank_pois(pois, top_k=5) is pois
+
+
+def test_bayesian_rating_trusts_many_votes():
+    ratings = bayesian_ratings(np.array([4.9, 4.7, 3.5]), np.array([3.0, 5000.0, 5000.0]), prior_votes=50)
+    assert ratings[1] > ratings[0]
+    # Few votes stay close to the mean rating
+    assert abs(ratings[0] - 4.1) < 0.1
+
+
+def test_well_rated_popular_places_rank_first(poi):
+    pois = [
+        poi("few_votes", LAT, LNG + 0.001, rating=4.9, user_ratings_total=3, category="museum"),
+        poi("popular", LAT + 0.001, LNG, rating=4.7, user_ratings_total=5000, category="park"),
+        poi("poor", LAT - 0.001, LNG, rating=3.2, user_ratings_total=800, category="church"),
+        poi("unrated", LAT, LNG - 0.001, rating=None, user_ratings_total=None, category="viewpoint"),
+    ]
+    assert _ids(rank_pois(pois, top_k=3)) == ["popular", "few_votes", "unrated"]
+
+
+def test_searched_categories_win(poi):
+    pois = [
+        poi("museum", LAT, LNG, category="museum"),
+        poi("shop", LAT + 0.001, LNG, category="store"),
+        poi("park", LAT, LNG + 0.001, category="park"),
+    ]
+    assert _ids(rank_pois(pois, poi_types=["museum", "park"], top_k=2)) == ["museum", "park"]
+
+
+def test_far_away_results_rank_last(poi):
+    pois = [poi(f"near{i}", LAT + i * 0.002, LNG, category=f"c{i}") for i in range(4)]
+    # Same rating and votes, but in Lyon
+    pois.append(poi("lyon", 45.7640, 4.8357, category="c9"))
+    assert sorted(_ids(rank_pois(pois, top_k=4))) == ["near0", "near1", "near2", "near3"]
+
+
+def test_diversity_decay_spreads_categories(poi):
+    pois = [poi(f"museum{i}", LAT + i * 0.001, LNG, category="museum", rating=4.8) for i in range(3)]
+    pois.append(poi("park", LAT, LNG + 0.001, category="park", rating=4.5))
+    scores = score_pois(pois)
+    # The park beats the second and third museum despite a lower rating
+    assert scores[3] > scores[1] and scores[3] > scores[2]
+    assert "park" in _ids(rank_pois(pois, top_k=2))
+
+
+def test_kept_candidates_come_first(poi):
+    pois = [poi(f"p{i}", LAT + i * 0.001, LNG, rating=4.0 + i * 0.1, category=f"c{i}") for i in range(6)]
+    ranked = rank_pois(pois, top_k=3, keep_ids=["p0"])
+    assert ranked[0].id == "p0"
+    assert len(ranked) == 3
+
+
+def test_all_kept_candidates_survive_a_small_top_k(poi):
+    pois = [poi(f"p{i}", LAT + i * 0.001, LNG, category=f"c{i}") for i in range(6)]
+    ranked = rank_pois(pois, top_k=2, keep_ids=["p1", "p3", "p5"])
+    assert sorted(_ids(ranked)) == ["p1", "p3", "p5"]
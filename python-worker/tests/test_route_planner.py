@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+import pytest
+
+from pois.route_planner import _path_length, _two_opt, cluster_days, plan_routes
+
+
+def _clustered_pois(poi):
+    # 8 places around the Louvre, 2 around Montmartre: day capacity must split the big cluster
+    pois = [poi(f"louvre{i}", 48.8606 + 0.001 * (i % 4), 2.3376 + 0.001 * (i // 4)) for i in range(8)]
+    pois += [poi(f"montmartre{i}", 48.8867 + 0.001 * i, 2.3431) for i in range(2)]
+    return pois
+
+
+@pytest.mark.parametrize("n, days", [(10, 2), (10, 3), (7, 7), (13, 4)])
+def test_cluster_days_respects_capacity(n, days):
+    rng = np.random.default_rng(0)
+    # Most points in one spot, so plain k-means would overfill one day
+    points = np.vstack([rng.normal(0, 0.1, (n - 2, 2)), rng.normal(20, 0.1, (2, 2))])
+    labels = cluster_days(points, days)
+    counts = np.bincount(labels, minlength=days)
+    assert counts.max() <= math.ceil(n / days)
+    assert counts.sum() == n
+
+
+def test_days_are_balanced(poi):
+    plan = plan_routes(_clustered_pois(poi), days=2)
+    assert [len(day.poi_ids) for day in plan.days] == [5, 5]
+
+
+def test_every_poi_is_planned_once(poi):
+    pois = _clustered_pois(poi)
+    plan = plan_routes(pois, days=3)
+    planned = [poi_id for day in plan.days for poi_id in day.poi_ids]
+    assert sorted(planned) == sorted(p.id for p in pois)
+    assert [day.day for day in plan.days] == list(range(1, len(plan.days) + 1))
+
+
+def test_plans_are_deterministic(poi):
+    pois = _clustered_pois(poi)
+    assert plan_routes(pois, days=3) == plan_routes(list(pois), days=3)
+
+
+def test_day_count_comes_from_the_trip_description(poi):
+    plan = plan_routes(_clustered_pois(poi), trip_description="Couple, 2 days in Paris, France in May")
+    assert len(plan.days) == 2
+
+
+def test_far_apart_areas_get_separate_days(poi):
+    plan = plan_routes(_clustered_pois(poi), days=3)
+    montmartre_days = {day.day for day in plan.days for poi_id in day.poi_ids if poi_id.startswith("montmartre")}
+    assert len(montmartre_days) == 1
+
+
+def test_two_opt_removes_crossings():
+    # Square corners visited in a crossing order: 0 -> 2 -> 1 -> 3
+    points = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+    dist = np.sqrt(((points[:, None] - points[None, :]) ** 2).sum(axis=2))
+    crossing = np.array([0, 3, 1, 2])
+    improved = _two_opt(crossing, dist)
+    assert _path_length(dist, improved) < _path_length(dist, crossing)
+    assert sorted(improved.tolist()) == [0, 1, 2, 3]
+
+
+def test_empty_selection(poi):
+    assert plan_routes([]).days == []
@@ -0,0 +1,114 @@
+from pathlib import Path
+
+import pytest
+
+from pois.travel_advisories import (
+    country_variants,
+    find_countries,
+    normalize_country,
+    parse_advisories_html,
+)
+
+FIXTURE = Path(__file__).parent / "fixtures" / "travel_advisories.html"
+
+
+@pytest.fixture(scope="module")
+def advisories():
+    parsed = parse_advisories_html(FIXTURE.read_text(encoding="utf-8"))
+    return {normalize_country(a.country): a for a in parsed}
+
+
+def test_parses_every_well_formed_row(advisories):
+    assert sorted(advisories) == [
+        "bahamas",
+        "brazil",
+        "burma myanmar",
+        "congo democratic republic of the",
+        "cote d ivoire",
+        "france",
+        "italy",
+        "japan",
+        "mainland china",
+        "mexico",
+    ]
+
+
+@pytest.mark.parametrize(
+    "key, level, label",
+    [
+        ("japan", 1, "Exercise Normal Precautions"),
+        ("france", 2, "Exercise Increased Caution"),
+        ("congo democratic republic of the", 3, "Reconsider Travel"),
+        ("burma myanmar", 4, "Do Not Travel"),
+        # "Level 2 - ..." separator
+        ("cote d ivoire", 2, "Exercise Increased Caution"),
+        # Bare "Level 2" gets the standard label
+        ("mainland china", 2, "Exercise Increased Caution"),
+    ],
+)
+def test_levels(advisories, key, level, label):
+    advisory = advisories[key]
+    assert advisory.level == level
+    assert advisory.level_label == label
+    assert advisory.summary.startswith(f"Level {level}: {label}")
+
+
+def test_country_names_drop_the_suffix(advisories):
+    assert advisories["france"].country == "France"
+    assert advisories["cote d ivoire"].country == "Côte d'Ivoire"
+    assert advisories["mainland china"].country == "Mainland China"
+
+
+def test_urls_and_dates(advisories):
+    france = advisories["france"]
+    assert france.url == (
+        "https://travel.state.gov/content/travel/en/traveladvisories/traveladvisories/france-travel-advisory.html"
+    )
+    assert france.source_updated_at == "2024-06-25"
+    assert advisories["cote d ivoire"].source_updated_at == "2024-05-14"
+
+
+def test_extra_columns_go_to_the_summary(advisories):
+    mexico = advisories["mexico"]
+    assert mexico.source_updated_at == "2023-08-22"
+    assert mexico.summary.endswith("Reissued with obsolete COVID-19 page links removed")
+
+
+def test_row_without_link_or_date_is_kept(advisories):
+    brazil = advisories["brazil"]
+    assert brazil.url is None
+    assert brazil.source_updated_at is None
+
+
+@pytest.mark.parametrize("name", ["atlantis", "narnia", "worldwide caution", ""])
+def test_malformed_rows_are_skipped(advisories, name):
+    assert name not in advisories
+
+
+def test_page_without_table_parses_to_nothing():
+    assert parse_advisories_html("<html><body><p>Level 4: Do Not Travel</p></body></html>") == []
+
+
+@pytest.mark.parametrize(
+    "name, normalized",
+    [
+        ("Côte d'Ivoire", "cote d ivoire"),
+        ("The Bahamas", "bahamas"),
+        ("  Bosnia  and Herzegovina ", "bosnia and herzegovina"),
+        ("TÜRKIYE", "turkiye"),
+    ],
+)
+def test_normalize_country(name, normalized):
+    assert normalize_country(name) == normalized
+
+
+def test_country_variants():
+    assert country_variants("Burma (Myanmar)") == ["burma", "myanmar"]
+    assert "democratic republic of the congo" in country_variants("Congo, Democratic Republic of the")
+    assert "china" in country_variants("Mainland China")
+
+
+def test_find_countries_uses_variants_and_aliases(advisories):
+    names = {key: advisory.country for key, advisory in advisories.items()}
+    found = find_countries("Two weeks in Myanmar, then Ivory Coast and the Bahamas; maybe China", names)
+    assert found == ["burma myanmar", "cote d ivoire", "bahamas", "mainland china"]